@@ -1,11 +1,16 @@
 import platform as platform
+import sys
 from datetime import datetime
 import pandas as pd
 import colorama as color_terminal
 
+from testrunner.daemon import TestDaemon, submit_job
 from testrunner.image_analysis import *
+from testrunner.noise_model import *
 from testrunner.performance_analysis import *
 from testrunner.render_tasks import *
+from testrunner.report import generate_report
+from testrunner.retention import compact_results
 from testrunner.utils import *
 
 PYDEVD_DISABLE_FILE_VALIDATION=1
@@ -29,7 +34,7 @@ def performance_analysis(execution_parameters: ExecutionParameters) -> None:
     df.to_excel(xls_file, sheet_name='Sheet1', index=False)
     
 
-def image_analysis(execution_parameters: ExecutionParameters) -> None:
+def image_analysis(execution_parameters: ExecutionParameters, pool=None) -> None:
     crop = execution_parameters.program == "redshiftBenchmark"
     references_path = execution_parameters.root_path  / 'references' / execution_parameters.program
     results_path = execution_parameters.root_path / execution_parameters.analysis_path
@@ -41,8 +46,11 @@ def image_analysis(execution_parameters: ExecutionParameters) -> None:
         print_error(f"{results_path} does not exists")
         exit(EXIT_FAILURE)
 
-    analyzer = ImageAnalyzer(references_path, results_path, execution_parameters.treshold, crop)
-    analyzer.analyze()
+    noise_model = NoiseModel(references_path)
+    analyzer = ImageAnalyzer(references_path, results_path, execution_parameters.treshold, crop,
+                             noise_model, execution_parameters.sample_ratio, execution_parameters.noise_sigma,
+                             execution_parameters.memory_budget)
+    analyzer.analyze(pool)
     analysis_log = date_time_with_prefix("custom_analysis")
     mismatch_log = date_time_with_prefix("custom_analysis_mismach")
     analyzer.save(results_path / analysis_log)
@@ -56,16 +64,41 @@ def execute_render_task(execution_parameters: ExecutionParameters) -> Task:
     return task
 
 
-def analyze_task_image_results(task: Task) -> None:
+def analyze_task_image_results(task: Task, pool=None) -> None:
     crop = task.params.program == "redshiftBenchmark"
-    analyzer = ImageAnalyzer(task.reference_path / task.params.program, task.results_path, task.params.treshold, crop)
-    analyzer.analyze()
+    references_path = task.reference_path / task.params.program
+    noise_model = NoiseModel(references_path)
+    analyzer = ImageAnalyzer(references_path, task.results_path, task.params.treshold, crop,
+                             noise_model, task.params.sample_ratio, task.params.noise_sigma, task.params.memory_budget)
+    analyzer.analyze(pool)
     analysis_log = date_time_with_prefix(f'{task.params.program}_ANALYSIS')
     mismatch_log = date_time_with_prefix(f'{task.params.program}_ANALYSIS_MISMACH')
     analyzer.save(task.results_path / analysis_log)
     analyzer.save_mismatch(task.results_path / mismatch_log)
 
 
+# runs the task selected by the parameters, the daemon passes its analysis workers
+def run(execution_parameters: ExecutionParameters, pool=None) -> None:
+    if execution_parameters.compact_results:
+        compact_results(execution_parameters)
+    elif execution_parameters.performance_analysis:
+        performance_analysis(execution_parameters)
+    elif execution_parameters.image_analysis:
+        image_analysis(execution_parameters, pool)
+        if execution_parameters.report:
+            generate_report(execution_parameters, execution_parameters.root_path / execution_parameters.analysis_path)
+    elif execution_parameters.report and execution_parameters.analysis_path:
+        # the report of the results given by --analysis-path, otherwise of the test run below
+        generate_report(execution_parameters, execution_parameters.root_path / execution_parameters.analysis_path)
+    else:
+        task = execute_render_task(execution_parameters)
+        # schedule results analysis for the task that was not a reference generation or a build comparison
+        if not task.params.reference and not task.params.ab:
+            analyze_task_image_results(task, pool)
+            if task.params.report:
+                generate_report(task.params, task.results_path)
+
+
 if __name__ == "__main__":
     color_terminal.init()
     print(f"{Fore.BLUE}Redshift Unit Tests{Style.RESET_ALL}")
@@ -76,7 +109,8 @@ if __name__ == "__main__":
         if not is_valid:
             print_error(f'{reason}')
             exit(EXIT_FAILURE)
-        pprint.pprint(execution_parameters.__dict__, indent=2)
+        if not execution_parameters.daemon_submit:
+            pprint.pprint(execution_parameters.__dict__, indent=2)
     except IOError as io_error:
         print_error(repr(io_error))
         exit(EXIT_FAILURE)
@@ -84,13 +118,11 @@ if __name__ == "__main__":
         print_error(repr(val_error))
         exit(EXIT_FAILURE)
 
-    if execution_parameters.performance_analysis:
-        performance_analysis(execution_parameters)
-    elif execution_parameters.image_analysis:
-        image_analysis(execution_parameters)
+    if execution_parameters.daemon:
+        TestDaemon(execution_parameters, run).serve(execution_parameters.daemon_port)
+    elif execution_parameters.daemon_submit:
+        args = [arg for arg in sys.argv[1:] if arg != '--daemon-submit']
+        exit(submit_job(execution_parameters.root_path, execution_parameters.daemon_port, args))
     else:
-        task = execute_render_task(execution_parameters)
-        # schedule results analysis for the task that was not a reference generation
-        if not task.params.reference:
-            analyze_task_image_results(task)
+        run(execution_parameters)
     print(f"\n{Fore.BLUE}Redshift Unit Tests Finished{Style.RESET_ALL}")
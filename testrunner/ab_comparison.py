@@ -0,0 +1,124 @@
+import csv
+import math
+import statistics
+
+from scipy import stats
+
+from .performance_analysis import log_render_time
+from .render_cache import STATE_COLD
+from .utils import *
+
+BUILDS = ['A', 'B']
+# every cycle renders the builds in ABBA order, the drift during the cycle affects both builds the same
+AB_CYCLE = 'ABBA'
+SIGNIFICANCE = 0.05
+COMPARISON_CSV = 'ab_comparison.csv'
+COMPARISON_JSON = 'ab_comparison.json'
+
+
+'''
+Paired comparison of the times of the baseline (A) and the candidate (B).
+The pairs are the neighbouring renders of the ABBA cycles, the test runs on the log of the times
+so the speedup is the geometric mean of the pair ratios A/B (above 1 - the candidate is faster).
+'''
+def paired_statistics(baseline: List[float], candidate: List[float]) -> dict:
+    pairs = [(a, b) for a, b in zip(baseline, candidate) if a and b]
+    if not pairs:
+        return None
+    differences = [math.log(a) - math.log(b) for a, b in pairs]
+    mean = statistics.fmean(differences)
+    result = {
+        "pairs": len(pairs),
+        "baseline": statistics.fmean([a for a, _ in pairs]),
+        "candidate": statistics.fmean([b for _, b in pairs]),
+        "speedup": math.exp(mean),
+        "ci_low": None,
+        "ci_high": None,
+        "p_value": None
+    }
+    if len(pairs) < 2:
+        return result
+    deviation = statistics.stdev(differences)
+    if deviation == 0:
+        result["ci_low"] = result["ci_high"] = result["speedup"]
+        result["p_value"] = 1.0 if mean == 0 else 0.0
+        return result
+    margin = stats.t.ppf(1 - SIGNIFICANCE / 2, len(pairs) - 1) * deviation / math.sqrt(len(pairs))
+    result["ci_low"] = math.exp(mean - margin)
+    result["ci_high"] = math.exp(mean + margin)
+    result["p_value"] = float(stats.ttest_rel([math.log(a) for a, _ in pairs], [math.log(b) for _, b in pairs]).pvalue)
+    return result
+
+
+'''
+Samples of the pairs rendered without a cold cache, a cold render is slower for the cache alone.
+With the cold cache policy every render is cold and all the pairs are kept.
+'''
+def warm_samples(samples: dict) -> dict:
+    states = [samples[build].get("cache", []) for build in BUILDS]
+    count = min(len(samples[build]["wall"]) for build in BUILDS)
+    warm = [run for run in range(count) if all(run >= len(state) or state[run] != STATE_COLD for state in states)]
+    if not warm:
+        return samples
+    return {build: {key: [values[run] for run in warm] for key, values in samples[build].items()} for build in BUILDS}
+
+
+# one row per scene, the renderer reported times are used when every render has them
+def compare_builds(comparisons: dict, treshold: float) -> List[dict]:
+    rows = []
+    for name, record in comparisons.items():
+        samples = warm_samples(record["samples"])
+        log_times = all(time is not None for build in BUILDS for time in samples[build]["log"])
+        timing = "log" if log_times else "wall"
+        result = paired_statistics(samples['A'][timing], samples['B'][timing]) or {}
+        wall = paired_statistics(samples['A']["wall"], samples['B']["wall"]) or {}
+        images = record.get("images", {})
+        rows.append({
+            "Name": name,
+            "Timing": timing,
+            "Pairs": result.get("pairs"),
+            "Baseline Time[s]": result.get("baseline"),
+            "Candidate Time[s]": result.get("candidate"),
+            "Speedup": result.get("speedup"),
+            "Speedup CI Low": result.get("ci_low"),
+            "Speedup CI High": result.get("ci_high"),
+            "p-value": result.get("p_value"),
+            "Significant": result.get("p_value") is not None and result["p_value"] < SIGNIFICANCE,
+            "Wall Speedup": wall.get("speedup"),
+            "Images": len(images),
+            "Max Image MSE": max([image["mse"] for image in images.values()], default=None),
+            "Image Mismatches": len([image for image in images.values() if image["mse"] > treshold])
+        })
+    return rows
+
+
+def save_comparison(rows: List[dict], results_path: Path) -> None:
+    try:
+        with open(results_path / COMPARISON_JSON, 'w') as f:
+            json.dump(rows, f, indent=2)
+        if rows:
+            with open(results_path / COMPARISON_CSV, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+                writer.writeheader()
+                writer.writerows(rows)
+    except IOError as io_err:
+        print_error(f"Could not save the build comparison to {results_path} [{repr(io_err)}]")
+
+
+def format_value(value, format: str = '.3f') -> str:
+    return '-' if value is None else f'{value:{format}}'
+
+
+def print_comparison(rows: List[dict], executables: dict) -> None:
+    print(f'{Fore.MAGENTA}Build comparison{Style.RESET_ALL}: A={executables["A"]} B={executables["B"]}')
+    for row in rows:
+        color = Fore.RESET
+        if row["Significant"]:
+            color = Fore.GREEN if row["Speedup"] > 1 else Fore.RED
+        msg = f'\t{row["Name"]}: A={format_value(row["Baseline Time[s]"])}s B={format_value(row["Candidate Time[s]"])}s ' \
+              f'speedup={color}{format_value(row["Speedup"])}{Style.RESET_ALL} ' \
+              f'[{format_value(row["Speedup CI Low"])}, {format_value(row["Speedup CI High"])}] ' \
+              f'p={format_value(row["p-value"], ".4f")} ({row["Timing"]})'
+        if row["Image Mismatches"]:
+            msg += f' {Fore.YELLOW}{row["Image Mismatches"]} images differ (mse={format_value(row["Max Image MSE"])}){Style.RESET_ALL}'
+        print(msg)
@@ -0,0 +1,130 @@
+import hashlib
+import os
+import shutil
+
+from .utils import *
+
+ARTIFACT_STORE_NAME = '.artifacts'
+ARTIFACT_MANIFEST_NAME = 'artifacts.json'
+HASH_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def file_digest(file: Path) -> str:
+    digest = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+'''
+Content addressed storage of the images and logs.
+Every file is stored once under objects/<hash[:2]>/<hash><ext>, the run folders get hard links
+(symbolic links or copies when the file system does not support them) to the stored objects.
+The store lives next to the run folders: results/.artifacts, references/.artifacts
+'''
+class ArtifactStore:
+    def __init__(self, root: Path):
+        self.root = root
+        self.objects_path = root / 'objects'
+
+    @staticmethod
+    def for_run(run_path: Path) -> 'ArtifactStore':
+        return ArtifactStore(run_path.parent / ARTIFACT_STORE_NAME)
+
+    def object_path(self, key: str) -> Path:
+        return self.objects_path / key[:2] / key
+
+    # stores the file content, returns the object key
+    def put(self, file: Path, move: bool = False) -> str:
+        key = f'{file_digest(file)}{file.suffix.lower()}'
+        object_path = self.object_path(key)
+        if object_path.exists():
+            if move:
+                os.remove(file)
+            return key
+        object_path.parent.mkdir(parents=True, exist_ok=True)
+        # other processes may store the same content at the same time
+        temp_path = object_path.with_name(f'.{key}.{os.getpid()}.tmp')
+        if move:
+            shutil.move(str(file), temp_path)
+        else:
+            shutil.copy2(file, temp_path)
+        os.replace(temp_path, object_path)
+        return key
+
+    def link(self, key: str, destination: Path) -> None:
+        object_path = self.object_path(key)
+        if destination.exists() or destination.is_symlink():
+            os.remove(destination)
+        try:
+            os.link(object_path, destination)
+        except OSError:
+            try:
+                os.symlink(object_path, destination)
+            except OSError:
+                shutil.copy2(object_path, destination)
+
+    # puts the file into the store and links it as the destination
+    def store(self, file: Path, destination: Path, move: bool = False) -> str:
+        key = self.put(file, move)
+        self.link(key, destination)
+        return key
+
+    # keys of the objects the manifests of the run folders next to the store refer to
+    def referenced_keys(self) -> set:
+        keys = set()
+        for manifest in self.root.parent.glob(f'*/{ARTIFACT_MANIFEST_NAME}'):
+            keys.update(ArtifactManifest(manifest.parent).entries.values())
+        return keys
+
+    '''
+    Removes the objects no run folder refers to anymore: not in any manifest and without other hard links
+    (the symbolic links do not count in the link count). The temporary files and the objects stored or
+    unlinked since `before` are kept, a run rendering at the same time may not have linked or recorded them yet,
+    unless they are the `released` objects the caller stopped referring to itself.
+    '''
+    def collect_garbage(self, before: float = None, released: set = None) -> int:
+        referenced = self.referenced_keys()
+        removed = 0
+        for object_path in self.objects_path.glob('*/*'):
+            if object_path.name.startswith('.') or object_path.name.endswith('.tmp'):
+                continue
+            stat = object_path.stat()
+            if object_path.name in referenced or stat.st_nlink > 1:
+                continue
+            # the copied and moved objects keep the source mtime, the ctime changes when they are stored
+            if before is not None and max(stat.st_mtime, stat.st_ctime) >= before and object_path.name not in (released or set()):
+                continue
+            os.remove(object_path)
+            removed += 1
+        return removed
+
+
+'''
+Maps the files of a run folder to the stored objects (<run>/artifacts.json)
+'''
+class ArtifactManifest:
+    def __init__(self, run_path: Path):
+        self.run_path = run_path
+        self.file = run_path / ARTIFACT_MANIFEST_NAME
+        self.entries = {}
+        if self.file.exists():
+            try:
+                with open(self.file, 'r') as f:
+                    self.entries = json.load(f)
+            except (IOError, json.decoder.JSONDecodeError) as err:
+                print(f"{Fore.YELLOW}Warning:{Style.RESET_ALL} ignoring artifact manifest {self.file} [{repr(err)}]")
+
+    def add(self, path: Path, key: str) -> None:
+        self.entries[Path(os.path.relpath(path, self.run_path)).as_posix()] = key
+
+    def update(self, entries: dict) -> None:
+        self.entries.update(entries)
+
+    def save(self) -> None:
+        try:
+            with open(self.file, 'w') as f:
+                json.dump(self.entries, f, indent=2, sort_keys=True)
+        except IOError as io_err:
+            print_error(f"Could not save artifact manifest to {self.file} [{repr(io_err)}]")
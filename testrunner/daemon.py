@@ -0,0 +1,452 @@
+import codecs
+import getpass
+import hmac
+import secrets
+import shutil
+import sys
+import threading
+import traceback
+import urllib.error
+import urllib.request
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .gpu_scaling import sweep_subsets
+from .image_analysis import USE_MULTIPROCESSING_ANALYSIS, enable_reference_cache
+from .utils import *
+
+if USE_MULTIPROCESSING_ANALYSIS:
+    from multiprocessing import Pool
+
+DAEMON_HOST = '127.0.0.1'
+DAEMON_STATE_PATH = Path('cache') / 'daemon'
+# secret of the running daemon, only the clients able to read the file can use the daemon
+DAEMON_TOKEN_FILE = DAEMON_STATE_PATH / 'token'
+DAEMON_TOKEN_HEADER = 'X-Daemon-Token'
+DEFAULT_REFERENCE_CACHE_MB = 256
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_FINISHED = 'finished'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+
+
+'''
+Sends the output printed by a job thread to the job, the other threads write to the console.
+'''
+class ThreadOutput:
+    def __init__(self, stream):
+        self.stream = stream
+        self.sinks = {}
+
+    def register(self, sink) -> None:
+        self.sinks[threading.get_ident()] = sink
+
+    def unregister(self) -> None:
+        self.sinks.pop(threading.get_ident(), None)
+
+    def write(self, text: str) -> int:
+        sink = self.sinks.get(threading.get_ident())
+        if sink is None:
+            return self.stream.write(text)
+        sink(text)
+        return len(text)
+
+    def flush(self) -> None:
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class Job:
+    def __init__(self, id: int, user: str, args: List[str]):
+        self.id = id
+        self.user = user
+        self.args = args
+        self.params = None
+        self.resources = set()
+        self.status = JOB_QUEUED
+        self.exit_code = None
+        self.output = []
+        self.changed = threading.Condition()
+
+    def write(self, text: str) -> None:
+        with self.changed:
+            self.output.append(text)
+            self.changed.notify_all()
+
+    def finish(self, status: str, exit_code: int) -> None:
+        with self.changed:
+            self.status = status
+            self.exit_code = exit_code
+            self.changed.notify_all()
+
+    def done(self) -> bool:
+        return self.status in [JOB_FINISHED, JOB_FAILED, JOB_CANCELLED]
+
+    # output chunks from the position, waits for new output until the job is done
+    def read(self, position: int) -> List[str]:
+        with self.changed:
+            while position >= len(self.output) and not self.done():
+                self.changed.wait()
+            return self.output[position:]
+
+    def info(self) -> dict:
+        return {"id": self.id, "user": self.user, "args": self.args, "status": self.status,
+                "exit_code": self.exit_code, "resources": sorted(self.resources)}
+
+
+# devices used by the job, the benchmark always writes its image to the same file
+def job_resources(params: ExecutionParameters) -> set:
+    if params.performance_analysis or params.image_analysis:
+        return set()
+    if params.gpu_sweep is not None:
+        # the sweep renders on each of its device sets in turn, it holds all of them
+        gpus = [gpu for subset in sweep_subsets(params.gpu, params.gpu_sweep) for gpu in subset.split(',')]
+    else:
+        gpus = params.gpu[0].split(',') if params.gpu else ['default']
+    resources = {f'gpu:{gpu.strip()}' for gpu in gpus}
+    if params.program == 'redshiftBenchmark':
+        resources.add('redshiftBenchmark')
+    return resources
+
+
+'''
+Jobs waiting for their devices.
+The users are served in turns, each user's jobs run in the submission order.
+A job starts when none of its devices is used by a running job.
+'''
+class JobQueue:
+    def __init__(self):
+        self.changed = threading.Condition()
+        self.queues = OrderedDict()  # user -> jobs
+        self.busy = set()
+
+    def put(self, job: Job) -> None:
+        with self.changed:
+            self.queues.setdefault(job.user, deque()).append(job)
+            self.changed.notify_all()
+
+    def cancel(self, job: Job) -> bool:
+        with self.changed:
+            queue = self.queues.get(job.user)
+            if queue is None or job not in queue:
+                return False
+            queue.remove(job)
+            if not queue:
+                del self.queues[job.user]
+            job.finish(JOB_CANCELLED, EXIT_FAILURE)
+            return True
+
+    def take(self) -> Job:
+        with self.changed:
+            while True:
+                job = self._next_job()
+                if job is not None:
+                    self.busy |= job.resources
+                    return job
+                self.changed.wait()
+
+    def release(self, job: Job) -> None:
+        with self.changed:
+            self.busy -= job.resources
+            self.changed.notify_all()
+
+    def _next_job(self) -> Job:
+        for user, queue in self.queues.items():
+            if queue[0].resources & self.busy:
+                continue
+            job = queue.popleft()
+            # the user goes to the end of the rotation
+            del self.queues[user]
+            if queue:
+                self.queues[user] = queue
+            return job
+        return None
+
+
+'''
+Writes a new token readable by the owner only, or by the group of the optional daemon_group.
+'''
+def create_token(root_path: Path, group: str = None) -> str:
+    token = secrets.token_hex(32)
+    token_file = root_path / DAEMON_TOKEN_FILE
+    token_file.parent.mkdir(parents=True, exist_ok=True)
+    if token_file.exists():
+        os.remove(token_file)
+    fd = os.open(token_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(token)
+    if group:
+        shutil.chown(token_file, group=group)
+        os.chmod(token_file, 0o640)
+    return token
+
+
+def read_token(root_path: Path) -> str:
+    with open(root_path / DAEMON_TOKEN_FILE, 'r') as f:
+        return f.read().strip()
+
+
+'''
+Name of the user owning the client socket, read from the kernel tcp table on linux.
+Elsewhere the clients are the users able to read the token, the daemon user.
+'''
+def peer_user(client_address: tuple, server_port: int) -> str:
+    try:
+        import pwd
+        with open('/proc/net/tcp', 'r') as f:
+            for line in f.readlines()[1:]:
+                fields = line.split()
+                local_port = int(fields[1].split(':')[1], 16)
+                remote_port = int(fields[2].split(':')[1], 16)
+                if local_port == client_address[1] and remote_port == server_port:
+                    return pwd.getpwuid(int(fields[7])).pw_name
+    except (ImportError, IOError, ValueError, IndexError, KeyError):
+        pass
+    return getpass.getuser()
+
+
+'''
+Long lived test runner serving the jobs submitted by the clients (--daemon-submit) over local http.
+The interpreter, the imports, the test manifests and the analysis workers with their decoded
+references stay warm between the jobs.
+Every request carries the token of the daemon (cache/daemon/token) in the X-Daemon-Token header,
+the jobs belong to the user owning the client connection.
+
+    POST /jobs                   {"cwd": ..., "args": [...]} -> job
+    GET  /jobs                   all jobs
+    GET  /jobs/<id>              job status
+    GET  /jobs/<id>/output       streams the job output until it ends
+    DELETE /jobs/<id>            cancels a queued job
+'''
+class TestDaemon:
+    def __init__(self, params: ExecutionParameters, run_job):
+        self.params = params
+        self.root_path = params.root_path
+        self.run_job = run_job
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.queue = JobQueue()
+        self.output = ThreadOutput(sys.stdout)
+        self.errors = ThreadOutput(sys.stderr)
+        self.pool = None
+        if USE_MULTIPROCESSING_ANALYSIS:
+            cache_mb = params.config.get('optional', {}).get('daemon_reference_cache_mb', DEFAULT_REFERENCE_CACHE_MB)
+            self.pool = Pool(initializer=enable_reference_cache, initargs=(cache_mb * 1024 * 1024,))
+
+    def serve(self, port: int) -> None:
+        sys.stdout, sys.stderr = self.output, self.errors
+        server = ThreadingHTTPServer((DAEMON_HOST, port), DaemonRequestHandler)
+        server.test_daemon = self
+        self.token = create_token(self.root_path, self.params.config.get('optional', {}).get('daemon_group'))
+        threading.Thread(target=self.dispatch, daemon=True).start()
+        print(f'{Fore.MAGENTA}Test daemon{Style.RESET_ALL} serving {Fore.GREEN}{self.root_path}{Style.RESET_ALL} '
+              f'on http://{DAEMON_HOST}:{port}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if (self.root_path / DAEMON_TOKEN_FILE).exists():
+                os.remove(self.root_path / DAEMON_TOKEN_FILE)
+            if self.pool is not None:
+                self.pool.terminate()
+            sys.stdout, sys.stderr = self.output.stream, self.errors.stream
+
+    def submit(self, user: str, cwd: str, args: List[str]) -> Job:
+        with self.lock:
+            job = Job(len(self.jobs) + 1, user, args)
+            self.jobs[job.id] = job
+        # the arguments are parsed right away, the errors go to the job output
+        self.output.register(job.write)
+        self.errors.register(job.write)
+        try:
+            if Path(cwd).resolve() != self.root_path:
+                raise ValueError(f"The daemon runs the tests of {self.root_path}, not {cwd}")
+            job.params = parse_command_line_args(args)
+            if job.params.daemon or job.params.daemon_submit:
+                raise ValueError("--daemon options can not be submitted to the daemon")
+            job.resources = job_resources(job.params)
+        except SystemExit:
+            job.finish(JOB_FAILED, EXIT_FAILURE)
+        except (IOError, ValueError) as err:
+            print_error(repr(err))
+            job.finish(JOB_FAILED, EXIT_FAILURE)
+        finally:
+            self.output.unregister()
+            self.errors.unregister()
+        if not job.done():
+            self.queue.put(job)
+        return job
+
+    def dispatch(self) -> None:
+        while True:
+            job = self.queue.take()
+            threading.Thread(target=self.run, args=(job,), daemon=True).start()
+
+    def run(self, job: Job) -> None:
+        job.status = JOB_RUNNING
+        self.output.register(job.write)
+        self.errors.register(job.write)
+        status, exit_code = JOB_FINISHED, EXIT_SUCCESS
+        try:
+            self.isolate(job)
+            print(f'{Fore.MAGENTA}Job {job.id}{Style.RESET_ALL} [{job.user}] started on {", ".join(sorted(job.resources)) or "cpu"}')
+            self.run_job(job.params, self.pool)
+        except SystemExit as exit_err:
+            exit_code = exit_err.code if isinstance(exit_err.code, int) else EXIT_FAILURE
+            status = JOB_FINISHED if exit_code == EXIT_SUCCESS else JOB_FAILED
+        except Exception:
+            traceback.print_exc(file=sys.stdout)
+            status, exit_code = JOB_FAILED, EXIT_FAILURE
+        finally:
+            self.output.unregister()
+            self.errors.unregister()
+            self.queue.release(job)
+            job.finish(status, exit_code)
+
+    # the jobs running at the same time on other devices must not share the redshift log folder,
+    # every device set gets its own local data folder that keeps its caches warm between the jobs
+    def isolate(self, job: Job) -> None:
+        if not job.resources:
+            return
+        local_data_path = self.root_path / DAEMON_STATE_PATH / 'redshift' / '_'.join(sorted(job.resources)).replace(':', '')
+        if not local_data_path.exists():
+            local_data_path.mkdir(parents=True)
+            preferences = get_local_data_path() / 'preferences.xml'
+            if preferences.exists():
+                shutil.copy2(preferences, local_data_path / 'preferences.xml')
+        job.params.environment['REDSHIFT_LOCALDATAPATH'] = str(local_data_path)
+
+    def job(self, id: str) -> Job:
+        try:
+            return self.jobs.get(int(id))
+        except ValueError:
+            return None
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    # the browsers can not send the token header to another origin without a preflight the daemon refuses
+    def authorized(self) -> bool:
+        token = self.headers.get(DAEMON_TOKEN_HEADER, '')
+        if hmac.compare_digest(token.encode('utf-8'), self.server.test_daemon.token.encode('utf-8')):
+            return True
+        self.send_json(403, {"error": f"Missing or wrong {DAEMON_TOKEN_HEADER}, read it from {DAEMON_TOKEN_FILE}"})
+        return False
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+        daemon = self.server.test_daemon
+        parts = self.path.strip('/').split('/')
+        if parts == ['jobs']:
+            return self.send_json(200, [job.info() for job in daemon.jobs.values()])
+        job = daemon.job(parts[1]) if len(parts) > 1 and parts[0] == 'jobs' else None
+        if job is None:
+            return self.send_json(404, {"error": f"Unknown request {self.path}"})
+        if len(parts) == 2:
+            return self.send_json(200, job.info())
+        if parts[2:] == ['output']:
+            return self.stream_output(job)
+        return self.send_json(404, {"error": f"Unknown request {self.path}"})
+
+    def do_POST(self):
+        if not self.authorized():
+            return
+        if self.path.strip('/') != 'jobs':
+            return self.send_json(404, {"error": f"Unknown request {self.path}"})
+        if self.headers.get_content_type() != 'application/json':
+            return self.send_json(415, {"error": "The jobs are submitted as application/json"})
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            user = peer_user(self.client_address, self.server.server_address[1])
+            job = self.server.test_daemon.submit(user, request['cwd'], request['args'])
+        except (json.decoder.JSONDecodeError, KeyError, TypeError, ValueError) as err:
+            return self.send_json(400, {"error": repr(err)})
+        self.send_json(201, job.info())
+
+    def do_DELETE(self):
+        if not self.authorized():
+            return
+        parts = self.path.strip('/').split('/')
+        job = self.server.test_daemon.job(parts[1]) if len(parts) == 2 and parts[0] == 'jobs' else None
+        if job is None:
+            return self.send_json(404, {"error": f"Unknown request {self.path}"})
+        if not self.server.test_daemon.queue.cancel(job):
+            return self.send_json(409, {"error": f"Job {job.id} is {job.status}, only the queued jobs can be cancelled"})
+        self.send_json(200, job.info())
+
+    # the connection is closed at the end of the job, the client reads until then
+    def stream_output(self, job: Job) -> None:
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.end_headers()
+        position = 0
+        try:
+            while True:
+                chunks = job.read(position)
+                if not chunks:
+                    break
+                position += len(chunks)
+                self.wfile.write(''.join(chunks).encode('utf-8'))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def send_json(self, code: int, data) -> None:
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def daemon_request(port: int, token: str, path: str, data: dict = None, method: str = None):
+    body = json.dumps(data).encode('utf-8') if data is not None else None
+    request = urllib.request.Request(f'http://{DAEMON_HOST}:{port}{path}', data=body, method=method,
+                                     headers={'Content-Type': 'application/json', DAEMON_TOKEN_HEADER: token})
+    return urllib.request.urlopen(request)
+
+
+# runs the command line on the daemon, prints its output and returns its exit code
+def submit_job(root_path: Path, port: int, args: List[str]) -> int:
+    try:
+        token = read_token(root_path)
+    except IOError as io_err:
+        print_error(f"Could not read the token of the test daemon [{repr(io_err)}], start it with --daemon")
+        return EXIT_FAILURE
+    try:
+        with daemon_request(port, token, '/jobs', {"cwd": str(Path.cwd()), "args": args}) as response:
+            job = json.load(response)
+    except urllib.error.HTTPError as err:
+        print_error(f"Test daemon refused the job [{err.code} {err.read().decode('utf-8', errors='replace')}]")
+        return EXIT_FAILURE
+    except urllib.error.URLError as err:
+        print_error(f"Test daemon is not running on port {port} [{repr(err)}], start it with --daemon")
+        return EXIT_FAILURE
+    if job['status'] == JOB_QUEUED:
+        print(f'{Fore.MAGENTA}Job {job["id"]}{Style.RESET_ALL} queued')
+    try:
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        with daemon_request(port, token, f'/jobs/{job["id"]}/output') as response:
+            for chunk in iter(lambda: response.read1(4096), b''):
+                sys.stdout.write(decoder.decode(chunk))
+                sys.stdout.flush()
+    except KeyboardInterrupt:
+        try:
+            daemon_request(port, token, f'/jobs/{job["id"]}', method='DELETE').close()
+            print(f'\nJob {job["id"]} cancelled')
+        except urllib.error.HTTPError:
+            print(f'\nJob {job["id"]} keeps running on the daemon')
+        return EXIT_FAILURE
+    with daemon_request(port, token, f'/jobs/{job["id"]}') as response:
+        job = json.load(response)
+    return job['exit_code'] if job['exit_code'] is not None else EXIT_FAILURE
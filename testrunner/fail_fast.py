@@ -0,0 +1,62 @@
+from .scheduling import predict_durations
+from .utils import *
+
+ON_STREAK_ABORT = 'abort'
+ON_STREAK_CANARY = 'canary'
+
+
+ASSERT_PATTERN = re.compile(r'ASSERT FAILED[:\s]*(.*)', re.DOTALL)
+# paths and the file names of the scenes, proxies, textures and sources in the message
+PATH_PATTERN = re.compile(r'\S*[\\/]\S*|[\w.\-]+\.(?:rs|rsproxy|rsmesh|cpp|h|hpp|html|png|exr|tiff?|jpe?g)\b', re.IGNORECASE)
+
+
+'''
+The first line of the assert text (or of the message) without the scene names, paths, addresses,
+line and frame numbers, the same for every scene failing the same way.
+'''
+def failure_signature(msg: str, names: List[str] = ()) -> str:
+    match = ASSERT_PATTERN.search(msg)
+    text = match.group(1) if match else msg
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    signature = lines[0] if lines else msg.strip()
+    for name in sorted(names, key=len, reverse=True):
+        if name:
+            signature = signature.replace(name, '<scene>')
+    signature = PATH_PATTERN.sub('<path>', signature)
+    return re.sub(r'0x[0-9a-fA-F]+|\d+', '#', signature).strip()
+
+
+'''
+Counts the consecutive render failures with the same signature.
+A broken renderer build fails every scene the same way, once the limit
+is reached there is no point to commit the GPUs to the rest of the suite.
+'''
+class FailureStreak:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.signature = None
+        self.length = 0
+
+    # returns True when the streak reached the limit, the names of the failed test are not part of the signature
+    def record_failure(self, msg: str, names: List[str] = ()) -> bool:
+        signature = failure_signature(msg, names)
+        if signature == self.signature:
+            self.length += 1
+        else:
+            self.signature = signature
+            self.length = 1
+        return self.limit > 0 and self.length >= self.limit
+
+    def reset(self) -> None:
+        self.signature = None
+        self.length = 0
+
+
+# splits the tests into the fastest (predicted) ones and the rest, both keep the input order
+def split_fastest_tests(tests: list, count: int) -> Tuple[list, list]:
+    predictions = predict_durations(tests)
+    # tests which scene is missing can't tell anything about the build
+    candidates = [i for i in range(len(tests)) if predictions[i][1] != 'none']
+    candidates.sort(key=lambda i: predictions[i][0])
+    fastest = set(candidates[:count])
+    return [t for i, t in enumerate(tests) if i in fastest], [t for i, t in enumerate(tests) if i not in fastest]
@@ -0,0 +1,110 @@
+import csv
+
+import matplotlib
+import matplotlib.pyplot as plt
+
+from .utils import *
+
+matplotlib.use('Agg')
+
+SCALING_CSV = 'scaling.csv'
+SCALING_JSON = 'scaling.json'
+SCALING_CHART = 'scaling.png'
+# scenes under this efficiency on the largest device set stopped scaling
+SCALING_EFFICIENCY_WARNING = 0.7
+MAX_CHART_LEGEND = 20
+
+
+# the device sets of the sweep: the given ones or the growing prefixes of --gpu "0,1,2,3" -> 0 | 0,1 | 0,1,2 | 0,1,2,3
+def sweep_subsets(gpu: List[str], subsets: List[str]) -> List[str]:
+    if subsets:
+        return subsets
+    devices = [device.strip() for device in gpu[0].split(',')]
+    return [','.join(devices[:count]) for count in range(1, len(devices) + 1)]
+
+
+def subset_key(subset: str) -> str:
+    return 'gpu' + '-'.join(device.strip() for device in subset.split(','))
+
+
+'''
+One row per scene and device set. The speedup and the efficiency are relative to the smallest
+device set of the scene: efficiency = (T_base * n_base) / (n * T_n), 1.0 is the perfect scaling.
+'''
+def scaling_rows(records: dict) -> List[dict]:
+    rows = []
+    for name, record in records.items():
+        runs = record["runs"]
+        if not runs:
+            continue
+        timing = "log" if all(run["log"] is not None for run in runs) else "wall"
+        base = min(runs, key=lambda run: run["count"])
+        for run in runs:
+            speedup = base[timing] / run[timing] if run[timing] else None
+            rows.append({
+                "Name": name,
+                "GPUs": run["gpus"],
+                "GPU Count": run["count"],
+                "Reported GPU Count": run["reported"],
+                "Timing": timing,
+                "Time[s]": run[timing],
+                "Wall Time[s]": run["wall"],
+                "Speedup": speedup,
+                "Efficiency": speedup * base["count"] / run["count"] if speedup else None
+            })
+    return rows
+
+
+def save_scaling(rows: List[dict], results_path: Path) -> None:
+    try:
+        with open(results_path / SCALING_JSON, 'w') as f:
+            json.dump(rows, f, indent=2)
+        if rows:
+            with open(results_path / SCALING_CSV, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+                writer.writeheader()
+                writer.writerows(rows)
+    except IOError as io_err:
+        print_error(f"Could not save the scaling results to {results_path} [{repr(io_err)}]")
+
+
+# speedup and efficiency over the device count, one line per scene
+def plot_scaling(rows: List[dict], file: Path) -> None:
+    scenes = {}
+    for row in rows:
+        if row["Speedup"] is not None:
+            scenes.setdefault(row["Name"], []).append((row["GPU Count"], row["Speedup"], row["Efficiency"]))
+    if not scenes:
+        return
+    fig, axes = plt.subplots(ncols=2, figsize=(16, 8))
+    counts = sorted({count for points in scenes.values() for count, _, _ in points})
+    for name, points in scenes.items():
+        points.sort()
+        axes[0].plot([p[0] for p in points], [p[1] for p in points], marker='o', label=name)
+        axes[1].plot([p[0] for p in points], [p[2] for p in points], marker='o', label=name)
+    axes[0].plot(counts, [count / counts[0] for count in counts], 'k--', label='ideal')
+    axes[0].set_title('Speedup')
+    axes[1].axhline(1.0, color='k', linestyle='--')
+    axes[1].axhline(SCALING_EFFICIENCY_WARNING, color='r', linestyle=':')
+    axes[1].set_title('Efficiency')
+    for ax in axes:
+        ax.set_xlabel('GPU count')
+        ax.set_xticks(counts)
+    if len(scenes) <= MAX_CHART_LEGEND:
+        axes[1].legend(loc='lower left', fontsize='small')
+    plt.tight_layout()
+    plt.savefig(str(file), dpi=100)
+    plt.close()
+
+
+def print_scaling(rows: List[dict]) -> None:
+    print(f'{Fore.MAGENTA}GPU scaling{Style.RESET_ALL}:')
+    for row in rows:
+        efficiency = row["Efficiency"]
+        color = Fore.RESET if efficiency is None or efficiency >= SCALING_EFFICIENCY_WARNING else Fore.YELLOW
+        msg = f'\t{row["Name"]} [{row["GPUs"]}]: time={row["Time[s]"]:.3f}s ({row["Timing"]})' if row["Time[s]"] else f'\t{row["Name"]} [{row["GPUs"]}]: time=-'
+        if efficiency is not None:
+            msg += f' speedup={row["Speedup"]:.2f} efficiency={color}{efficiency:.2f}{Style.RESET_ALL}'
+        if row["Reported GPU Count"] is not None and row["Reported GPU Count"] != row["GPU Count"]:
+            msg += f' {Fore.YELLOW}the renderer used {row["Reported GPU Count"]} GPU(s){Style.RESET_ALL}'
+        print(msg)
@@ -0,0 +1,40 @@
+import statistics
+
+from .utils import *
+
+HISTORY_DEPTH = 5
+
+
+'''
+Render durations of the tests collected from the execution results
+of the previous runs (results/<date>/<program>_TEST_<date>.json)
+and reference generations (references/<program>/<program>_REFERENCE_<date>.json)
+of the full quality renders
+'''
+class DurationHistory:
+    def __init__(self, root_path: Path, program: str):
+        self.root_path = root_path
+        self.program = program
+
+    def files(self) -> List[Path]:
+        files = list((self.root_path / 'results').glob(f'*/{self.program}_TEST_*.json'))
+        files += list((self.root_path / 'references' / self.program).glob(f'{self.program}_REFERENCE_*.json'))
+        return sorted(files, key=lambda f: f.stat().st_mtime)
+
+    # median of the last HISTORY_DEPTH successful renders of each test
+    def load(self) -> dict:
+        samples = {}
+        for file in self.files():
+            try:
+                with open(file, 'r') as f:
+                    info = json.load(f)
+            except (IOError, json.decoder.JSONDecodeError):
+                continue
+            # the --fast and --progressive renders are shorter than the full quality render
+            if not info.get('full_quality', True) or info.get('progressive'):
+                continue
+            succeeded = {entry[0] for entry in info.get('success', [])}
+            for name, duration in info.get('durations', {}).items():
+                if name in succeeded:
+                    samples.setdefault(name, []).append(duration)
+        return {name: statistics.median(values[-HISTORY_DEPTH:]) for name, values in samples.items()}
@@ -1,10 +1,20 @@
+import os
+# must be set before cv2 is imported
+os.environ.setdefault('OPENCV_IO_ENABLE_OPENEXR', '1')
 import cv2 as cv
+import numpy as np
 import matplotlib
 import matplotlib.pyplot as plt
 from skimage.metrics import mean_squared_error
 from skimage.metrics import structural_similarity as ssim
+import queue
 import shutil
+from collections import OrderedDict
+from scipy.ndimage import uniform_filter
 
+from .artifact_store import ArtifactManifest, ArtifactStore
+from .image_headers import read_image_header
+from .memory_budget import *
 from .utils import *
 
 USE_MULTIPROCESSING_ANALYSIS = True
@@ -14,9 +24,33 @@ except ImportError:
     print('multiprocessing module was not found. Will use single threaded version')
     USE_MULTIPROCESSING_ANALYSIS = False
 
+# optional - uncompressed tiff files are memory mapped instead of decoded
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
 
 matplotlib.use('Agg')
 
+RESULT_SUFFIX = '.result'
+REFERENCE_SUFFIX = '.reference'
+# linear float images are compared in the 8-bit range so the --treshold keeps its meaning
+LINEAR_SCALE = 255.0
+DISPLAY_GAMMA = 2.2
+# frames of a sequence are named <test_name>[.<aov>].<frame>
+SEQUENCE_FRAME_PATTERN = re.compile(r'^(.*)\.(\d+)$')
+
+# images up to this size are analyzed in batches, a batch holds up to BATCH_PIXELS pixels
+BATCH_MAX_IMAGE_PIXELS = 512 * 512
+BATCH_PIXELS = 4 * 1024 * 1024
+# structural_similarity defaults: 7x7 uniform window, sample covariance
+SSIM_WIN_SIZE = 7
+SSIM_K1 = 0.01
+SSIM_K2 = 0.03
+
+# decoded references kept by the long lived workers of the daemon, disabled by default
+reference_cache = None
+
 @dataclass
 class AnalysisItem:
     def __init__(self, reference_image: Path, result_image: Path, name: str, plot_path: Path, treshold: float = 0.95, crop:bool=False):
@@ -28,6 +62,9 @@ class AnalysisItem:
         self.crop = crop
         self.mse = 0.0
         self.ssi = 0.0
+        self.flicker = None
+        self.artifacts = {}
+        self.headers = None
 
     # cuts the bottom part of the image description generatedby the benchmark    
     def _trim(self, imdata):
@@ -68,16 +105,31 @@ class AnalysisItem:
             print(f'{Fore.YELLOW}Warning:{ Style.RESET_ALL} Could not find crop size for height {h}')
             return imdata
 
-    def compute_mse_and_ssi(self) -> None:
+    # headers of the reference and the result, read once
+    def read_headers(self):
+        if self.headers is None:
+            self.headers = (read_image_header(self.reference_image), read_image_header(self.result_image))
+        return self.headers
+
+    # worst case memory of the analysis, the diff plot is included as the mismatch is not known up front
+    def estimate_memory(self) -> int:
+        return estimate_pair_memory(*self.read_headers()) + PLOT_BYTES
+
+    def load_images(self):
         if self.crop:
-            cv_ref = self._trim(cv.imread(str(self.reference_image)))
-            cv_res = self._trim(cv.imread(str(self.result_image)))
+            cv_ref = self._trim(read_reference(self.reference_image))
+            cv_res = self._trim(read_image(self.result_image))
         else:
-            cv_ref = cv.imread(str(self.reference_image))
-            cv_res = cv.imread(str(self.result_image))
+            cv_ref = read_reference(self.reference_image)
+            cv_res = read_image(self.result_image)
+        return cv_ref, cv_res
 
-        cv_ref = cv.cvtColor(cv_ref, cv.COLOR_BGR2GRAY)
-        cv_res = cv.cvtColor(cv_res, cv.COLOR_BGR2GRAY)
+    def load_gray_images(self):
+        cv_ref, cv_res = self.load_images()
+        return to_gray(cv_ref), to_gray(cv_res)
+
+    def compute_mse_and_ssi(self, images=None) -> None:
+        cv_ref, cv_res = images if images is not None else self.load_gray_images()
 
         self.mse = mean_squared_error(cv_ref, cv_res)
         #it make sense to ocmpare images that are not enitrely black
@@ -87,12 +139,7 @@ class AnalysisItem:
             self.ssi = ssim(cv_ref, cv_res, data_range=data_range)
 
     def create_diff_plot(self, plot_file_path:Path)->None:
-        if self.crop:
-            cv_ref = self._trim(cv.imread(str(self.reference_image)))
-            cv_res = self._trim(cv.imread(str(self.result_image)))
-        else:
-            cv_ref = cv.imread(str(self.reference_image))
-            cv_res = cv.imread(str(self.result_image))
+        cv_ref, cv_res = [to_display(image) for image in self.load_images()]
         
         fig, axes = plt.subplots(ncols=3, figsize=(19.20,10.80), sharex=True, sharey=True)
         ax = axes.ravel()
@@ -113,20 +160,258 @@ class AnalysisItem:
         plt.savefig(str(plot_file_path), dpi=300)
         plt.close()
 
-def Analyze(item: AnalysisItem):
+# BGR image, 8-bit for png, linear values for exr and float tiff
+def read_image(path: Path):
+    if tifffile is not None and path.suffix.lower() in ['.tif', '.tiff']:
+        try:
+            image = tifffile.memmap(str(path), mode='r')
+            # RGB(A) -> BGR view
+            return image[..., 2::-1] if image.ndim == 3 and image.shape[2] >= 3 else image
+        except (ValueError, OSError):
+            pass
+    flags = cv.IMREAD_COLOR if path.suffix.lower() == '.png' else cv.IMREAD_UNCHANGED
+    image = cv.imread(str(path), flags)
+    if image is None:
+        raise ValueError(f'Could not read {path}')
+    return image
+
+
+'''
+Least recently used decoded images limited by their size in bytes.
+The references do not change between the jobs, a warm worker decodes each of them once.
+'''
+class DecodedImageCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.entries = OrderedDict()
+
+    def get(self, path: Path):
+        stat = path.stat()
+        key = (str(path), stat.st_mtime_ns, stat.st_size)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        image = read_image(path)
+        if image.nbytes <= self.max_bytes:
+            self.entries[key] = image
+            self.bytes += image.nbytes
+            while self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted.nbytes
+        return image
+
+
+# pool initializer of the daemon workers
+def enable_reference_cache(max_bytes: int) -> None:
+    global reference_cache
+    reference_cache = DecodedImageCache(max_bytes) if max_bytes > 0 else None
+
+
+def read_reference(path: Path):
+    if reference_cache is None:
+        return read_image(path)
+    return reference_cache.get(path)
+
+
+def to_gray(image):
+    if image.dtype == np.uint8:
+        if image.ndim == 2:
+            return image
+        return cv.cvtColor(np.ascontiguousarray(image[..., :3]), cv.COLOR_BGR2GRAY)
+    linear = image.astype(np.float64)
+    if np.issubdtype(image.dtype, np.integer):
+        linear /= np.iinfo(image.dtype).max
+    if linear.ndim == 3:
+        # Rec. 709 luminance of the linear BGR values
+        linear = 0.0722 * linear[..., 0] + 0.7152 * linear[..., 1] + 0.2126 * linear[..., 2]
+    return linear * LINEAR_SCALE
+
+
+# tone maps the linear images for the diff plot
+def to_display(image):
+    if image.dtype == np.uint8:
+        return np.ascontiguousarray(image[..., :3]) if image.ndim == 3 else image
+    linear = image.astype(np.float32)
+    if np.issubdtype(image.dtype, np.integer):
+        linear /= np.iinfo(image.dtype).max
+    if linear.ndim == 3:
+        linear = linear[..., :3]
+    return (np.clip(linear, 0.0, 1.0) ** (1.0 / DISPLAY_GAMMA) * 255).astype(np.uint8)
+
+
+'''
+Frames of one rendered sequence analyzed together by one worker.
+Each frame is decoded once and compared with the reference and with the previous frame
+to measure the temporal flicker: the mean square difference between the frame to frame
+changes of the result and of the reference sequence.
+'''
+class SequenceAnalysisItem:
+    def __init__(self, name: str, items: List[AnalysisItem]):
+        self.name = name
+        self.items = items
+
+    def analyze(self) -> None:
+        previous = None
+        for item in self.items:
+            try:
+                cv_ref, cv_res = item.load_gray_images()
+                item.compute_mse_and_ssi((cv_ref, cv_res))
+                if previous is not None and previous[0].shape == cv_ref.shape:
+                    item.flicker = temporal_flicker(previous, (cv_ref, cv_res))
+                previous = (cv_ref, cv_res)
+                handle_mismatch(item)
+            except ValueError as ve:
+                print_error(f"Analysis of {item.name} failed: {repr(ve)}")
+                previous = None
+
+    # the frames are analyzed one by one, the gray images of the previous frame are kept
+    def estimate_memory(self) -> int:
+        largest = max(self.items, key=lambda item: (item.read_headers()[0] or UNKNOWN_IMAGE).pixels)
+        reference = largest.read_headers()[0] or UNKNOWN_IMAGE
+        return largest.estimate_memory() + 2 * reference.pixels * (8 if reference.floating else 1)
+
+
+'''
+Many small images of the same size analyzed together by one worker.
+The gray images are stacked into (N, H, W) arrays and the mse and ssim of all the pairs
+are computed at once, the results are the same as compute_mse_and_ssi of every item.
+'''
+class BatchAnalysisItem:
+    def __init__(self, items: List[AnalysisItem]):
+        self.items = items
+
+    def analyze(self) -> None:
+        loaded = []
+        for item in self.items:
+            try:
+                loaded.append((item, item.load_gray_images()))
+            except ValueError as ve:
+                print_error(f"Analysis of {item.name} failed: {repr(ve)}")
+        # cropped benchmark images may end up with different sizes
+        shapes = {}
+        for item, images in loaded:
+            shapes.setdefault(images[0].shape, []).append((item, images))
+        for group in shapes.values():
+            references = np.stack([images[0] for _, images in group]).astype(np.float64)
+            results = np.stack([images[1] for _, images in group]).astype(np.float64)
+            mse = np.mean((references - results) ** 2, axis=(1, 2))
+            ssi = batch_structural_similarity(references, results)
+            for index, (item, _) in enumerate(group):
+                item.mse = float(mse[index])
+                item.ssi = float(ssi[index])
+                handle_mismatch(item)
+
+    # the gray stacks in float64 with the ssim intermediates of the whole batch
+    def estimate_memory(self) -> int:
+        pixels = sum((item.read_headers()[0] or UNKNOWN_IMAGE).pixels for item in self.items)
+        return pixels * 8 * (2 + SSIM_FLOAT_ARRAYS) + self.items[0].estimate_memory()
+
+
+# structural_similarity of every (H, W) pair, data range of the reference, 1.0 for the flat references
+def batch_structural_similarity(references, results):
+    data_range = references.max(axis=(1, 2)) - references.min(axis=(1, 2))
+    size = (1, SSIM_WIN_SIZE, SSIM_WIN_SIZE)
+    cov_norm = SSIM_WIN_SIZE ** 2 / (SSIM_WIN_SIZE ** 2 - 1)
+    ux = uniform_filter(references, size=size)
+    uy = uniform_filter(results, size=size)
+    vx = cov_norm * (uniform_filter(references * references, size=size) - ux * ux)
+    vy = cov_norm * (uniform_filter(results * results, size=size) - uy * uy)
+    vxy = cov_norm * (uniform_filter(references * results, size=size) - ux * uy)
+    c1 = ((SSIM_K1 * data_range) ** 2)[:, None, None]
+    c2 = ((SSIM_K2 * data_range) ** 2)[:, None, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s = ((2 * ux * uy + c1) * (2 * vxy + c2)) / ((ux ** 2 + uy ** 2 + c1) * (vx + vy + c2))
+    pad = (SSIM_WIN_SIZE - 1) // 2
+    ssi = s[:, pad:-pad, pad:-pad].mean(axis=(1, 2), dtype=np.float64)
+    return np.where(data_range > 0, ssi, 1.0)
+
+
+# groups the small images of the same size into batches, the other items are analyzed one by one
+def batch_small_items(work_items: list) -> list:
+    sizes = {}
+    others = []
+    for item in work_items:
+        reference, result = item.read_headers() if isinstance(item, AnalysisItem) else (None, None)
+        if reference is None or result is None or reference.shape != result.shape or \
+                reference.pixels > BATCH_MAX_IMAGE_PIXELS or min(reference.shape) < SSIM_WIN_SIZE:
+            others.append(item)
+            continue
+        size = reference.shape
+        sizes.setdefault((size, item.crop), []).append(item)
+    batched = []
+    for (size, crop), items in sizes.items():
+        if len(items) == 1:
+            others.append(items[0])
+            continue
+        # every worker of the pool still gets a batch
+        count = max(1, min(BATCH_PIXELS // (size[0] * size[1]), -(-len(items) // (os.cpu_count() or 1))))
+        batched += [BatchAnalysisItem(items[i:i + count]) for i in range(0, len(items), count)]
+    return batched + others
+
+
+def temporal_flicker(previous, current) -> float:
+    reference_change = current[0].astype(np.float64) - previous[0]
+    result_change = current[1].astype(np.float64) - previous[1]
+    return float(np.mean((result_change - reference_change) ** 2))
+
+
+def handle_mismatch(item: AnalysisItem) -> None:
+    if item.mse > item.treshold:
+        store = ArtifactStore.for_run(item.output_dir.parent)
+        for image in [item.reference_image, item.result_image]:
+            key = store.store(image, item.output_dir / image.name)
+            item.artifacts[f'{item.output_dir.name}/{image.name}'] = key
+        plot_file = item.output_dir / f'{item.name}.diff.png'
+        item.create_diff_plot(plot_file)
+
+
+def Analyze(item):
+    if isinstance(item, (SequenceAnalysisItem, BatchAnalysisItem)):
+        item.analyze()
+        return item
     try:
         item.compute_mse_and_ssi()
-        if item.mse > item.treshold:
-            shutil.copy2(item.reference_image, item.output_dir)
-            shutil.copy2(item.result_image, item.output_dir)
-            plot_file = item.output_dir / f'{item.name}.diff.png'
-            item.create_diff_plot(plot_file)
+        handle_mismatch(item)
     except ValueError as ve:
         print_error(f"Analysis of {item.name} failed: {repr(ve)}")
     return item
+
+
+'''
+Groups the frames of the tests rendering a sequence, recorded by the runner in the execution results
+(test name -> {"images": [...]}). The numbered images of the other tests are separate tests.
+'''
+def group_sequences(items: List[AnalysisItem], sequences: dict) -> list:
+    sequence_images = {image for record in sequences.values() for image in record.get("images", [])}
+    frames_of = {}
+    grouped = []
+    for item in items:
+        match = SEQUENCE_FRAME_PATTERN.match(item.name)
+        if not match or item.result_image.name not in sequence_images:
+            grouped.append(item)
+            continue
+        frames_of.setdefault(match.group(1), []).append((int(match.group(2)), item))
+    for name, frames in frames_of.items():
+        if len(frames) == 1:
+            grouped.append(frames[0][1])
+            continue
+        frames.sort(key=lambda frame: frame[0])
+        grouped.append(SequenceAnalysisItem(name, [item for _, item in frames]))
+    return grouped
+
+
+def print_analysis(item: AnalysisItem) -> None:
+    msg = f"Analysis of {Fore.GREEN}{item.name}{Style.RESET_ALL}: " \
+        f"mse={Fore.BLUE}{item.mse:.3f}{Style.RESET_ALL}, "\
+        f"ssi={Fore.BLUE}{item.ssi:.3f}{Style.RESET_ALL}"
+    if item.flicker is not None:
+        msg += f", flicker={Fore.BLUE}{item.flicker:.3f}{Style.RESET_ALL}"
+    print(msg)
     
 class ImageAnalyzer:
-    def __init__(self, references_path: Path, results_path: Path, treshold: float = 0.95, crop: bool = False):
+    def __init__(self, references_path: Path, results_path: Path, treshold: float = 0.95, crop: bool = False,
+                 noise_model=None, sample_ratio: float = 1.0, noise_sigma: float = 3.0, memory_budget: float = None):
         self.reference_path = references_path
         self.results_path = results_path
         self.analysis_output_path = self.results_path / 'common'
@@ -138,11 +423,18 @@ class ImageAnalyzer:
 
         self.treshold = treshold
         self.crop = crop
+        # per image tresholds calibrated from the noise of the references
+        self.noise_model = noise_model
+        self.sample_ratio = sample_ratio
+        self.noise_sigma = noise_sigma
+        # bytes the workers may use together, --memory-budget is in GB
+        self.memory_budget = int(memory_budget * GB) if memory_budget else default_memory_budget()
         self.analysis_items = []
         self.mismatch_items = []
 
 
-    def analyze(self):
+    # the daemon passes its warm worker pool
+    def analyze(self, pool=None):
         program = "redshiftCmdBenchmark" if self.crop else "redshiftCmdLine"
         print(f'{Fore.MAGENTA}Analyzing results{Style.RESET_ALL} from {self.results_path} vs {program}')
         all, found, missing = self.match_results_with_references()
@@ -160,26 +452,17 @@ class ImageAnalyzer:
             print("There is nothing to compare")
             return
         
-        analyzed_items = []    
-        if USE_MULTIPROCESSING_ANALYSIS:
-            with Pool() as pool:
+        work_items = batch_small_items(group_sequences(self.analysis_items, self.load_sequences()))
+        if pool is not None:
+            self.analysis_items = self.collect_results(self.run_in_budget(pool, work_items, os.cpu_count() or 1))
+        elif USE_MULTIPROCESSING_ANALYSIS:
+            estimates = [item.estimate_memory() for item in work_items]
+            workers = workers_for_budget(estimates, self.memory_budget, os.cpu_count() or 1)
+            with Pool(workers) as pool:
                 # Meh... the analysisItem is not the best one
-                results = pool.imap_unordered(Analyze, self.analysis_items)
-                for item in results:
-                    msg = f"Analysis of {Fore.GREEN}{item.name}{Style.RESET_ALL}: " \
-                        f"mse={Fore.BLUE}{item.mse:.3f}{Style.RESET_ALL}, "\
-                        f"ssi={Fore.BLUE}{item.ssi:.3f}{Style.RESET_ALL}"
-                    print(msg)
-                    analyzed_items.append(item)
+                self.analysis_items = self.collect_results(self.run_in_budget(pool, work_items, workers, estimates))
         else:
-            analyzed_items =[Analyze(item) for item in self.analysis_items]            
-            for item in analyzed_items:
-                msg = f"Analysis of {Fore.GREEN}{item.name}{Style.RESET_ALL}: " \
-                      f"mse={Fore.BLUE}{item.mse:.3f}{Style.RESET_ALL}, "\
-                      f"ssi={Fore.BLUE}{item.ssi:.3f}{Style.RESET_ALL}"
-                print(msg)
-        
-        self.analysis_items = analyzed_items
+            self.analysis_items = self.collect_results([Analyze(item) for item in work_items])
                 
         mismatch_images = [ item for item in self.analysis_items if item.mse > item.treshold]
         mismatch_images.sort(key=lambda x: x.mse, reverse=True)
@@ -189,6 +472,78 @@ class ImageAnalyzer:
             print(f"\tmse={Fore.BLUE}{item.mse:.3f}{Style.RESET_ALL} [{Fore.GREEN}{item.name}{Style.RESET_ALL}]")
         self.mismatch_items = mismatch_images
 
+        # the common folder is recreated by every analysis
+        artifacts = ArtifactManifest(self.results_path)
+        artifacts.entries = {path: key for path, key in artifacts.entries.items() if not path.startswith(f'{self.analysis_output_path.name}/')}
+        for item in self.analysis_items:
+            artifacts.update(item.artifacts)
+        artifacts.save()
+
+        # the noise of both frames adds up in the frame to frame change
+        flickering_images = [item for item in self.analysis_items if item.flicker is not None and item.flicker > 2 * item.treshold]
+        if flickering_images:
+            flickering_images.sort(key=lambda x: x.flicker, reverse=True)
+            print(f"{Fore.YELLOW}There are {Fore.BLUE}{len(flickering_images)}{Fore.YELLOW} frames with temporal flicker{Style.RESET_ALL}")
+            for item in flickering_images:
+                print(f"\tflicker={Fore.BLUE}{item.flicker:.3f}{Style.RESET_ALL} [{Fore.GREEN}{item.name}{Style.RESET_ALL}]")
+
+    '''
+    Dispatches the largest items first and only as many at once as their estimated memory
+    fits the budget, smaller items fill the rest. An item larger than the budget runs alone.
+    Yields the analyzed items as they finish.
+    '''
+    def run_in_budget(self, pool, work_items: list, workers: int, estimates: List[int] = None):
+        estimates = estimates or [item.estimate_memory() for item in work_items]
+        budget = self.memory_budget
+        pending = sorted(range(len(work_items)), key=lambda index: estimates[index], reverse=True)
+        running = {}
+        finished = queue.Queue()
+        monitor = MemoryMonitor()
+        estimated_peak = 0
+        while pending or running:
+            for index in list(pending):
+                if len(running) >= workers:
+                    break
+                used = workers * WORKER_BASE_BYTES + sum(running.values())
+                if running and budget is not None and used + estimates[index] > budget:
+                    continue
+                pending.remove(index)
+                running[index] = estimates[index]
+                pool.apply_async(Analyze, (work_items[index],),
+                                 callback=lambda result, index=index: finished.put((index, result)),
+                                 error_callback=lambda error, index=index: finished.put((index, error)))
+            estimated_peak = max(estimated_peak, workers * WORKER_BASE_BYTES + sum(running.values()))
+            while True:
+                monitor.sample()
+                try:
+                    index, result = finished.get(timeout=0.5)
+                    break
+                except queue.Empty:
+                    continue
+            monitor.sample()
+            del running[index]
+            if isinstance(result, Exception):
+                print_error(f"Analysis of {getattr(work_items[index], 'name', 'batch')} failed: {repr(result)}")
+                continue
+            yield result
+
+        msg = f"Analysis memory: {Fore.BLUE}{workers}{Style.RESET_ALL} workers, " \
+              f"estimated peak {Fore.BLUE}{estimated_peak / GB:.2f}{Style.RESET_ALL} GB"
+        if budget is not None:
+            msg += f" of {Fore.BLUE}{budget / GB:.2f}{Style.RESET_ALL} GB budget"
+        if monitor.peak is not None:
+            msg += f", measured peak {Fore.BLUE}{monitor.peak / GB:.2f}{Style.RESET_ALL} GB"
+        print(msg)
+
+    def collect_results(self, results) -> List[AnalysisItem]:
+        analyzed_items = []
+        for result in results:
+            items = result.items if isinstance(result, (SequenceAnalysisItem, BatchAnalysisItem)) else [result]
+            for item in items:
+                print_analysis(item)
+                analyzed_items.append(item)
+        return analyzed_items
+
     def save_data(self, file: Path, data):
         json_data = json.dumps(data, indent=2)
         try:
@@ -198,34 +553,61 @@ class ImageAnalyzer:
             print_error(
                 f"Could not save analysis info to {file} [{repr(io_err)}]")
 
+    def item_record(self, item: AnalysisItem) -> dict:
+        record = {"mse": item.mse, "ssi": item.ssi}
+        if item.treshold != self.treshold:
+            record["treshold"] = item.treshold
+        if item.flicker is not None:
+            record["flicker"] = item.flicker
+        return record
+
     def save(self, file:Path):
-        results = {item.name: {"mse": item.mse, "ssi": item.ssi} for item in self.analysis_items}
+        results = {item.name: self.item_record(item) for item in self.analysis_items}
         self.save_data(file, results)
     
     def save_mismatch(self, file:Path):
-        results = {item.name: {"mse": item.mse, "ssi": item.ssi} for item in self.mismatch_items}
+        results = {item.name: self.item_record(item) for item in self.mismatch_items}
         if results:
             self.save_data(file, results)
         else:
             print("No mismatch image information found to save.")
         
     #returns total number of image to analyze and number of matches found
+    # the sequences rendered by the runs of the results folder
+    def load_sequences(self) -> dict:
+        sequences = {}
+        for file in sorted(self.results_path.glob('*_TEST_*.json'), key=lambda file: file.stat().st_mtime):
+            try:
+                with open(file, 'r') as f:
+                    sequences.update(json.load(f).get("sequences", {}))
+            except (IOError, ValueError) as err:
+                print_error(f"Could not read the sequences of {file} [{repr(err)}]")
+        return sequences
+
     def match_results_with_references(self) -> Tuple[int, int, list]:
         # scan the results path and collect all images
         # for each image from results find a reference image
         missing_items = []
         images_directory = self.results_path / 'images'
-        result_image_paths = [Path(f) for f in images_directory.glob('*.png')]
+        # the summarized runs have no images of the passing tests
+        result_image_paths = [Path(f) for f in images_directory.iterdir() if f.suffix.lower() in IMAGE_EXTENSIONS] \
+            if images_directory.exists() else []
         self.to_compare_items = []
         for result_image in result_image_paths:
-            name = result_image.name.split(".")[0]
-            reference_file = self.reference_path / 'images' / f'{name}.reference.png'
+            # <test_name>[.<aov>][.<frame>].result.<ext>
+            extension = result_image.suffix
+            suffix = f'{RESULT_SUFFIX}{extension}'
+            name = result_image.name[:-len(suffix)] if result_image.name.endswith(suffix) else result_image.name.split(".")[0]
+            reference_file = self.reference_path / 'images' / f'{name}{REFERENCE_SUFFIX}{extension}'
             if not reference_file.exists():
                 warn_msg = f'{Fore.YELLOW}Warning: {Fore.GREEN}{reference_file}{Style.RESET_ALL} does not exists'
                 missing_items.append(reference_file)
                 print(warn_msg)
                 continue
-            self.analysis_items.append(AnalysisItem(reference_file, result_image, name, self.analysis_output_path, self.treshold, self.crop))
+            treshold = self.treshold
+            if self.noise_model is not None:
+                treshold = self.noise_model.threshold(name, self.treshold, self.sample_ratio, self.noise_sigma)
+            self.analysis_items.append(AnalysisItem(reference_file, result_image, name, self.analysis_output_path, treshold, self.crop))
 
         number_of_all_items = len(result_image_paths)
         number_of_matcehd_items = len(self.analysis_items)
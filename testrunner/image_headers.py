@@ -0,0 +1,102 @@
+import struct
+
+from .utils import *
+
+# optional - reads the tiff tags, without it the tif images have no header information
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_CHANNELS = {0: 1, 2: 3, 3: 3, 4: 2, 6: 4}  # color type -> channels (palette is decoded to BGR)
+EXR_MAGIC = b'\x76\x2f\x31\x01'
+EXR_PIXEL_BYTES = {0: 4, 1: 2, 2: 4}  # uint, half, float
+EXR_MAX_HEADER = 64 * 1024
+
+
+@dataclass
+class ImageHeader:
+    def __init__(self, height: int, width: int, channels: int, bytes_per_channel: int):
+        self.height = height
+        self.width = width
+        self.channels = channels
+        self.bytes_per_channel = bytes_per_channel
+
+    @property
+    def pixels(self) -> int:
+        return self.height * self.width
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.height, self.width
+
+    @property
+    def floating(self) -> bool:
+        return self.bytes_per_channel > 1
+
+
+# size and pixel format from the file header without decoding the image, None when unknown
+def read_image_header(path: Path) -> ImageHeader:
+    suffix = path.suffix.lower()
+    try:
+        if suffix == '.png':
+            return read_png_header(path)
+        if suffix == '.exr':
+            return read_exr_header(path)
+        if suffix in ['.tif', '.tiff']:
+            return read_tiff_header(path)
+    except (IOError, ValueError, struct.error):
+        pass
+    return None
+
+
+def read_png_header(path: Path) -> ImageHeader:
+    with open(path, 'rb') as f:
+        header = f.read(26)
+    if len(header) < 26 or header[:8] != PNG_SIGNATURE or header[12:16] != b'IHDR':
+        return None
+    width, height, bit_depth, color_type = struct.unpack('>IIBB', header[16:26])
+    return ImageHeader(height, width, PNG_CHANNELS.get(color_type, 3), 2 if bit_depth == 16 else 1)
+
+
+# attributes: name\0 type\0 size value, ends with an empty name
+def read_exr_header(path: Path) -> ImageHeader:
+    with open(path, 'rb') as f:
+        data = f.read(EXR_MAX_HEADER)
+    if data[:4] != EXR_MAGIC:
+        return None
+    position = 8
+    window = None
+    channels = []
+    while position < len(data) and data[position] != 0:
+        name_end = data.index(b'\0', position)
+        type_end = data.index(b'\0', name_end + 1)
+        name = data[position:name_end]
+        size, = struct.unpack('<i', data[type_end + 1:type_end + 5])
+        value = data[type_end + 5:type_end + 5 + size]
+        if name == b'dataWindow':
+            window = struct.unpack('<iiii', value[:16])
+        elif name == b'channels':
+            channel = 0
+            while channel < len(value) and value[channel] != 0:
+                channel_end = value.index(b'\0', channel)
+                pixel_type, = struct.unpack('<i', value[channel_end + 1:channel_end + 5])
+                channels.append(EXR_PIXEL_BYTES.get(pixel_type, 4))
+                channel = channel_end + 17
+        position = type_end + 5 + size
+    if window is None or not channels:
+        return None
+    x_min, y_min, x_max, y_max = window
+    # opencv decodes every channel to float
+    return ImageHeader(y_max - y_min + 1, x_max - x_min + 1, len(channels), 4)
+
+
+def read_tiff_header(path: Path) -> ImageHeader:
+    if tifffile is None:
+        return None
+    with tifffile.TiffFile(str(path)) as tiff:
+        page = tiff.pages[0]
+        height, width = page.shape[0], page.shape[1]
+        channels = page.shape[2] if len(page.shape) > 2 else 1
+        return ImageHeader(height, width, channels, page.dtype.itemsize)
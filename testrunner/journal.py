@@ -0,0 +1,52 @@
+import os
+
+from .utils import *
+
+JOURNAL_NAME = 'journal.jsonl'
+
+
+'''
+Append only record of the test results, one json line written and flushed to disk after every test.
+An interrupted run (crash, reboot, Ctrl-C) keeps everything completed so far and can be resumed.
+'''
+class ResultsJournal:
+    def __init__(self, results_path: Path):
+        self.file = results_path / JOURNAL_NAME
+
+    def reset(self) -> None:
+        if self.file.exists():
+            os.remove(self.file)
+
+    # replaces the journal with the records at once, a crash leaves the old or the new journal
+    def rewrite(self, records: List[dict]) -> None:
+        temp = self.file.with_name(f'.{self.file.name}.tmp')
+        try:
+            with open(temp, 'w') as f:
+                f.writelines(json.dumps(record) + '\n' for record in records)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp, self.file)
+        except IOError as io_err:
+            print_error(f"Could not rewrite the results journal {self.file} [{repr(io_err)}]")
+
+    def append(self, record: dict) -> None:
+        try:
+            with open(self.file, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        except IOError as io_err:
+            print_error(f"Could not write to the results journal {self.file} [{repr(io_err)}]")
+
+    def load(self) -> List[dict]:
+        records = []
+        if not self.file.exists():
+            return records
+        with open(self.file, 'r') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.decoder.JSONDecodeError:
+                    # the last line may be cut by the crash
+                    print(f"{Fore.YELLOW}Warning:{Style.RESET_ALL} skipping damaged journal line in {self.file}")
+        return records
@@ -0,0 +1,137 @@
+import hashlib
+import os
+
+from .history import DurationHistory
+from .utils import *
+
+MANIFEST_VERSION = 1
+
+
+'''
+Resolves the include graph of the test json files once into a flat list of tests.
+Every test gets the inherited tags, the json file it comes from, the scene size and the historical
+render duration. The result is cached in cache/manifest_<hash>.json and reused until any of the
+json files, scenes or execution results it was built from changes.
+'''
+class TestManifest:
+    def __init__(self, test_files: list, root_path: Path, program: str):
+        self.test_files = [Path(f).resolve() for f in test_files]
+        self.root_path = root_path
+        self.program = program
+        self.scenes_root = root_path / 'scenes'
+        self.history = DurationHistory(root_path, program)
+        key = hashlib.sha1('|'.join([program] + [str(f) for f in self.test_files]).encode()).hexdigest()[:16]
+        self.cache_file = root_path / 'cache' / f'manifest_{key}.json'
+
+    def load(self) -> list:
+        cached = self.load_cache()
+        if cached is not None:
+            return cached['tests']
+        compiled = self.compile()
+        self.save_cache(compiled)
+        return compiled['tests']
+
+    def compile(self) -> dict:
+        tests = []
+        sources = {}
+        names = {}
+        for test_file in self.test_files:
+            self.resolve(test_file, [], [], tests, sources, names)
+
+        durations = self.history.load()
+        scenes = {}
+        for test in tests:
+            scene = self.scenes_root / Path(test['path_to_scene'])
+            stat = scene.stat() if scene.exists() else None
+            scenes[str(scene)] = stat.st_mtime if stat else None
+            test['scene_size'] = stat.st_size if stat else None
+            test['duration'] = durations.get(test['test_name'])
+
+        history_files = {str(f): f.stat().st_mtime for f in self.history.files()}
+        return {'version': MANIFEST_VERSION, 'sources': sources, 'scenes': scenes,
+                'history': history_files, 'tests': tests}
+
+    def resolve(self, test_json: Path, chain: list, tags: list, tests: list, sources: dict, names: dict) -> None:
+        test_json = test_json.resolve()
+        if test_json in chain:
+            cycle = ' -> '.join(str(f) for f in chain[chain.index(test_json):] + [test_json])
+            raise ValueError(f'Include cycle detected: {cycle}')
+        with open(test_json, 'r') as test_file:
+            conf = json.load(test_file)
+        sources[str(test_json)] = test_json.stat().st_mtime
+        file_tags = merge_tags(tags, conf.get('tags'))
+        for t in conf['tests']:
+            if 'include' in t:
+                self.resolve(test_json.parent / t['include'], chain + [test_json],
+                             merge_tags(file_tags, t.get('tags')), tests, sources, names)
+                continue
+            name = t['test_name']
+            if name in names:
+                first = names[name]
+                # the outputs are named after the test, the second render would overwrite the first one
+                if first['path_to_scene'] != t['path_to_scene']:
+                    raise ValueError(f'Duplicate test name [{name}] for different scenes: '
+                                     f'{first["path_to_scene"]} ({first["source"]}) and {t["path_to_scene"]} ({test_json})')
+                print(f'{Fore.YELLOW}Warning:{Style.RESET_ALL} test [{name}] from {test_json} is already defined in {first["source"]}, skipping')
+                continue
+            test = dict(t)
+            test['tags'] = merge_tags(file_tags, t.get('tags'))
+            test['source'] = str(test_json)
+            names[name] = test
+            tests.append(test)
+
+    def load_cache(self):
+        if not self.cache_file.exists():
+            return None
+        try:
+            with open(self.cache_file, 'r') as f:
+                cached = json.load(f)
+        except (IOError, json.decoder.JSONDecodeError):
+            return None
+        if cached.get('version') != MANIFEST_VERSION:
+            return None
+        if not all(self.mtime(Path(f)) == mtime for f, mtime in cached['sources'].items()):
+            return None
+        if not all(self.mtime(Path(f)) == mtime for f, mtime in cached['scenes'].items()):
+            return None
+        history_files = {str(f): f.stat().st_mtime for f in self.history.files()}
+        if history_files != cached['history']:
+            return None
+        return cached
+
+    def save_cache(self, compiled: dict) -> None:
+        try:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.cache_file, 'w') as f:
+                json.dump(compiled, f, indent=2)
+        except IOError as io_err:
+            print_error(f"Could not save test manifest to {self.cache_file} [{repr(io_err)}]")
+
+    @staticmethod
+    def mtime(path: Path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+
+# tags declared on a file or on an include directive are inherited by every test below it
+def merge_tags(inherited, own) -> List[str]:
+    tags = list(inherited or [])
+    for tag in own or []:
+        tag = tag.lower()
+        if tag not in tags:
+            tags.append(tag)
+    return tags
+
+
+def load_test_files(tests: list, root_path: Path, program: str) -> list:
+    print(f'{Fore.GREEN}Processing files from{Style.RESET_ALL}: {tests}:', end= ' ')
+    try:
+        scene_files = TestManifest(tests, root_path, program).load()
+    except (IOError, ValueError) as err:
+        print()
+        print_error(repr(err))
+        exit(EXIT_FAILURE)
+    print(f'{Fore.BLUE}{len(scene_files)}{Style.RESET_ALL} tests were found')
+    return scene_files
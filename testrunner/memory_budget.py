@@ -0,0 +1,89 @@
+import os
+from multiprocessing import active_children
+
+from .image_headers import ImageHeader
+from .utils import *
+
+# optional - memory of the processes on every platform, without it it is read from /proc
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+GB = 1024 ** 3
+# python, numpy, opencv, scikit-image and matplotlib loaded by every worker
+WORKER_BASE_BYTES = 250 * 1024 ** 2
+# float64 arrays alive at once in structural_similarity: inputs, filtered moments, their products and the ssim map
+SSIM_FLOAT_ARRAYS = 20
+# the 19.2x10.8 inch diff plot at 300 dpi: the RGBA canvas and the resampled images
+PLOT_BYTES = 2 * 5760 * 3240 * 4
+# share of the available memory used when --memory-budget is not given
+DEFAULT_BUDGET_RATIO = 0.8
+# assumed for the images which header can't be read: 4k with 4 float channels
+UNKNOWN_IMAGE = ImageHeader(2160, 3840, 4, 4)
+
+
+def available_memory() -> int:
+    if psutil is not None:
+        return psutil.virtual_memory().available
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def default_memory_budget() -> int:
+    available = available_memory()
+    return int(available * DEFAULT_BUDGET_RATIO) if available else None
+
+
+# decoded color images, their gray versions and the ssim intermediates of one pair
+def estimate_pair_memory(reference: ImageHeader, result: ImageHeader) -> int:
+    reference = reference or UNKNOWN_IMAGE
+    result = result or UNKNOWN_IMAGE
+    decoded = reference.pixels * reference.channels * reference.bytes_per_channel + \
+        result.pixels * result.channels * result.bytes_per_channel
+    gray = (reference.pixels + result.pixels) * (8 if reference.floating else 1)
+    return decoded + gray + reference.pixels * SSIM_FLOAT_ARRAYS * 8
+
+
+# the most workers which base memory and smallest items fit the budget
+def workers_for_budget(estimates: List[int], budget: int, cpu_count: int) -> int:
+    if budget is None or not estimates:
+        return max(1, min(cpu_count, len(estimates)))
+    workers = 0
+    total = 0
+    for estimate in sorted(estimates)[:cpu_count]:
+        total += WORKER_BASE_BYTES + estimate
+        if total > budget:
+            break
+        workers += 1
+    return max(1, workers)
+
+
+# resident memory of the process, None when it can't be measured
+def process_memory(pid: int) -> int:
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except psutil.Error:
+            return None
+    try:
+        with open(f'/proc/{pid}/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, ValueError, IndexError, AttributeError):
+        return None
+
+
+'''
+Peak of the total resident memory of the analysis workers sampled while they run
+'''
+class MemoryMonitor:
+    def __init__(self):
+        self.peak = None
+
+    def sample(self) -> None:
+        sizes = [process_memory(child.pid) for child in active_children()]
+        sizes = [size for size in sizes if size is not None]
+        if sizes:
+            self.peak = max(self.peak or 0, sum(sizes))
@@ -0,0 +1,82 @@
+import statistics
+
+import numpy as np
+
+from .image_analysis import AnalysisItem
+from .utils import *
+
+NOISE_MODEL_FILE = 'noise_model.json'
+DEFAULT_NOISE_SIGMA = 3.0
+
+
+'''
+Monte-carlo noise of the references measured by rendering every reference scene several times
+(--reference --calibrate N). For every reference image it keeps the distribution of the mse between
+the repeated renders and the reference, and the mean per-pixel variance of the renders.
+
+Two independent renders with the same samples differ by mse ~ 2*var, a render with a fraction r
+of the reference samples has r times fewer samples so its variance grows 1/r times:
+mse(fast, reference) ~ var/r + var = mse_mean * (1 + 1/r) / 2
+'''
+class NoiseModel:
+    def __init__(self, references_path: Path):
+        self.file = references_path / NOISE_MODEL_FILE
+        self.entries = {}
+        if self.file.exists():
+            try:
+                with open(self.file, 'r') as f:
+                    self.entries = json.load(f)
+            except (IOError, json.decoder.JSONDecodeError) as err:
+                print(f"{Fore.YELLOW}Warning:{Style.RESET_ALL} ignoring noise model {self.file} [{repr(err)}]")
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.entries
+
+    def set(self, name: str, statistics: dict) -> None:
+        self.entries[name] = statistics
+
+    # the global treshold is the lower bound, the noise model only relaxes it for the noisy images,
+    # both are scaled by the noise growth of the renders with fewer samples
+    def threshold(self, name: str, treshold: float, sample_ratio: float = 1.0, sigma: float = DEFAULT_NOISE_SIGMA) -> float:
+        scale = (1.0 + 1.0 / sample_ratio) / 2.0
+        entry = self.entries.get(name)
+        if entry is None:
+            return scale * treshold
+        return scale * max(treshold, entry['mse_mean'] + sigma * entry['mse_std'])
+
+    def save(self) -> None:
+        try:
+            with open(self.file, 'w') as f:
+                json.dump(self.entries, f, indent=2, sort_keys=True)
+        except IOError as io_err:
+            print_error(f"Could not save noise model to {self.file} [{repr(io_err)}]")
+
+
+def measure_noise(reference: Path, samples: List[Path], crop: bool = False) -> dict:
+    mse = []
+    count = 0
+    mean = None
+    m2 = None
+    for sample in [reference] + samples:
+        item = AnalysisItem(reference, sample, reference.name, reference.parent, crop=crop)
+        cv_ref, cv_res = item.load_gray_images()
+        if sample != reference:
+            item.compute_mse_and_ssi((cv_ref, cv_res))
+            mse.append(float(item.mse))
+        # Welford's running per-pixel variance
+        values = cv_res.astype(np.float64)
+        count += 1
+        if mean is None:
+            mean = np.zeros_like(values)
+            m2 = np.zeros_like(values)
+        delta = values - mean
+        mean += delta / count
+        m2 += delta * (values - mean)
+
+    return {
+        'samples': len(samples),
+        'mse': mse,
+        'mse_mean': statistics.mean(mse),
+        'mse_std': statistics.pstdev(mse),
+        'pixel_variance': float(np.mean(m2 / (count - 1))) if count > 1 else 0.0
+    }
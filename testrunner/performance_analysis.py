@@ -5,6 +5,7 @@ from bs4 import BeautifulSoup
 import re
 from testrunner.utils import Path
 
+from .render_cache import STATE_UNKNOWN, load_cache_states
 from .utils import *
 
 USE_MULTIPROCESSING_ANALYSIS = True
@@ -23,26 +24,36 @@ class AnalysisItem(ABC):
     name: str
     record = dict()
 
-    def __init__(self, reference: Path, result: Path, name: str):
+    # information is what get_information read from the result log of a summarized run
+    def __init__(self, reference: Path, result: Path, name: str, information: list = None):
         self.reference = reference
         self.result = result
         self.name = name
+        self.information = information
     
     @abstractmethod
     def analyze(self):
         pass    
 
+    @abstractmethod
+    def get_information(self, data):
+        pass
+
+    def result_information(self):
+        if self.information is not None:
+            return self.information
+        return self.get_information(read_html(self.result))
+
 
 class BenchmarkAnalysisItem(AnalysisItem):
 
-    def __init__(self, reference: Path, result: Path, name: str):
-        super().__init__(reference, result, name)
+    def __init__(self, reference: Path, result: Path, name: str, information: list = None):
+        super().__init__(reference, result, name, information)
 
     def analyze(self):
         reference_data = read_html(self.reference)
         reference_time, reference_gpus = self.get_information(reference_data)
-        result_data = read_html(self.result)
-        result_time, result_gpus = self.get_information(result_data)
+        result_time, result_gpus = self.result_information()
 
         self.record = {
             'Name': self.name,
@@ -74,15 +85,14 @@ class BenchmarkAnalysisItem(AnalysisItem):
 
 class CmdLineAnalysisItem(AnalysisItem):
 
-    def __init__(self, reference: Path, result: Path, name: str):
-        super().__init__(reference, result, name)
+    def __init__(self, reference: Path, result: Path, name: str, information: list = None):
+        super().__init__(reference, result, name, information)
     
     def analyze(self):
         reference_data =  read_html(self.reference)
         reference_gpu_time, reference_total_time, reference_gpu_count, reference_gpu_names = self.get_information(reference_data)
 
-        result_data = read_html(self.result)
-        result_gpu_time, result_total_time, result_gpu_count, result_gpu_names = self.get_information(result_data)
+        result_gpu_time, result_total_time, result_gpu_count, result_gpu_names = self.result_information()
 
         self.record = {
             "Name": self.name,
@@ -128,6 +138,37 @@ class CmdLineAnalysisItem(AnalysisItem):
         return gpu_time, total_time, gpu_info, gpu_names
         
 
+DURATION_UNITS = {'ms': 0.001, 's': 1.0, 'm': 60.0, 'h': 3600.0}
+
+
+# "12.3s", "1m 2.5s", "250ms", "00h:01m:02s" -> seconds, None when there is no duration
+def parse_seconds(text: str) -> float:
+    if not text:
+        return None
+    parts = re.findall(r'(\d+(?:\.\d+)?)\s*(ms|h|m|s)\b', text)
+    if not parts:
+        return None
+    return sum(float(value) * DURATION_UNITS[unit] for value, unit in parts)
+
+
+# render time and number of devices reported by the renderer, None when the log does not tell
+def log_render_info(log_file: Path, program: str) -> Tuple[float, int]:
+    try:
+        data = read_html(log_file)
+    except IOError:
+        return None, None
+    if program == 'redshiftBenchmark':
+        render_time, gpus = BenchmarkAnalysisItem(log_file, log_file, '').get_information(data)
+        return (render_time if render_time != "" else None), (len(gpus.split(',')) if gpus else None)
+    _, total_time, gpu_count, _ = CmdLineAnalysisItem(log_file, log_file, '').get_information(data)
+    return parse_seconds(total_time), (int(gpu_count) if gpu_count.isdigit() else None)
+
+
+# render time without the process start and the scene loading
+def log_render_time(log_file: Path, program: str) -> float:
+    return log_render_info(log_file, program)[0]
+
+
 class PerformanceAnalyzer:
 
     reference_path: Path
@@ -153,19 +194,32 @@ class PerformanceAnalyzer:
         for item in items:
             item.analyze()
         records = [item.record for item in items]
+        self.add_cache_states(records)
         return records        
+
+    # cold and warm renders are not comparable, every time is tagged with the cache state of its render
+    # and the cold start time of the pre-warm render
+    def add_cache_states(self, records: List[dict]) -> None:
+        for prefix, path in [('Result', self.results_path), ('Reference', self.reference_path)]:
+            states = load_cache_states(path)
+            for record in records:
+                cache = states.get(record['Name'], {})
+                prewarm = cache.get('prewarm') or {}
+                record[f'{prefix} Cache State'] = cache.get('state', STATE_UNKNOWN)
+                record[f'{prefix} Cold Time[s]'] = prewarm.get('log') if prewarm.get('log') is not None else ""
             
 
     def get_analysis_item(self, item)->AnalysisItem:
         if self.analysis_type == 'redshiftCmdLine':
-            return CmdLineAnalysisItem(item['reference'], item['result'], item['name'])
+            return CmdLineAnalysisItem(item['reference'], item['result'], item['name'], item.get('information'))
         else:
-            return BenchmarkAnalysisItem(item['reference'], item['result'], item['name'])
+            return BenchmarkAnalysisItem(item['reference'], item['result'], item['name'], item.get('information'))
 
     def match_results_with_references(self):
         missing_items = []
         results_logs = self.results_path / 'logs'
-        result_items = [Path(f) for f in results_logs.glob("*.html")]
+        # the logs of the compacted runs are compressed
+        result_items = [Path(f) for f in results_logs.glob("*.html*") if f.suffix in ['.html'] + COMPRESSED_LOG_SUFFIXES]
 
         items = []
         for result in result_items:
@@ -178,6 +232,14 @@ class PerformanceAnalyzer:
                 continue
             #print(result)
             items.append({'name': name, 'reference': reference_file, 'result': result})
+
+        # the summarized runs keep what was read from the logs of the passing tests
+        matched = {item['name'] for item in items}
+        for name, test in load_summary(self.results_path).get('tests', {}).items():
+            reference_file = self.reference_path / 'logs' / f'{name}.reference.html'
+            if name in matched or test.get('performance') is None or not reference_file.exists():
+                continue
+            items.append({'name': name, 'reference': reference_file, 'result': None, 'information': test['performance']})
         
         return items, missing_items
 
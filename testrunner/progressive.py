@@ -0,0 +1,52 @@
+from .utils import *
+
+DECISION_CONVERGED = 'converged'
+DECISION_DIVERGED = 'diverged'
+DECISION_COMPLETED = 'completed'
+
+DEFAULT_DIVERGENCE_FACTOR = 4.0
+# the last pass is the full quality render, the fraction of the reference samples of a pass is its
+# "ratio" or its UnifiedMaxSamples over the samples of the reference render options
+DEFAULT_PROGRESSIVE_PASSES = [
+    {"options": {"UnifiedMaxSamples": 32}},
+    {"options": {"UnifiedMaxSamples": 64}},
+    {"options": {"UnifiedMaxSamples": 128}}
+]
+
+def progressive_passes(config: dict) -> List[dict]:
+    return config.get('optional', {}).get('progressive_passes', DEFAULT_PROGRESSIVE_PASSES)
+
+
+# fraction of the reference samples rendered by the pass
+def pass_ratio(render_pass: dict, base_options: Path) -> float:
+    if "ratio" in render_pass:
+        return render_pass["ratio"]
+    ratio = samples_ratio(render_pass["options"].get("UnifiedMaxSamples"), base_options)
+    return ratio if ratio is not None else 1.0
+
+
+# render options of the pass: the base options with the pass overrides
+def write_pass_options(base_options: Path, overrides: dict, file: Path) -> Path:
+    lines = []
+    if base_options.exists():
+        with open(base_options, 'r') as f:
+            lines = [line.rstrip('\n') for line in f if line.strip()]
+    lines = [line for line in lines if line.split()[0] not in overrides]
+    lines += [f'{key} {value}' for key, value in overrides.items()]
+    file.parent.mkdir(parents=True, exist_ok=True)
+    with open(file, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return file
+
+
+'''
+Decides if the pass rendered with a fraction of the samples already tells the final result.
+Converged - every image is under the full quality treshold, more samples only lower the noise.
+Diverged - an image is far above the treshold expected for the noise of the pass.
+'''
+def judge_pass(metrics: dict, thresholds: dict, pass_thresholds: dict, divergence_factor: float) -> str:
+    if any(metrics[name] > divergence_factor * pass_thresholds[name] for name in metrics):
+        return DECISION_DIVERGED
+    if all(metrics[name] <= thresholds[name] for name in metrics):
+        return DECISION_CONVERGED
+    return None
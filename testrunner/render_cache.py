@@ -0,0 +1,96 @@
+import shutil
+
+from .utils import *
+
+CACHE_DEFAULT = 'default'
+CACHE_ISOLATED = 'isolated'
+CACHE_SHARED = 'shared'
+CACHE_COLD = 'cold'
+CACHE_POLICIES = [CACHE_DEFAULT, CACHE_ISOLATED, CACHE_SHARED, CACHE_COLD]
+
+# state of the cache at the start of the render
+STATE_COLD = 'cold'  # the scene was never rendered with the cache
+STATE_WARM = 'warm'  # the scene was rendered with the cache before (the pre-warm pass or an earlier run)
+STATE_UNKNOWN = 'unknown'  # the cache of the redshift preferences, anything could be in it
+CACHE_JSON = 'cache.json'
+# scenes rendered with the cache, kept in the cache folder
+WARMED_JSON = 'warmed.json'
+SHARED_CACHE_PATH = Path('cache') / 'render'
+
+
+'''
+Texture and shader cache of the renders, redshift uses the folder given by REDSHIFT_CACHEPATH.
+    default  - the cache folder of the redshift preferences
+    isolated - a cache of the run, cold at the start of the run and removed at its end
+    shared   - a cache kept between the runs, warm for the scenes rendered before
+    cold     - emptied before every render
+'''
+class RenderCache:
+    def __init__(self, policy: str, root_path: Path, results_path: Path, env: dict):
+        self.policy = policy
+        self.path = None
+        if policy in [CACHE_ISOLATED, CACHE_COLD]:
+            self.path = results_path / 'cache'
+        elif policy == CACHE_SHARED:
+            self.path = root_path / SHARED_CACHE_PATH
+        if self.path:
+            self.path.mkdir(parents=True, exist_ok=True)
+            env['REDSHIFT_CACHEPATH'] = str(self.path)
+        self.warmed = set(self.load_warmed())
+
+    def load_warmed(self) -> List[str]:
+        if not self.path or not (self.path / WARMED_JSON).exists():
+            return []
+        try:
+            with open(self.path / WARMED_JSON, 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError) as err:
+            print_error(f"Could not read the warmed scenes of {self.path} [{repr(err)}]")
+            return []
+
+    # prepares the cache for the render of the scene and returns its state
+    def prepare(self, name: str) -> str:
+        if self.policy == CACHE_COLD:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.path.mkdir(parents=True, exist_ok=True)
+            self.warmed.clear()
+            return STATE_COLD
+        if name in self.warmed:
+            return STATE_WARM
+        return STATE_UNKNOWN if self.policy == CACHE_DEFAULT else STATE_COLD
+
+    def rendered(self, name: str) -> None:
+        if name in self.warmed:
+            return
+        self.warmed.add(name)
+        if not self.path or self.policy == CACHE_COLD:
+            return
+        try:
+            with open(self.path / WARMED_JSON, 'w') as f:
+                json.dump(sorted(self.warmed), f, indent=2)
+        except IOError as io_err:
+            print_error(f"Could not save the warmed scenes to {self.path} [{repr(io_err)}]")
+
+    # the isolated and cold caches live only during the run
+    def close(self) -> None:
+        if self.policy in [CACHE_ISOLATED, CACHE_COLD]:
+            shutil.rmtree(self.path, ignore_errors=True)
+
+
+def save_cache_states(records: dict, results_path: Path) -> None:
+    try:
+        with open(results_path / CACHE_JSON, 'w') as f:
+            json.dump(records, f, indent=2)
+    except IOError as io_err:
+        print_error(f"Could not save the cache states to {results_path} [{repr(io_err)}]")
+
+
+def load_cache_states(results_path: Path) -> dict:
+    if not (results_path / CACHE_JSON).exists():
+        return {}
+    try:
+        with open(results_path / CACHE_JSON, 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError) as err:
+        print_error(f"Could not read the cache states of {results_path} [{repr(err)}]")
+        return {}
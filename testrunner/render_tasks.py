@@ -3,22 +3,75 @@
 import json
 import os as os
 import shutil
+import time
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 
 from pathlib import Path
 
+from .ab_comparison import *
+from .artifact_store import ArtifactManifest, ArtifactStore
+from .fail_fast import *
+from .gpu_scaling import *
+from .journal import ResultsJournal
+from .manifest import load_test_files
+from .image_analysis import AnalysisItem
+from .noise_model import NoiseModel, measure_noise
+from .performance_analysis import log_render_info, log_render_time
+from .progressive import *
+from .render_cache import RenderCache, save_cache_states
+from .scheduling import order_tests, print_schedule
+from .selection import TestSelector
 from .utils import *
 
 
+# frame number in the scene file name: scene.####.rs or scene.0001.rs
+FRAME_NUMBER_PATTERN = re.compile(r'#+|(?<=\.)\d+(?=\.[^.]+$)')
+
+
+# "<start>,<end>[,<step>]" -> list of frames, "scene" -> None (frames defined by the scene)
+def parse_frames(value) -> List[int]:
+    if value == 'scene':
+        return None
+    parts = value.split(',') if isinstance(value, str) else list(value)
+    start, end = int(float(parts[0])), int(float(parts[1]))
+    step = int(float(parts[2])) if len(parts) > 2 else 1
+    return list(range(start, end + 1, step))
+
+
+def glob_escape(value: str) -> str:
+    return re.sub(r'([*?\[])', r'[\1]', value)
+
+
 @dataclass(repr=True)
 class Scene:
     def __init__(self, param: dict, root_path: Path):
         self.name = param["test_name"]
         self.path = root_path / 'scenes' / Path(param["path_to_scene"])
         self.type = self.path.suffix
-        self.frames = ('1', '1') if not "frames" in param else param["frames"]
+        self.frames_given = "frames" in param
+        self.frames = [1] if not self.frames_given else parse_frames(param["frames"])
         self.skippostfx = "false" if not "skippostfx" in param else param["skippostfx"]
+        self.tags = param.get("tags", [])
+
+    # redshift scenes hold a single frame, a sequence is a set of numbered .rs files
+    def frame_paths(self) -> List[Path]:
+        name = self.path.name
+        match = FRAME_NUMBER_PATTERN.search(name)
+        if not match:
+            return [self.path]
+        prefix, width, suffix = name[:match.start()], len(match.group(0)), name[match.end():]
+        if self.frames is None:
+            # "scene" - all the numbered files of the sequence
+            frames = sorted(self.path.parent.glob(f'{glob_escape(prefix)}{"[0-9]" * width}{glob_escape(suffix)}'))
+            return frames if frames else [self.path]
+        if not self.frames_given and not match.group(0).startswith('#'):
+            return [self.path]
+        return [self.path.with_name(f'{prefix}{str(frame).zfill(width)}{suffix}') for frame in self.frames]
+
+
+# per test details next to the results
+DETAIL_SECTIONS = ["progressive", "comparison", "scaling", "cache", "sequences"]
 
 
 '''
@@ -26,20 +79,71 @@ Keeps the information about the scenes
 that Succeeded, Failed or skipped
 '''
 class ExecutionResults:
-    def __init__(self):
+    def __init__(self, journal: ResultsJournal = None, full_quality: bool = True):
+        self.journal = journal
         self.info = {
             "summary": {},  # dict
+            "full_quality": full_quality,  # false for the reduced samples and progressive renders, their durations are not kept in the history
             "success": [],
             "failed": [],
-            "skipped": []
+            "skipped": [],
+            "durations": {},  # test name -> render time [s]
+            "progressive": {},  # test name -> passes rendered and the early termination decision
+            "comparison": {},  # test name -> render times and image differences of the A/B builds
+            "scaling": {},  # test name -> render times with the device sets of the GPU sweep
+            "cache": {},  # test name -> cache policy, cache state of the render and the pre-warm render times
+            "sequences": {}  # test name -> scene files and result images of the tests rendering several frames
         }
 
-    def add_result(self, type: str, scene: Scene, err_msg: str = "") -> None:
+    def add_result(self, type: str, scene: Scene, err_msg: str = "", duration: float = None) -> None:
         self.info[type].append((scene.name, str(scene.path), err_msg))
+        if duration is not None:
+            self.info["durations"][scene.name] = duration
+        if self.journal:
+            self.journal.append({"type": type, "name": scene.name, "path": str(scene.path), "msg": err_msg, "duration": duration})
+
+    def add_progressive(self, scene: Scene, record: dict) -> None:
+        self.add_details("progressive", scene, record)
+
+    def add_comparison(self, scene: Scene, record: dict) -> None:
+        self.add_details("comparison", scene, record)
+
+    def add_scaling(self, scene: Scene, record: dict) -> None:
+        self.add_details("scaling", scene, record)
+
+    def add_sequence(self, scene: Scene, record: dict) -> None:
+        self.add_details("sequences", scene, record)
+
+    def add_cache(self, scene: Scene, record: dict) -> None:
+        self.add_details("cache", scene, record)
+
+    def add_details(self, section: str, scene: Scene, record: dict) -> None:
+        self.info[section][scene.name] = record
+        if self.journal:
+            self.journal.append({"type": section, "name": scene.name, "record": record})
+
+    # rebuilds the results of an interrupted run, skipped tests are not restored so they are retried
+    def restore(self, records: List[dict]) -> set:
+        completed = {}
+        details = {section: {} for section in DETAIL_SECTIONS}
+        for record in records:
+            if record["type"] in DETAIL_SECTIONS:
+                details[record["type"]][record["name"]] = record["record"]
+            elif record["type"] in ["success", "failed"]:
+                # the last record wins when a test was rendered again
+                completed[record["name"]] = record
+        for name, record in completed.items():
+            self.info[record["type"]].append((name, record["path"], record["msg"]))
+            if record["duration"] is not None:
+                self.info["durations"][name] = record["duration"]
+            for section in DETAIL_SECTIONS:
+                if name in details[section]:
+                    self.info[section][name] = details[section][name]
+        return set(completed.keys())
 
     def _summary(self) -> None:
-        summary = {key: len(value)
-                   for key, value in self.info.items() if key != 'summary'}
+        summary = {key: len(self.info[key])
+                   for key in ["success", "failed", "skipped"]}
         self.info["summary"] = summary
 
     def save(self, file: Path) -> None:
@@ -56,8 +160,9 @@ class ExecutionResults:
 class Task(ABC):
     def __init__(self, params: ExecutionParameters):
         self.params = params
-        self.scenes = load_test_files(params.tests)
+        self.scenes = TestSelector(params).select(load_test_files(params.tests, params.root_path, params.program))
         self.env = os.environ.copy()
+        self.env.update(params.environment)
         self.reference_path = params.root_path / 'references'
         self.results_path = Path()
 
@@ -83,10 +188,14 @@ class RenderingTask(Task):
     end_msg: str
     results_json_log = Path
     execution_results: ExecutionResults
+    count: int
+    index: int
+    success: int
+    skipped: int
+    errors: int
     
     def __init__(self, params: ExecutionParameters):
         super().__init__(params)
-        self.execution_results = ExecutionResults()
         self.env['REDSHIFT_PATHOVERRIDE_STRING'] = self.params.user_config['required']['redshift_project_root']
         print(f'{Fore.MAGENTA}Executing {Fore.GREEN}{params.program}{Style.RESET_ALL} [reference: {self.params.reference}]')
 
@@ -100,14 +209,23 @@ class RenderingTask(Task):
         self.images_path.mkdir(parents=True, exist_ok=True)
         self.logs_path.mkdir(parents=True, exist_ok=True)
         self.commons_path.mkdir(parents=True, exist_ok=True)
+
+        self.store = ArtifactStore.for_run(self.results_path)
+        self.artifacts = ArtifactManifest(self.results_path)
+        self.journal = ResultsJournal(self.results_path)
+        self.execution_results = ExecutionResults(self.journal, not self.params.fast and not self.params.progressive)
+        self.render_cache = RenderCache(self.params.cache_policy, self.params.root_path, self.results_path, self.env)
+        if self.params.prewarm:
+            (self.logs_path / 'prewarm').mkdir(parents=True, exist_ok=True)
         
     def clear_temp(self):
         shutil.rmtree(self.temp_output_path)
         Path.mkdir(self.temp_output_path, parents=True)
     
     def handle_result(self, return_code: int, test_name: str) -> Tuple[bool, str]:
-        log_file = get_latest_log_path() / "log.html"
-        shutil.copy2(log_file, self.logs_path / f'{test_name}{self.result_suffix}.html')
+        log_file = get_latest_log_path(self.env) / "log.html"
+        log_copy = self.logs_path / f'{test_name}{self.result_suffix}.html'
+        self.artifacts.add(log_copy, self.store.store(log_file, log_copy))
 
         if return_code != 0:
             result, msg = analyze_latest_log(log_file)
@@ -115,96 +233,319 @@ class RenderingTask(Task):
                 return result, msg
             return False, "Process did not ended successfully!"
         
+        output_images, msg = self.collect_output_images()
+        if not output_images and msg:
+            return False, msg
+        self.result_images = [self.rename_and_move_to_results(output_image, test_name) for output_image in output_images]
+        return True, "Success"
+
+    def collect_output_images(self) -> Tuple[List[Path], str]:
         if self.params.program == "redshiftBenchmark":
             if get_os_tag() == "win":
                 output_image = self.params.root_path / 'redshiftBenchmarkOutput.png'
             else:
                 output_image = Path.home() / 'redshiftBenchmarkOutput.png'       
             if not output_image.exists():
-                return False, f"{output_image} does bit exists"
-            self.rename_and_move_to_results(output_image, test_name)
-        else:
-            output_images = [Path(file_path)
-                            for file_path in self.temp_output_path.glob('**/*.png')]
-            for output_image in output_images:
-                self.rename_and_move_to_results(output_image, test_name)
-        return True, "Success"
-    
-    def rename_and_move_to_results(self, output_image:Path, name:str):
-         # change output image name to test_name
+                return [], f"{output_image} does bit exists"
+            return [output_image], ""
+        extensions = OUTPUT_FORMAT_EXTENSIONS[self.params.output_format]
+        output_images = [Path(file_path)
+                        for file_path in self.temp_output_path.glob('**/*') if file_path.suffix.lower() in extensions]
+        return output_images, ""
+
+    # change output image name to test_name
+    def result_image_name(self, output_image: Path, name: str) -> str:
+        extension = output_image.suffix.lower()
         if len(output_image.suffixes) > 1:
             name_parts = [name] + \
-                output_image.suffixes[:-1] + [f"{self.result_suffix}.png"]
+                output_image.suffixes[:-1] + [f"{self.result_suffix}{extension}"]
         else:
-            name_parts = [name] + [f"{self.result_suffix}.png"]
-        name = "".join(name_parts)
-        suffixed_image_path = output_image.with_name(name)
-        if suffixed_image_path.exists():
-            print(f"{Fore.YELLOW}Warning:{Style.RESET_ALL} removing [{suffixed_image_path}]")
-            os.remove(suffixed_image_path)
-        output_image.rename(suffixed_image_path)
-        output_image = suffixed_image_path
-        if Path.exists(self.images_path / name):
-            print(f"{Fore.YELLOW}Warning:{Style.RESET_ALL} removing [{self.images_path / name}]")
-            os.remove(self.images_path / name)
-        shutil.move(str(output_image), self.images_path)
-
-    def prepare_command_line_params(self, scene: Scene) -> list:
+            name_parts = [name] + [f"{self.result_suffix}{extension}"]
+        return "".join(name_parts)
+    
+    def rename_and_move_to_results(self, output_image:Path, name:str) -> str:
+        name = self.result_image_name(output_image, name)
+        destination = self.images_path / name
+        if Path.exists(destination):
+            print(f"{Fore.YELLOW}Warning:{Style.RESET_ALL} removing [{destination}]")
+        self.artifacts.add(destination, self.store.store(output_image, destination, move=True))
+        return name
+
+    def prepare_command_line_params(self, scene: Scene, options=None) -> list:
         return [] 
 
-    def execute(self):
-        count = len(self.scenes)
-        success = 0
-        skipped = 0
-        errors = 0
-        index = 0
-        for scene_params in self.scenes:
-            index += 1
-            scene = Scene(scene_params, self.params.root_path)
-            if not scene.path.exists():
-                err_msg = f"{scene.path} do not exists"
-                print_error(err_msg)
-                self.execution_results.add_result("failed", scene, err_msg)
-                errors += 1
-                continue
-            if not scene.type == ".rs":
-                warn_msg = f'{Fore.YELLOW}Warning: {Fore.GREEN}{scene.path}{Style.RESET_ALL} is not redshift scene'
-                print(warn_msg)
-                self.execution_results.add_result('skipped', scene, warn_msg)
-                skipped += 1
-                continue
+    # comma separated devices of the render
+    def gpus(self) -> str:
+        return self.params.gpu[0]
 
-            print(self.run_msg.format(color = Fore.BLUE, reset= Style.RESET_ALL, index=index, count=count, scene=scene.name), end=": ")
+    def render(self, scene: Scene) -> int:
+        if self.params.progressive and not self.params.reference:
+            return self.render_progressive(scene)
+        return execute_process(self.prepare_command_line_params(scene), self.env)
 
+    # renders the scene once before the measured render to fill the cache, returns the times of the cold render
+    def prewarm(self, scene: Scene, name: str = None) -> dict:
+        self.clear_temp()
+        start = time.perf_counter()
+        return_code = execute_process(self.prepare_command_line_params(scene), self.env)
+        wall = time.perf_counter() - start
+        log_file = get_latest_log_path(self.env) / "log.html"
+        log_copy = self.logs_path / 'prewarm' / f'{name or scene.name}{self.result_suffix}.html'
+        self.artifacts.add(log_copy, self.store.store(log_file, log_copy))
+        self.clear_temp()
+        if return_code != 0:
+            print(f"{Fore.YELLOW}[pre-warm failed]{Style.RESET_ALL}", end=" ")
+            return {"wall": wall, "log": None}
+        self.render_cache.rendered(scene.name)
+        return {"wall": wall, "log": log_render_time(log_copy, self.params.program)}
+
+    # renders the passes with growing number of samples and stops when the result is clear,
+    # the outputs of the last rendered pass are left in the temp folder as the result
+    def render_progressive(self, scene: Scene) -> int:
+        record = {"passes": []}
+        base_options = Path(self.params.get_render_options())
+        for index, render_pass in enumerate(progressive_passes(self.params.config)):
             self.clear_temp()
-            cmd_params = self.prepare_command_line_params(scene)
-            return_code = execute_process(cmd_params, self.env)
-            result, msg = self.handle_result(return_code, scene.name)
-            if not result:
+            options = write_pass_options(base_options, render_pass['options'], self.results_path / 'progressive' / f'options_pass{index}.txt')
+            return_code = execute_process(self.prepare_command_line_params(scene, options), self.env)
+            if return_code != 0:
+                return return_code
+            ratio = pass_ratio(render_pass, base_options)
+            metrics, thresholds, pass_thresholds = self.measure_pass(scene, ratio)
+            if not metrics:
+                # nothing to compare with, the full render decides
+                break
+            decision = judge_pass(metrics, thresholds, pass_thresholds, self.params.divergence_factor)
+            record["passes"].append({"ratio": ratio, "mse": metrics})
+            if decision:
+                print(f"[{decision} at {ratio:.3f} samples]", end=" ")
+                record["decision"] = decision
+                self.execution_results.add_progressive(scene, record)
+                return return_code
+
+        self.clear_temp()
+        record["decision"] = DECISION_COMPLETED
+        self.execution_results.add_progressive(scene, record)
+        return execute_process(self.prepare_command_line_params(scene), self.env)
+
+    # mse of the pass images and the full quality and pass tresholds, empty when a reference is missing
+    def measure_pass(self, scene: Scene, ratio: float) -> Tuple[dict, dict, dict]:
+        metrics, thresholds, pass_thresholds = {}, {}, {}
+        output_images, msg = self.collect_output_images()
+        for output_image in output_images:
+            name = self.result_image_name(output_image, scene.name)
+            key = name[:-len(f'{self.result_suffix}{output_image.suffix.lower()}')]
+            reference = self.reference_path / self.params.program / 'images' / f'{key}.reference{output_image.suffix.lower()}'
+            if not reference.exists():
+                return {}, {}, {}
+            item = AnalysisItem(reference, output_image, key, self.commons_path, self.params.treshold)
+            item.compute_mse_and_ssi()
+            metrics[key] = float(item.mse)
+            thresholds[key] = self.noise_model.threshold(key, self.params.treshold, 1.0, self.params.noise_sigma)
+            pass_thresholds[key] = self.noise_model.threshold(key, self.params.treshold, ratio, self.params.noise_sigma)
+        return metrics, thresholds, pass_thresholds
+
+    # renders the reference scene again to measure the monte-carlo noise of the reference images
+    def calibrate(self, scene: Scene) -> None:
+        calibration_path = self.results_path / 'calibration'
+        samples = {}
+        for run in range(self.params.calibrate):
+            print(f"\t\tCalibration render {Fore.BLUE}{run + 1}{Style.RESET_ALL}/{Fore.BLUE}{self.params.calibrate}{Style.RESET_ALL}", end=": ")
+            self.clear_temp()
+            return_code = execute_process(self.prepare_command_line_params(scene), self.env)
+            output_images, msg = self.collect_output_images()
+            if return_code != 0 or not output_images:
                 print(f"{Fore.RED}Failed!{Style.RESET_ALL}")
-                print_error(f"\t{msg}")
-                self.execution_results.add_result('failed', scene, msg)
-                errors += 1
-                continue
-            success += 1
+                shutil.rmtree(calibration_path, ignore_errors=True)
+                return
             print(f"{Fore.GREEN}Success{Style.RESET_ALL}")
-            self.execution_results.add_result('success', scene, "success")
+            for output_image in output_images:
+                name = self.result_image_name(output_image, scene.name)
+                sample = calibration_path / str(run) / name
+                sample.parent.mkdir(parents=True, exist_ok=True)
+                shutil.move(str(output_image), sample)
+                samples.setdefault(name, []).append(sample)
+
+        crop = self.params.program == "redshiftBenchmark"
+        for name, paths in samples.items():
+            reference = self.images_path / name
+            if not reference.exists():
+                continue
+            key = name[:-len(f'{self.result_suffix}{reference.suffix}')]
+            noise = measure_noise(reference, paths, crop)
+            self.noise_model.set(key, noise)
+            print(f"\t\tNoise of {Fore.GREEN}{key}{Style.RESET_ALL}: "
+                  f"mse={Fore.BLUE}{noise['mse_mean']:.3f}{Style.RESET_ALL}\u00b1{Fore.BLUE}{noise['mse_std']:.3f}{Style.RESET_ALL}")
+        shutil.rmtree(calibration_path, ignore_errors=True)
+
+    def schedule(self) -> None:
+        self.scenes, schedule = order_tests(self.scenes, self.params.order)
+        print_schedule(schedule, self.params.order)
+        try:
+            with open(self.results_path / 'schedule.json', 'w') as f:
+                json.dump(schedule, f, indent=2)
+        except IOError as io_err:
+            print_error(f"Could not save the schedule to {self.results_path} [{repr(io_err)}]")
+
+    def execute(self):
+        self.schedule()
+        self.count = len(self.scenes)
+        self.index = 0
+        self.success = 0
+        self.skipped = 0
+        self.errors = 0
+        if self.params.calibrate:
+            self.noise_model = NoiseModel(self.results_path)
+        elif self.params.progressive:
+            self.noise_model = NoiseModel(self.reference_path / self.params.program)
+
+        pending = self.scenes
+        if self.params.resume:
+            pending = self.resume(pending)
+        else:
+            self.journal.reset()
+        try:
+            self.render_pending(pending)
+        except KeyboardInterrupt:
+            print_error(f"\nInterrupted, continue with: --resume {self.results_path}")
+            self.execution_results.save(self.results_json_log)
+            self.artifacts.save()
+            self.clear_temp()
+            exit(EXIT_FAILURE)
 
         print(self.end_msg.format(
             reset=Style.RESET_ALL, 
             magenta=Fore.MAGENTA, green=Fore.GREEN, red=Fore.RED, yellow=Fore.YELLOW,
-            success=success, errors=errors, skipped=skipped, count=count))
+            success=self.success, errors=self.errors, skipped=self.skipped, count=self.count))
 
         self.execution_results.save(self.results_json_log)
+        self.artifacts.save()
+        save_cache_states(self.execution_results.info["cache"], self.results_path)
+        self.render_cache.close()
+        if self.params.calibrate:
+            self.noise_model.save()
+        self.clear_temp()
+
+    # restores the results recorded in the journal, returns the tests that still have to be rendered
+    def resume(self, scenes: list) -> list:
+        completed = self.execution_results.restore(self.journal.load())
+        self.success = len(self.execution_results.info["success"])
+        self.errors = len(self.execution_results.info["failed"])
+        self.index = self.success + self.errors
+        pending = [scene for scene in scenes if scene["test_name"] not in completed]
+        print(f'{Fore.MAGENTA}Resuming {Fore.GREEN}{self.results_path}{Style.RESET_ALL}: '
+              f'{self.index} tests completed, {len(pending)} to render')
+        # the journal holds only the completed tests, the retried ones are recorded again
+        self.journal.rewrite(self.journal_records())
+        return pending
+
+    def journal_records(self) -> List[dict]:
+        info = self.execution_results.info
+        records = []
+        for type in ["success", "failed"]:
+            for name, path, msg in info[type]:
+                records.append({"type": type, "name": name, "path": path, "msg": msg, "duration": info["durations"].get(name)})
+        for section in DETAIL_SECTIONS:
+            for name, record in info[section].items():
+                records.append({"type": section, "name": name, "record": record})
+        return records
+
+    def render_pending(self, pending: list) -> None:
+        if self.params.smoke:
+            smoke, pending = split_fastest_tests(pending, self.params.smoke)
+            print(f'{Fore.MAGENTA}Smoke phase{Style.RESET_ALL}: rendering {len(smoke)} fastest tests first')
+            failed, remaining = self.render_scenes(smoke, FailureStreak(1))
+            if failed:
+                print_error("Smoke phase failed, the remaining tests will not be rendered")
+                self.skip_scenes(remaining + pending, "smoke phase failed")
+                pending = []
+
+        failed, remaining = self.render_scenes(pending, FailureStreak(self.params.max_failure_streak))
+        if failed:
+            print_error(f"{self.params.max_failure_streak} consecutive failures with the same signature, the renderer build looks broken")
+            if self.params.on_failure_streak == ON_STREAK_CANARY:
+                canary, remaining = split_fastest_tests(remaining, self.params.canary_count)
+                print(f'{Fore.MAGENTA}Switching to canary tests{Style.RESET_ALL}: {len(canary)} tests')
+                self.render_scenes(canary, FailureStreak(0))
+            self.skip_scenes(remaining, "aborted after consecutive failures")
+
+    # stops when the failure streak reaches its limit, returns if it happened and the scenes that were not rendered
+    def render_scenes(self, scenes: list, streak: FailureStreak) -> Tuple[bool, list]:
+        for position, scene_params in enumerate(scenes):
+            status, msg = self.render_scene(scene_params)
+            if status == 'success':
+                streak.reset()
+            elif status == 'failed' and streak.record_failure(msg, [scene_params["test_name"], Path(scene_params["path_to_scene"]).stem]):
+                return True, scenes[position + 1:]
+        return False, []
+
+    def skip_scenes(self, scenes: list, reason: str) -> None:
+        for scene_params in scenes:
+            scene = Scene(scene_params, self.params.root_path)
+            self.execution_results.add_result('skipped', scene, reason)
+            self.skipped += 1
+
+    # returns the status of the test: success, failed, skipped or missing, and the message
+    def render_scene(self, scene_params: dict) -> Tuple[str, str]:
+        self.index += 1
+        scene = Scene(scene_params, self.params.root_path)
+        status, msg = self.check_scene(scene)
+        if status:
+            return status, msg
+
+        print(self.run_msg.format(color = Fore.BLUE, reset= Style.RESET_ALL, index=self.index, count=self.count, scene=scene.name), end=": ")
+
+        prewarm = self.prewarm(scene) if self.params.prewarm else None
+        state = self.render_cache.prepare(scene.name)
         self.clear_temp()
+        start = time.perf_counter()
+        return_code = self.render(scene)
+        duration = time.perf_counter() - start
+        self.render_cache.rendered(scene.name)
+        result, msg = self.handle_result(return_code, scene.name)
+        self.artifacts.save()
+        self.execution_results.add_cache(scene, {"policy": self.params.cache_policy, "state": state, "prewarm": prewarm})
+        if not result:
+            print(f"{Fore.RED}Failed!{Style.RESET_ALL}")
+            print_error(f"\t{msg}")
+            self.execution_results.add_result('failed', scene, msg, duration)
+            self.errors += 1
+            return 'failed', msg
+        self.success += 1
+        print(f"{Fore.GREEN}Success{Style.RESET_ALL}")
+        frames = scene.frame_paths()
+        if len(frames) > 1 and self.params.program != 'redshiftBenchmark':
+            # the image analysis follows the sequences the runner rendered, not the image names
+            self.execution_results.add_sequence(scene, {"frames": [frame.name for frame in frames], "images": sorted(self.result_images)})
+        self.execution_results.add_result('success', scene, "success", duration)
+        if self.params.reference and self.params.calibrate:
+            self.calibrate(scene)
+        return 'success', "success"
+
+    # records the scenes that can't be rendered, returns their status and message or None
+    def check_scene(self, scene: Scene) -> Tuple[str, str]:
+        missing = [path for path in scene.frame_paths() if not path.exists()]
+        if missing:
+            err_msg = f"{', '.join(str(path) for path in missing)} do not exists"
+            print_error(err_msg)
+            self.execution_results.add_result("failed", scene, err_msg)
+            self.errors += 1
+            return 'missing', err_msg
+        if not scene.type == ".rs":
+            warn_msg = f'{Fore.YELLOW}Warning: {Fore.GREEN}{scene.path}{Style.RESET_ALL} is not redshift scene'
+            print(warn_msg)
+            self.execution_results.add_result('skipped', scene, warn_msg)
+            self.skipped += 1
+            return 'skipped', warn_msg
+        return None, None
 
 
 class RedshiftCmdLineTask(RenderingTask):
     def __init__(self, params: ExecutionParameters):
         super().__init__(params)
-        date_name = date_time_with_prefix("")
-        self.results_folder_name = date_name
-        self.results_path = self.params.root_path / 'results' / self.results_folder_name
+        # --resume continues in the folder of the interrupted run
+        self.results_path = self.params.resume or create_run_folder(self.params.root_path / 'results')
+        self.results_folder_name = self.results_path.name
         self.result_suffix = ".result"
         self.init_folders()
         self.run_msg = "\tRunning test {color}{index}{reset}/{color}{count}{reset} [{scene}]"
@@ -212,12 +553,13 @@ class RedshiftCmdLineTask(RenderingTask):
             '\tSucces: {green}{success}{reset}/{count}\n' \
             '\tFailed: {red}{errors}{reset}/{count}\n' \
             '\tSkipped:{yellow}{skipped}{reset}/{count}'
-        self.results_json_log = self.results_path / f'{self.params.program}_TEST_{date_name}.json'
+        self.results_json_log = self.results_path / f'{self.params.program}_TEST_{self.results_folder_name}.json'
 
-    def prepare_command_line_params(self, scene: Scene) -> list:
-        gpus =  split_to_gpus(self.params.gpu[0])
-        cmd_params = [self.params.get_executable(), scene.path, "-oro",
-                      "options.txt", "-oif", "png", "-oip", self.temp_output_path] + gpus
+    def prepare_command_line_params(self, scene: Scene, options=None) -> list:
+        gpus =  split_to_gpus(self.gpus())
+        # all the frames are rendered by one process to load the scene once
+        cmd_params = [self.params.get_executable()] + scene.frame_paths() + ["-oro",
+                      options or self.params.get_render_options(), "-oif", self.params.output_format, "-oip", self.temp_output_path] + gpus
         if scene.skippostfx == 'true':
             cmd_params.append("-skippostfix")
         return cmd_params
@@ -238,10 +580,11 @@ class RedshiftCmdLineReferenceTask(RenderingTask):
             '\tSkipped:{yellow}{skipped}{reset}/{count}'
         self.results_json_log = self.results_path / f'{self.params.program}_REFERENCE_{date_name}.json'
 
-    def prepare_command_line_params(self, scene: Scene) -> list:
-        gpus =  split_to_gpus(self.params.gpu[0])
-        cmd_params = [self.params.get_executable(), scene.path, "-oro",
-                      "options.txt", "-oif", "png", "-oip", self.temp_output_path] + gpus
+    def prepare_command_line_params(self, scene: Scene, options=None) -> list:
+        gpus =  split_to_gpus(self.gpus())
+        # all the frames are rendered by one process to load the scene once
+        cmd_params = [self.params.get_executable()] + scene.frame_paths() + ["-oro",
+                      options or self.params.get_render_options(), "-oif", self.params.output_format, "-oip", self.temp_output_path] + gpus
         if scene.skippostfx == 'true':
             cmd_params.append("-skippostfix")
         return cmd_params
@@ -250,9 +593,9 @@ class RedshiftCmdLineReferenceTask(RenderingTask):
 class RedshiftBenchmarkTask(RenderingTask):
     def __init__(self, params: ExecutionParameters):
         super().__init__(params)
-        date_name = date_time_with_prefix("")
-        self.results_folder_name = date_name
-        self.results_path = self.params.root_path / 'results' / self.results_folder_name
+        # --resume continues in the folder of the interrupted run
+        self.results_path = self.params.resume or create_run_folder(self.params.root_path / 'results')
+        self.results_folder_name = self.results_path.name
         self.result_suffix = ".result"
         self.init_folders()
         self.run_msg = "\tRunning test {color}{index}{reset}/{color}{count}{reset} [{scene}]"
@@ -260,12 +603,15 @@ class RedshiftBenchmarkTask(RenderingTask):
             '\tSucces: {green}{success}{reset}/{count}\n' \
             '\tFailed: {red}{errors}{reset}/{count}\n' \
             '\tSkipped:{yellow}{skipped}{reset}/{count}'
-        self.results_json_log = self.results_path / f'{self.params.program}_TEST_{date_name}.json'
+        self.results_json_log = self.results_path / f'{self.params.program}_TEST_{self.results_folder_name}.json'
 
   
     def prepare_command_line_params(self, scene: Scene) -> list:
-        gpus =  split_to_gpus(self.params.gpu[0])
-        cmd_params = [self.params.get_executable(), scene.path] + gpus
+        gpus =  split_to_gpus(self.gpus())
+        frames = scene.frame_paths()
+        if len(frames) > 1:
+            print(f"{Fore.YELLOW}Warning:{Style.RESET_ALL} redshiftBenchmark renders a single frame, using {frames[0].name}", end=" ")
+        cmd_params = [self.params.get_executable(), frames[0]] + gpus
         return cmd_params
 
 
@@ -285,13 +631,253 @@ class RedshiftBenchmarkReferenceTask(RenderingTask):
         self.results_json_log = self.results_path / f'{self.params.program}_REFERENCE_{date_name}.json'
     
     def prepare_command_line_params(self, scene: Scene) -> list:
-        gpus =  split_to_gpus(self.params.gpu[0])
-        cmd_params = [self.params.get_executable(), scene.path] + gpus
+        gpus =  split_to_gpus(self.gpus())
+        frames = scene.frame_paths()
+        if len(frames) > 1:
+            print(f"{Fore.YELLOW}Warning:{Style.RESET_ALL} redshiftBenchmark renders a single frame, using {frames[0].name}", end=" ")
+        cmd_params = [self.params.get_executable(), frames[0]] + gpus
         return cmd_params
 
 
+'''
+Renders every scene with two builds of the program interleaved in ABBA cycles
+and compares their render times and images.
+'''
+class RedshiftABTask(RenderingTask):
+    def __init__(self, params: ExecutionParameters):
+        super().__init__(params)
+        self.results_path = self.params.resume or create_run_folder(self.params.root_path / 'results')
+        self.results_folder_name = self.results_path.name
+        self.result_suffix = ".result"
+        self.init_folders()
+        self.executables = dict(zip(BUILDS, self.params.ab))
+        self.executable = self.executables['A']
+        self.run_msg = "\tComparing {color}{index}{reset}/{color}{count}{reset} [{scene}]"
+        self.end_msg = '{magenta}Comparison completed{reset}:\n' \
+            '\tSucces: {green}{success}{reset}/{count}\n' \
+            '\tFailed: {red}{errors}{reset}/{count}\n' \
+            '\tSkipped:{yellow}{skipped}{reset}/{count}'
+        self.results_json_log = self.results_path / f'{self.params.program}_AB_{self.results_folder_name}.json'
+
+    def init_folders(self):
+        super().init_folders()
+        for build in BUILDS:
+            (self.images_path / build).mkdir(parents=True, exist_ok=True)
+            (self.logs_path / build).mkdir(parents=True, exist_ok=True)
+        (self.logs_path / 'prewarm').mkdir(parents=True, exist_ok=True)
+
+    def execute(self):
+        super().execute()
+        rows = compare_builds(self.execution_results.info["comparison"], self.params.treshold)
+        print_comparison(rows, self.executables)
+        save_comparison(rows, self.results_path)
+
+    # the command line of the program with the executable of the build
+    def prepare_command_line_params(self, scene: Scene, options=None) -> list:
+        if self.params.program == 'redshiftBenchmark':
+            cmd_params = RedshiftBenchmarkTask.prepare_command_line_params(self, scene)
+        else:
+            cmd_params = RedshiftCmdLineTask.prepare_command_line_params(self, scene, options)
+        return [self.executable] + cmd_params[1:]
+
+    def render_scene(self, scene_params: dict) -> Tuple[str, str]:
+        self.index += 1
+        scene = Scene(scene_params, self.params.root_path)
+        status, msg = self.check_scene(scene)
+        if status:
+            return status, msg
+
+        print(self.run_msg.format(color = Fore.BLUE, reset= Style.RESET_ALL, index=self.index, count=self.count, scene=scene.name), end=": ")
+        samples = {build: {"wall": [], "log": [], "cache": []} for build in BUILDS}
+        images = {}
+        start = time.perf_counter()
+        # a discarded warm-up render of each build, the first measured pair must not pay for the cold
+        # caches and files alone. The caches of the builds may not be compatible, both builds are warmed
+        prewarm = {}
+        for build in BUILDS:
+            self.executable = self.executables[build]
+            prewarm[build] = self.prewarm(scene, f'{scene.name}.{build}')
+        for cycle in range(self.params.ab_cycles):
+            for build in AB_CYCLE:
+                run = len(samples[build]["wall"])
+                print(build, end="", flush=True)
+                samples[build]["cache"].append(self.render_cache.prepare(scene.name))
+                result, msg, wall, log_time = self.render_build(scene, build, run)
+                self.render_cache.rendered(scene.name)
+                self.artifacts.save()
+                if not result:
+                    msg = f"[{build}] {msg}"
+                    print(f" {Fore.RED}Failed!{Style.RESET_ALL}")
+                    print_error(f"\t{msg}")
+                    self.execution_results.add_result('failed', scene, msg, time.perf_counter() - start)
+                    self.errors += 1
+                    return 'failed', msg
+                samples[build]["wall"].append(wall)
+                samples[build]["log"].append(log_time)
+                # the images of the first render of each build are kept
+                if run == 0:
+                    images[build] = self.move_build_images(scene, build)
+
+        record = {"executables": {build: str(executable) for build, executable in self.executables.items()},
+                  "samples": samples,
+                  "images": self.compare_images(images)}
+        self.execution_results.add_comparison(scene, record)
+        self.execution_results.add_cache(scene, {"policy": self.params.cache_policy, "state": samples['A']["cache"][0], "prewarm": prewarm})
+        row = compare_builds({scene.name: record}, self.params.treshold)[0]
+        self.success += 1
+        print(f" {Fore.GREEN}Success{Style.RESET_ALL} [speedup {format_value(row['Speedup'])}, p={format_value(row['p-value'], '.4f')}]")
+        self.execution_results.add_result('success', scene, "success", time.perf_counter() - start)
+        return 'success', "success"
+
+    # renders the scene with the build, returns the result, the message, the process and the renderer time
+    def render_build(self, scene: Scene, build: str, run: int) -> Tuple[bool, str, float, float]:
+        self.executable = self.executables[build]
+        self.clear_temp()
+        start = time.perf_counter()
+        return_code = execute_process(self.prepare_command_line_params(scene), self.env)
+        wall = time.perf_counter() - start
+
+        log_file = get_latest_log_path(self.env) / "log.html"
+        log_copy = self.logs_path / build / f'{scene.name}.{run}.html'
+        self.artifacts.add(log_copy, self.store.store(log_file, log_copy))
+        if return_code != 0:
+            result, msg = analyze_latest_log(log_file)
+            return False, msg if not result else "Process did not ended successfully!", wall, None
+        output_images, msg = self.collect_output_images()
+        if not output_images:
+            return False, msg or "No output images", wall, None
+        return True, "Success", wall, log_render_time(log_copy, self.params.program)
+
+    # returns the image names stored in images/<build>
+    def move_build_images(self, scene: Scene, build: str) -> List[str]:
+        names = []
+        output_images, msg = self.collect_output_images()
+        for output_image in output_images:
+            name = self.result_image_name(output_image, scene.name)
+            destination = self.images_path / build / name
+            self.artifacts.add(destination, self.store.store(output_image, destination, move=True))
+            names.append(name)
+        return names
+
+    # mse and ssi of the candidate image against the baseline image
+    def compare_images(self, images: dict) -> dict:
+        differences = {}
+        for name in sorted(set(images['A']) & set(images['B'])):
+            extension = Path(name).suffix
+            key = name[:-len(f'{self.result_suffix}{extension}')]
+            item = AnalysisItem(self.images_path / 'A' / name, self.images_path / 'B' / name, key, self.commons_path, self.params.treshold)
+            try:
+                item.compute_mse_and_ssi()
+            except ValueError as ve:
+                print_error(f"Comparison of {name} failed: {repr(ve)}")
+                continue
+            differences[key] = {"mse": float(item.mse), "ssi": float(item.ssi)}
+            if item.mse > item.treshold:
+                item.create_diff_plot(self.commons_path / f'{key}.ab.diff.png')
+        for name in sorted(set(images['A']) ^ set(images['B'])):
+            print(f"{Fore.YELLOW}Warning:{Style.RESET_ALL} {name} was written by one of the builds only", end=" ")
+        return differences
+
+
+'''
+Renders every scene with growing device sets to measure the multi-GPU scaling.
+The images of the first device set are kept as the results of the run.
+'''
+class RedshiftScalingTask(RenderingTask):
+    def __init__(self, params: ExecutionParameters):
+        super().__init__(params)
+        self.results_path = self.params.resume or create_run_folder(self.params.root_path / 'results')
+        self.results_folder_name = self.results_path.name
+        self.result_suffix = ".result"
+        self.init_folders()
+        self.subsets = sweep_subsets(self.params.gpu, self.params.gpu_sweep)
+        self.subset = self.subsets[0]
+        self.run_msg = "\tSweeping {color}{index}{reset}/{color}{count}{reset} [{scene}]"
+        self.end_msg = '{magenta}Sweep completed{reset}:\n' \
+            '\tSucces: {green}{success}{reset}/{count}\n' \
+            '\tFailed: {red}{errors}{reset}/{count}\n' \
+            '\tSkipped:{yellow}{skipped}{reset}/{count}'
+        self.results_json_log = self.results_path / f'{self.params.program}_SCALING_{self.results_folder_name}.json'
+
+    def init_folders(self):
+        super().init_folders()
+        for subset in sweep_subsets(self.params.gpu, self.params.gpu_sweep):
+            (self.logs_path / subset_key(subset)).mkdir(parents=True, exist_ok=True)
+
+    def execute(self):
+        print(f'{Fore.MAGENTA}GPU sweep{Style.RESET_ALL}: {" | ".join(self.subsets)}')
+        super().execute()
+        rows = scaling_rows(self.execution_results.info["scaling"])
+        print_scaling(rows)
+        save_scaling(rows, self.results_path)
+        plot_scaling(rows, self.results_path / SCALING_CHART)
+
+    def gpus(self) -> str:
+        return self.subset
+
+    def prepare_command_line_params(self, scene: Scene, options=None) -> list:
+        if self.params.program == 'redshiftBenchmark':
+            return RedshiftBenchmarkTask.prepare_command_line_params(self, scene)
+        return RedshiftCmdLineTask.prepare_command_line_params(self, scene, options)
+
+    def render_scene(self, scene_params: dict) -> Tuple[str, str]:
+        self.index += 1
+        scene = Scene(scene_params, self.params.root_path)
+        status, msg = self.check_scene(scene)
+        if status:
+            return status, msg
+
+        print(self.run_msg.format(color = Fore.BLUE, reset= Style.RESET_ALL, index=self.index, count=self.count, scene=scene.name), end=": ")
+        runs = []
+        start = time.perf_counter()
+        prewarm = None
+        if self.params.prewarm:
+            self.subset = self.subsets[0]
+            prewarm = self.prewarm(scene)
+        for position, subset in enumerate(self.subsets):
+            self.subset = subset
+            print(f"[{subset}]", end=" ", flush=True)
+            state = self.render_cache.prepare(scene.name)
+            self.clear_temp()
+            render_start = time.perf_counter()
+            return_code = execute_process(self.prepare_command_line_params(scene), self.env)
+            wall = time.perf_counter() - render_start
+            self.render_cache.rendered(scene.name)
+            log_file = get_latest_log_path(self.env) / "log.html"
+            log_copy = self.logs_path / subset_key(subset) / f'{scene.name}{self.result_suffix}.html'
+            self.artifacts.add(log_copy, self.store.store(log_file, log_copy))
+            if position == 0:
+                # the first device set gives the results of the run
+                result, msg = self.handle_result(return_code, scene.name)
+            else:
+                result, msg = analyze_latest_log(log_file) if return_code != 0 else (True, "Success")
+                if result and return_code != 0:
+                    result, msg = False, "Process did not ended successfully!"
+            self.artifacts.save()
+            if not result:
+                msg = f"[{subset}] {msg}"
+                print(f"{Fore.RED}Failed!{Style.RESET_ALL}")
+                print_error(f"\t{msg}")
+                self.execution_results.add_result('failed', scene, msg, time.perf_counter() - start)
+                self.errors += 1
+                return 'failed', msg
+            log_time, reported = log_render_info(log_copy, self.params.program)
+            runs.append({"gpus": subset, "count": len(subset.split(',')), "reported": reported, "wall": wall, "log": log_time, "cache": state})
+
+        self.execution_results.add_scaling(scene, {"runs": runs})
+        self.execution_results.add_cache(scene, {"policy": self.params.cache_policy, "state": runs[0]["cache"], "prewarm": prewarm})
+        self.success += 1
+        print(f"{Fore.GREEN}Success{Style.RESET_ALL}")
+        self.execution_results.add_result('success', scene, "success", time.perf_counter() - start)
+        return 'success', "success"
+
+
 class TaskFactory:
     def create_task(self, params: ExecutionParameters) -> Task:
+        if params.ab:
+            return RedshiftABTask(params)
+        if params.gpu_sweep is not None:
+            return RedshiftScalingTask(params)
         if params.reference:
             if params.program == 'redshiftBenchmark':
                 return RedshiftBenchmarkReferenceTask(params)
@@ -0,0 +1,409 @@
+import html
+import os
+from multiprocessing import Pool
+from urllib.parse import quote
+
+import cv2 as cv
+import numpy as np
+
+from .image_analysis import REFERENCE_SUFFIX, RESULT_SUFFIX, read_image, to_display
+from .image_headers import read_image_header
+from .memory_budget import *
+from .performance_analysis import log_render_time
+from .render_cache import load_cache_states
+from .utils import *
+
+REPORT_FOLDER = 'report'
+REPORT_FILE = 'index.html'
+PREVIEWS_FOLDER = 'previews'
+# generated previews with the source images they were made from, only the changed ones are made again
+PREVIEWS_JSON = 'previews.json'
+PREVIEWS_VERSION = 1
+# the table shows the small previews, the expanded row the large ones
+PREVIEW_WIDTHS = [160, 640]
+PREVIEW_QUALITY = 85
+# full resolution crops around the largest difference
+CROP_SIZE = 256
+# the differences are amplified to be visible in the previews
+DIFF_GAIN = 4
+ANALYSIS_LOG_PATTERN = re.compile(r'^(.+_ANALYSIS|custom_analysis)_\d{4}-\d{2}-\d{2}_\d{6}\.json$')
+# problems first in the initial order of the table
+STATUS_ORDER = ['failed', 'mismatch', 'missing', 'skipped', 'passed']
+
+
+def file_signature(path: Path) -> list:
+    if path is None or not path.exists():
+        return None
+    stat = path.stat()
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def preview_width(image, width: int):
+    height, image_width = image.shape[:2]
+    if image_width <= width:
+        return image
+    return cv.resize(image, (width, max(1, round(height * width / image_width))), interpolation=cv.INTER_AREA)
+
+
+def write_previews(image, prefix: Path) -> List[str]:
+    names = []
+    for width in PREVIEW_WIDTHS:
+        file = prefix.with_name(f'{prefix.name}.{width}.jpg')
+        cv.imwrite(str(file), preview_width(image, width), [cv.IMWRITE_JPEG_QUALITY, PREVIEW_QUALITY])
+        names.append(file.name)
+    return names
+
+
+# the window of the crop with the largest mean difference
+def crop_window(diff) -> Tuple[int, int, int, int]:
+    height, width = diff.shape[:2]
+    size_y, size_x = min(CROP_SIZE, height), min(CROP_SIZE, width)
+    grid = cv.resize(diff.astype(np.float32), (max(1, width // size_x), max(1, height // size_y)), interpolation=cv.INTER_AREA)
+    cell_y, cell_x = np.unravel_index(np.argmax(grid), grid.shape)
+    y = min(int((cell_y + 0.5) * height / grid.shape[0] - size_y / 2), height - size_y)
+    x = min(int((cell_x + 0.5) * width / grid.shape[1] - size_x / 2), width - size_x)
+    return max(0, x), max(0, y), size_x, size_y
+
+
+'''
+Previews of one image pair made by a worker: the small and large versions of the reference,
+the result and the amplified difference, and the full resolution crops of the largest difference.
+Returns the file names of the previews or the error.
+'''
+def make_previews(job: dict) -> dict:
+    previews_path = Path(job["path"])
+    files = {}
+    try:
+        images = {}
+        for kind in ["reference", "result"]:
+            if job[kind]:
+                images[kind] = to_display(read_image(Path(job[kind])))
+                files[kind] = write_previews(images[kind], previews_path / f'{job["key"]}.{kind}')
+        if len(images) == 2 and images["reference"].shape == images["result"].shape:
+            diff = cv.absdiff(images["reference"], images["result"])
+            diff = diff.max(axis=2) if diff.ndim == 3 else diff
+            heat = cv.applyColorMap(np.clip(diff.astype(np.uint16) * DIFF_GAIN, 0, 255).astype(np.uint8), cv.COLORMAP_INFERNO)
+            files["diff"] = write_previews(heat, previews_path / f'{job["key"]}.diff')
+            x, y, width, height = crop_window(diff)
+            files["crops"] = []
+            for kind, image in [("reference", images["reference"]), ("result", images["result"]), ("diff", heat)]:
+                file = previews_path / f'{job["key"]}.{kind}.crop.png'
+                cv.imwrite(str(file), image[y:y + height, x:x + width])
+                files["crops"].append(file.name)
+            files["window"] = [x, y, width, height]
+    except (ValueError, cv.error) as err:
+        return {"name": job["name"], "files": files, "error": repr(err)}
+    return {"name": job["name"], "files": files, "error": None}
+
+
+# the test of the image: <test_name>[.<aov>][.<frame>]
+def test_of_image(name: str, tests: List[str]) -> str:
+    matches = [test for test in tests if name == test or name.startswith(f'{test}.')]
+    return max(matches, key=len) if matches else name
+
+
+def format_number(value, format: str = '.3f') -> str:
+    return '' if value is None or value == "" else f'{value:{format}}'
+
+
+'''
+Static html report of a results folder: a sortable table of the image metrics, the render times
+and the cache states with the previews of every image pair. The previews are made in parallel
+and cached in report/previews, a report made again only makes the previews of the changed images.
+'''
+class ReportGenerator:
+    def __init__(self, results_path: Path, reference_path: Path, program: str, treshold: float, memory_budget: float = None):
+        self.results_path = results_path
+        self.reference_path = reference_path
+        self.program = program
+        self.treshold = treshold
+        self.report_path = results_path / REPORT_FOLDER
+        self.previews_path = self.report_path / PREVIEWS_FOLDER
+        self.memory_budget = int(memory_budget * GB) if memory_budget else default_memory_budget()
+
+    def generate(self) -> Path:
+        self.previews_path.mkdir(parents=True, exist_ok=True)
+        rows = self.collect_rows()
+        previews = self.update_previews(rows)
+        report_file = self.report_path / REPORT_FILE
+        try:
+            with open(report_file, 'w', encoding='utf-8') as f:
+                f.write(self.render_html(rows, previews))
+        except IOError as io_err:
+            print_error(f"Could not save the report to {report_file} [{repr(io_err)}]")
+            return None
+        print(f'{Fore.MAGENTA}Report{Style.RESET_ALL}: {report_file}')
+        return report_file
+
+    def load_json(self, file: Path) -> dict:
+        try:
+            with open(file, 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError) as err:
+            print_error(f"Could not read {file} [{repr(err)}]")
+            return {}
+
+    # the latest image analysis and the execution results of the run
+    def load_results(self) -> Tuple[dict, dict]:
+        analysis_logs = sorted([file for file in self.results_path.glob('*.json') if ANALYSIS_LOG_PATTERN.match(file.name)],
+                               key=lambda file: file.stat().st_mtime)
+        analysis = self.load_json(analysis_logs[-1]) if analysis_logs else {}
+        execution_logs = sorted([file for file in self.results_path.glob(f'{self.program}_*_*.json') if '_ANALYSIS_' not in file.name],
+                                key=lambda file: file.stat().st_mtime)
+        execution = self.load_json(execution_logs[-1]) if execution_logs else {}
+        return analysis, execution
+
+    def collect_rows(self) -> List[dict]:
+        analysis, execution = self.load_results()
+        cache_states = load_cache_states(self.results_path)
+        # the render times of the summarized runs which logs were removed
+        summary = load_summary(self.results_path).get("tests", {})
+        durations = execution.get("durations", {})
+        tests = {}
+        for status in ["success", "failed", "skipped"]:
+            for name, path, msg in execution.get(status, []):
+                tests[name] = (status, msg)
+
+        rows = []
+        images = {}
+        images_path = self.results_path / 'images'
+        if images_path.exists():
+            for image in images_path.iterdir():
+                suffix = f'{RESULT_SUFFIX}{image.suffix}'
+                if image.name.endswith(suffix):
+                    images[image.name[:-len(suffix)]] = image
+        for name in sorted(set(images) | set(analysis)):
+            result = images.get(name)
+            reference = None
+            if result is not None:
+                reference = self.reference_path / 'images' / f'{name}{REFERENCE_SUFFIX}{result.suffix}'
+                reference = reference if reference.exists() else None
+            record = analysis.get(name)
+            treshold = record.get("treshold", self.treshold) if record else self.treshold
+            if record is None:
+                status = 'missing'
+            else:
+                status = 'mismatch' if record["mse"] > treshold else 'passed'
+            rows.append(self.row(name, test_of_image(name, list(tests)), status, "", record, treshold, reference, result))
+        # the tests without images, the failed renders
+        tested = {row["test"] for row in rows}
+        for test, (status, msg) in tests.items():
+            if test not in tested:
+                rows.append(self.row(test, test, 'passed' if status == 'success' else status, msg, None, self.treshold, None, None))
+        for row in rows:
+            row["duration"] = durations.get(row["test"])
+            cache = cache_states.get(row["test"], {})
+            row["cache"] = cache.get("state", "")
+            row["cold_time"] = (cache.get("prewarm") or {}).get("log")
+            row["time"] = log_render_time(self.results_path / 'logs' / f'{row["test"]}{RESULT_SUFFIX}.html', self.program)
+            if row["time"] is None:
+                row["time"] = summary.get(row["test"], {}).get("time")
+            row["reference_time"] = log_render_time(self.reference_path / 'logs' / f'{row["test"]}{REFERENCE_SUFFIX}.html', self.program)
+        rows.sort(key=lambda row: (STATUS_ORDER.index(row["status"]), -(row["mse"] or 0.0), row["name"]))
+        return rows
+
+    def row(self, name: str, test: str, status: str, msg: str, record: dict, treshold: float, reference: Path, result: Path) -> dict:
+        return {
+            "name": name,
+            "test": test,
+            "status": status,
+            "msg": msg,
+            "mse": record["mse"] if record else None,
+            "ssi": record["ssi"] if record else None,
+            "flicker": record.get("flicker") if record else None,
+            "treshold": treshold,
+            "reference": reference,
+            "result": result
+        }
+
+    # makes the previews of the images that changed since the last report, returns the previews of every row
+    def update_previews(self, rows: List[dict]) -> dict:
+        cache_file = self.report_path / PREVIEWS_JSON
+        cache = self.load_json(cache_file) if cache_file.exists() else {}
+        cached = cache.get("items", {}) if cache.get("version") == PREVIEWS_VERSION else {}
+        previews = {}
+        jobs = []
+        for row in rows:
+            if row["reference"] is None and row["result"] is None:
+                continue
+            sources = {"reference": file_signature(row["reference"]), "result": file_signature(row["result"])}
+            entry = cached.get(row["name"])
+            if entry and entry["sources"] == sources and all((self.previews_path / file).exists() for file in self.entry_files(entry)):
+                previews[row["name"]] = entry
+                continue
+            previews[row["name"]] = {"sources": sources, "files": {}}
+            jobs.append({"name": row["name"], "path": str(self.previews_path),
+                         "reference": str(row["reference"]) if row["reference"] else None,
+                         "result": str(row["result"]) if row["result"] else None})
+        # the previews are named by a number, the numbers of the reused previews are taken
+        used_keys = {file.split('.')[0] for entry in previews.values() for file in self.entry_files(entry)}
+        free_keys = (f'{index:05d}' for index in range(len(rows) + len(used_keys) + 1) if f'{index:05d}' not in used_keys)
+        for job in jobs:
+            job["key"] = next(free_keys)
+
+        print(f'{Fore.MAGENTA}Report previews{Style.RESET_ALL}: {len(jobs)} to make, {len(previews) - len(jobs)} cached')
+        for result in self.run_jobs(jobs):
+            if result["error"]:
+                print_error(f"Previews of {result['name']} failed: {result['error']}")
+            previews[result["name"]]["files"] = result["files"]
+
+        # the previews of the removed or changed images
+        kept = {file for entry in previews.values() for file in self.entry_files(entry)}
+        for file in self.previews_path.iterdir():
+            if file.name not in kept:
+                os.remove(file)
+        try:
+            with open(cache_file, 'w') as f:
+                json.dump({"version": PREVIEWS_VERSION, "items": previews}, f, indent=2)
+        except IOError as io_err:
+            print_error(f"Could not save the report previews to {cache_file} [{repr(io_err)}]")
+        return previews
+
+    def entry_files(self, entry: dict) -> List[str]:
+        files = entry["files"]
+        return [file for kind in ["reference", "result", "diff", "crops"] for file in files.get(kind, [])]
+
+    # as many workers as the decoded image pairs fit the memory budget
+    def run_jobs(self, jobs: List[dict]) -> list:
+        if not jobs:
+            return []
+        estimates = [estimate_pair_memory(*(read_image_header(Path(job[kind])) if job[kind] else None for kind in ["reference", "result"]))
+                     for job in jobs]
+        workers = workers_for_budget(estimates, self.memory_budget, os.cpu_count() or 1)
+        if workers == 1:
+            return [make_previews(job) for job in jobs]
+        with Pool(workers) as pool:
+            return list(pool.imap_unordered(make_previews, jobs))
+
+    def link(self, path: Path) -> str:
+        return quote(Path(os.path.relpath(path, self.report_path)).as_posix())
+
+    def preview_link(self, file: str) -> str:
+        return f'{PREVIEWS_FOLDER}/{quote(file)}'
+
+    def image_cell(self, files: List[str], title: str) -> str:
+        if not files:
+            return '<td></td>'
+        srcset = ', '.join(f'{self.preview_link(file)} {width}w' for file, width in zip(files, PREVIEW_WIDTHS))
+        return f'<td><img loading="lazy" src="{self.preview_link(files[0])}" srcset="{srcset}" sizes="{PREVIEW_WIDTHS[0]}px" ' \
+               f'width="{PREVIEW_WIDTHS[0]}" alt="{html.escape(title)}" title="{html.escape(title)}"></td>'
+
+    # the large previews, the crops and the links to the full images shown when the row is expanded
+    def details(self, row: dict, files: dict) -> str:
+        parts = []
+        for kind in ["reference", "result", "diff"]:
+            if files.get(kind):
+                parts.append(f'<figure><img loading="lazy" src="{self.preview_link(files[kind][-1])}"><figcaption>{kind}</figcaption></figure>')
+        if files.get("crops"):
+            x, y, width, height = files["window"]
+            for kind, file in zip(["reference", "result", "diff"], files["crops"]):
+                parts.append(f'<figure><img loading="lazy" class="crop" src="{self.preview_link(file)}">'
+                             f'<figcaption>{kind} {width}x{height} at {x},{y}</figcaption></figure>')
+        links = []
+        for label, path in [("reference", row["reference"]), ("result", row["result"]),
+                            ("diff plot", self.results_path / 'common' / f'{row["name"]}.diff.png'),
+                            ("log", find_log(self.results_path / 'logs' / f'{row["test"]}{RESULT_SUFFIX}.html'))]:
+            if path is not None and path.exists():
+                links.append(f'<a href="{self.link(path)}">{label}</a>')
+        return f'<details><summary>{html.escape(row["name"])}</summary><div class="previews">{"".join(parts)}</div>' \
+               f'<div>{" | ".join(links)}</div></details>'
+
+    def render_html(self, rows: List[dict], previews: dict) -> str:
+        counts = {status: len([row for row in rows if row["status"] == status]) for status in STATUS_ORDER}
+        summary = ', '.join(f'<span class="{status}">{status}: {count}</span>' for status, count in counts.items() if count)
+        columns = ['Reference', 'Result', 'Diff', 'Name', 'Status', 'MSE', 'Treshold', 'SSIM', 'Flicker',
+                   'Time[s]', 'Reference Time[s]', 'Time Ratio', 'Duration[s]', 'Cache', 'Cold Time[s]']
+        header = ''.join(f'<th onclick="sortTable(this)">{column}</th>' if index > 2 else f'<th>{column}</th>'
+                         for index, column in enumerate(columns))
+        body = []
+        for row in rows:
+            files = previews.get(row["name"], {}).get("files", {})
+            ratio = row["time"] / row["reference_time"] if row["time"] and row["reference_time"] else None
+            cells = [self.image_cell(files.get(kind), f'{row["name"]} {kind}') for kind in ["reference", "result", "diff"]]
+            cells.append(f'<td data-value="{html.escape(row["name"])}">{self.details(row, files)}</td>')
+            cells.append(f'<td data-value="{STATUS_ORDER.index(row["status"])}" class="{row["status"]}" title="{html.escape(row["msg"] or "")}">{row["status"]}</td>')
+            for value in [row["mse"], row["treshold"], row["ssi"], row["flicker"], row["time"], row["reference_time"], ratio, row["duration"]]:
+                cells.append(f'<td data-value="{"" if value is None else value}">{format_number(value)}</td>')
+            cells.append(f'<td>{html.escape(row["cache"])}</td>')
+            cells.append(f'<td data-value="{"" if row["cold_time"] is None else row["cold_time"]}">{format_number(row["cold_time"])}</td>')
+            body.append(f'<tr data-name="{html.escape(row["name"].lower())}" data-status="{row["status"]}">{"".join(cells)}</tr>')
+        return REPORT_TEMPLATE.format(
+            title=html.escape(f'{self.program} {self.results_path.name}'),
+            generated=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            summary=summary, header=header, body='\n'.join(body))
+
+
+def generate_report(params: ExecutionParameters, results_path: Path) -> Path:
+    reference_path = params.root_path / 'references' / params.program
+    if not results_path.exists():
+        print_error(f"{results_path} does not exists")
+        exit(EXIT_FAILURE)
+    return ReportGenerator(results_path, reference_path, params.program, params.treshold, params.memory_budget).generate()
+
+
+REPORT_TEMPLATE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ font-family: sans-serif; font-size: 13px; margin: 16px; }}
+table {{ border-collapse: collapse; }}
+th, td {{ border-bottom: 1px solid #ddd; padding: 4px 6px; text-align: left; vertical-align: top; }}
+th {{ position: sticky; top: 0; background: #f4f4f4; cursor: pointer; white-space: nowrap; }}
+th[data-order=asc]::after {{ content: " \\25B2"; }}
+th[data-order=desc]::after {{ content: " \\25BC"; }}
+td img {{ display: block; background: #222; }}
+.previews {{ display: flex; flex-wrap: wrap; gap: 8px; margin: 8px 0; }}
+.previews img {{ max-width: 640px; }}
+.previews img.crop {{ image-rendering: pixelated; width: 256px; }}
+figure {{ margin: 0; }}
+.failed, .mismatch {{ color: #c00; font-weight: bold; }}
+.missing, .skipped {{ color: #b70; }}
+.passed {{ color: #080; }}
+</style>
+</head>
+<body>
+<h2>{title}</h2>
+<p>Generated {generated}: {summary}</p>
+<p><input id="filter" placeholder="Filter by name" oninput="filterRows()">
+<label><input id="problems" type="checkbox" onchange="filterRows()"> Only problems</label></p>
+<table>
+<thead><tr>{header}</tr></thead>
+<tbody>
+{body}
+</tbody>
+</table>
+<script>
+function cellValue(row, index) {{
+    const cell = row.cells[index];
+    const value = cell.dataset.value !== undefined ? cell.dataset.value : cell.textContent;
+    const number = parseFloat(value);
+    return isNaN(number) ? value.toLowerCase() : number;
+}}
+function sortTable(th) {{
+    const body = th.closest('table').tBodies[0];
+    const index = Array.from(th.parentNode.children).indexOf(th);
+    const ascending = th.dataset.order !== 'asc';
+    th.parentNode.querySelectorAll('th').forEach(header => delete header.dataset.order);
+    th.dataset.order = ascending ? 'asc' : 'desc';
+    const rows = Array.from(body.rows).sort((a, b) => {{
+        const x = cellValue(a, index), y = cellValue(b, index);
+        // the empty values are always last
+        if (x === '' || y === '') return (x === '') - (y === '');
+        const order = typeof x === typeof y ? (x < y ? -1 : x > y ? 1 : 0) : (typeof x === 'number' ? -1 : 1);
+        return ascending ? order : -order;
+    }});
+    rows.forEach(row => body.appendChild(row));
+}}
+function filterRows() {{
+    const text = document.getElementById('filter').value.toLowerCase();
+    const problems = document.getElementById('problems').checked;
+    for (const row of document.querySelector('tbody').rows) {{
+        row.hidden = !row.dataset.name.includes(text) || (problems && row.dataset.status === 'passed');
+    }}
+}}
+</script>
+</body>
+</html>
+'''
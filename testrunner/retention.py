@@ -0,0 +1,274 @@
+import os
+import shutil
+import time
+from multiprocessing import Pool
+
+import cv2 as cv
+import numpy as np
+
+from .artifact_store import ARTIFACT_STORE_NAME, ArtifactManifest, ArtifactStore
+from .image_analysis import RESULT_SUFFIX
+from .image_headers import read_image_header
+from .memory_budget import *
+from .performance_analysis import BenchmarkAnalysisItem, CmdLineAnalysisItem, log_render_time
+from .render_cache import load_cache_states
+from .report import ANALYSIS_LOG_PATTERN, test_of_image
+from .utils import *
+
+LEVEL_FULL = 'full'
+LEVEL_COMPRESSED = 'compressed'
+LEVEL_SUMMARY = 'summary'
+COMPACTION_JSON = 'compaction.json'
+EXECUTION_LOG_PATTERN = re.compile(r'^(redshiftCmdLine|redshiftBenchmark)_(TEST|AB|SCALING)_.*\.json$')
+# the folders with the per test artifacts, the json records in the run folder are always kept
+ARTIFACT_FOLDERS = ['images', 'logs', 'common', 'report', 'tmp', 'progressive', 'calibration']
+# the report keeps its own previews, it is removed with the summarized runs only
+COMPRESSED_FOLDERS = ['images', 'logs', 'common']
+ZSTD_LEVEL = 19
+PNG_COMPRESSION = 9
+TIFF_DEFLATE = 8
+
+
+def compress_log(file: Path) -> Path:
+    data = file.read_bytes()
+    if zstandard is not None:
+        compressed = file.with_name(file.name + '.zst')
+        compressed.write_bytes(zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data))
+    else:
+        compressed = file.with_name(file.name + '.gz')
+        with gzip.open(compressed, 'wb', compresslevel=9) as f:
+            f.write(data)
+    return compressed
+
+
+'''
+Encodes the image again with the strongest lossless compression of its format, the new file is kept
+only when it decodes to the same pixels and is smaller. Runs in the workers, returns the new file or None.
+'''
+def recompress_image(path: str) -> str:
+    path = Path(path)
+    temp = path.with_name(f'.{path.stem}.compact{path.suffix}')
+    if path.suffix.lower() == '.png':
+        params = [cv.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION]
+    elif path.suffix.lower() in ['.tif', '.tiff']:
+        params = [cv.IMWRITE_TIFF_COMPRESSION, TIFF_DEFLATE]
+    else:
+        return None
+    try:
+        image = cv.imread(str(path), cv.IMREAD_UNCHANGED)
+        if image is None or not cv.imwrite(str(temp), image, params):
+            return None
+        decoded = cv.imread(str(temp), cv.IMREAD_UNCHANGED)
+        if decoded is not None and decoded.dtype == image.dtype and np.array_equal(decoded, image) and \
+                temp.stat().st_size < path.stat().st_size:
+            return str(temp)
+    except cv.error:
+        pass
+    if temp.exists():
+        os.remove(temp)
+    return None
+
+
+# the decoded image and its decoded new encoding compared with it
+def estimate_recompress_memory(path: Path) -> int:
+    header = read_image_header(path) or UNKNOWN_IMAGE
+    return 2 * header.pixels * header.channels * header.bytes_per_channel + path.stat().st_size
+
+
+def folder_size(path: Path) -> int:
+    return sum(file.stat().st_size for file in path.rglob('*') if file.is_file() and not file.is_symlink())
+
+
+'''
+Retention of the results folder. The newest runs keep everything, the older runs get compressed logs
+and losslessly compressed images, the oldest keep only the summary.json of their metrics and timings.
+The artifacts of the failing tests are kept as they are in every run.
+'''
+class ResultsCompactor:
+    def __init__(self, results_path: Path, keep_runs: int, keep_compressed: int, memory_budget: float = None):
+        self.results_path = results_path
+        self.keep_runs = keep_runs
+        self.keep_compressed = keep_compressed
+        # bytes the recompression workers may use together, --memory-budget is in GB
+        self.memory_budget = int(memory_budget * GB) if memory_budget else default_memory_budget()
+        # the stored objects the compacted runs do not refer to anymore
+        self.released = set()
+
+    # run folders from the newest, the artifact store is not a run
+    def runs(self) -> List[Path]:
+        runs = [path for path in self.results_path.iterdir() if path.is_dir() and path.name != ARTIFACT_STORE_NAME]
+        return sorted(runs, key=lambda path: path.name, reverse=True)
+
+    def level(self, position: int) -> str:
+        if position < self.keep_runs:
+            return LEVEL_FULL
+        if position < self.keep_runs + self.keep_compressed:
+            return LEVEL_COMPRESSED
+        return LEVEL_SUMMARY
+
+    def compact(self) -> None:
+        if not self.results_path.exists():
+            print_error(f"{self.results_path} does not exists")
+            return
+        start = time.time()
+        runs = self.runs()
+        print(f'{Fore.MAGENTA}Compacting{Style.RESET_ALL} {len(runs)} runs in {self.results_path}: '
+              f'{min(len(runs), self.keep_runs)} kept, the {self.keep_compressed} older compressed, the rest summarized')
+        for position, run_path in enumerate(runs):
+            level = self.level(position)
+            done = self.load_json(run_path / COMPACTION_JSON).get("level", LEVEL_FULL)
+            if level == LEVEL_FULL or done == LEVEL_SUMMARY or done == level:
+                continue
+            size = folder_size(run_path)
+            failing = self.failing_tests(run_path)
+            if done != LEVEL_COMPRESSED:
+                self.compress(run_path, failing)
+            if level == LEVEL_SUMMARY:
+                self.summarize(run_path, failing)
+            self.save_json(run_path / COMPACTION_JSON, {"level": level, "date": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                                                        "failing": sorted(failing)})
+            print(f'\t{run_path.name}: {level}, {Fore.BLUE}{size / 1024 ** 2:.1f}{Style.RESET_ALL} MB -> '
+                  f'{Fore.BLUE}{folder_size(run_path) / 1024 ** 2:.1f}{Style.RESET_ALL} MB, {len(failing)} failing tests kept')
+        store = ArtifactStore(self.results_path / ARTIFACT_STORE_NAME)
+        if store.objects_path.exists():
+            print(f'\tRemoved {Fore.BLUE}{store.collect_garbage(start, self.released)}{Style.RESET_ALL} unreferenced stored objects')
+
+    def load_json(self, file: Path) -> dict:
+        if not file.exists():
+            return {}
+        try:
+            with open(file, 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError) as err:
+            print_error(f"Could not read {file} [{repr(err)}]")
+            return {}
+
+    def save_json(self, file: Path, data) -> None:
+        try:
+            with open(file, 'w') as f:
+                json.dump(data, f, indent=2)
+        except IOError as io_err:
+            print_error(f"Could not save {file} [{repr(io_err)}]")
+
+    def execution_logs(self, run_path: Path) -> List[Path]:
+        return sorted([file for file in run_path.glob('*.json') if EXECUTION_LOG_PATTERN.match(file.name)],
+                      key=lambda file: file.stat().st_mtime)
+
+    def analysis(self, run_path: Path) -> dict:
+        logs = sorted([file for file in run_path.glob('*.json') if ANALYSIS_LOG_PATTERN.match(file.name)],
+                      key=lambda file: file.stat().st_mtime)
+        return self.load_json(logs[-1]) if logs else {}
+
+    # the failed renders and the tests with an image over its treshold
+    def failing_tests(self, run_path: Path) -> set:
+        failing = set()
+        tests = set()
+        for file in self.execution_logs(run_path):
+            info = self.load_json(file)
+            for status in ["success", "failed", "skipped"]:
+                tests.update(entry[0] for entry in info.get(status, []))
+            failing.update(entry[0] for entry in info.get("failed", []))
+        for file in run_path.glob('*.json'):
+            if 'MISMACH' in file.name.upper():
+                failing.update(test_of_image(name, list(tests)) for name in self.load_json(file))
+        return failing
+
+    def is_failing(self, file: Path, failing: set) -> bool:
+        return any(file.name == test or file.name.startswith(f'{test}.') for test in failing)
+
+    def artifact_files(self, run_path: Path, failing: set, folders: List[str] = ARTIFACT_FOLDERS) -> List[Path]:
+        files = []
+        for folder in folders:
+            if (run_path / folder).exists():
+                files += [file for file in (run_path / folder).rglob('*')
+                          if (file.is_file() or file.is_symlink()) and not self.is_failing(file, failing)]
+        return files
+
+    # the compressed files replace the links to the stored objects
+    def compress(self, run_path: Path, failing: set) -> None:
+        store = ArtifactStore.for_run(run_path)
+        artifacts = ArtifactManifest(run_path)
+        files = self.artifact_files(run_path, failing, COMPRESSED_FOLDERS)
+        shutil.rmtree(run_path / 'tmp', ignore_errors=True)
+        for file in files:
+            if file.suffix.lower() == '.html' and file.exists():
+                compressed = compress_log(file)
+                self.replace(run_path, store, artifacts, file, compressed, compressed)
+        images = [str(file) for file in files if file.suffix.lower() in ['.png', '.tif', '.tiff'] and file.exists()]
+        for image, temp in zip(images, self.recompress_images(images)):
+            if temp:
+                self.replace(run_path, store, artifacts, Path(image), Path(temp), Path(image))
+        artifacts.save()
+
+    # as many workers as the decoded images fit the memory budget
+    def recompress_images(self, images: List[str]) -> List[str]:
+        if not images:
+            return []
+        estimates = [estimate_recompress_memory(Path(image)) for image in images]
+        workers = workers_for_budget(estimates, self.memory_budget, os.cpu_count() or 1)
+        if workers == 1:
+            return [recompress_image(image) for image in images]
+        with Pool(workers) as pool:
+            return list(pool.imap(recompress_image, images))
+
+    def release(self, artifacts: ArtifactManifest, relative: str) -> None:
+        key = artifacts.entries.pop(relative, None)
+        if key:
+            self.released.add(key)
+
+    def replace(self, run_path: Path, store: ArtifactStore, artifacts: ArtifactManifest, file: Path, new_file: Path, destination: Path) -> None:
+        relative = Path(os.path.relpath(file, run_path)).as_posix()
+        stored = relative in artifacts.entries
+        self.release(artifacts, relative)
+        os.remove(file)
+        if stored:
+            artifacts.add(destination, store.store(new_file, destination, move=True))
+        elif new_file != destination:
+            os.replace(new_file, destination)
+
+    # keeps the metrics and the timings of the run in summary.json and removes the artifacts of the passing tests
+    def summarize(self, run_path: Path, failing: set) -> None:
+        tests = {}
+        program = None
+        for file in self.execution_logs(run_path):
+            program = EXECUTION_LOG_PATTERN.match(file.name).group(1)
+            info = self.load_json(file)
+            for status in ["success", "failed", "skipped"]:
+                for name, path, msg in info.get(status, []):
+                    tests[name] = {"status": status, "msg": msg, "duration": info.get("durations", {}).get(name)}
+        cache_states = load_cache_states(run_path)
+        for name, test in tests.items():
+            log = run_path / 'logs' / f'{name}{RESULT_SUFFIX}.html'
+            test["cache"] = cache_states.get(name, {}).get("state")
+            test["time"] = log_render_time(log, program) if program else None
+            test["performance"] = self.performance_information(log, program)
+        analysis = self.analysis(run_path)
+        self.save_json(run_path / SUMMARY_JSON, {"program": program, "tests": tests, "images": analysis})
+
+        artifacts = ArtifactManifest(run_path)
+        for file in self.artifact_files(run_path, failing):
+            self.release(artifacts, Path(os.path.relpath(file, run_path)).as_posix())
+            os.remove(file)
+        for folder in ARTIFACT_FOLDERS:
+            if not (run_path / folder).exists():
+                continue
+            for path in sorted((run_path / folder).rglob('*'), reverse=True) + [run_path / folder]:
+                if path.is_dir() and not path.is_symlink() and not any(path.iterdir()):
+                    path.rmdir()
+        artifacts.save()
+
+    # what the performance analysis reads from the log
+    def performance_information(self, log: Path, program: str) -> list:
+        if program is None or find_log(log) is None:
+            return None
+        try:
+            data = read_html(log)
+        except IOError:
+            return None
+        if program == 'redshiftBenchmark':
+            return list(BenchmarkAnalysisItem(log, log, '').get_information(data))
+        return list(CmdLineAnalysisItem(log, log, '').get_information(data))
+
+
+def compact_results(params: ExecutionParameters) -> None:
+    ResultsCompactor(params.root_path / 'results', params.keep_runs, params.keep_compressed, params.memory_budget).compact()
@@ -0,0 +1,53 @@
+import statistics
+
+from .utils import *
+
+ORDER_LONGEST_FIRST = 'longest-first'
+ORDER_DECLARED = 'declared'
+
+
+'''
+Predicts the render duration of the manifest tests.
+The duration of the previous runs is used when available, otherwise the time is
+estimated from the scene file size with the seconds per byte ratio of the tests with history.
+'''
+def predict_durations(tests: list) -> List[Tuple[float, str]]:
+    ratios = [t['duration'] / t['scene_size'] for t in tests if t.get('duration') and t.get('scene_size')]
+    seconds_per_byte = statistics.median(ratios) if ratios else None
+
+    predictions = []
+    for t in tests:
+        if t.get('duration') is not None:
+            predictions.append((t['duration'], 'history'))
+        elif t.get('scene_size') is not None:
+            # without any history the size alone still gives the relative order
+            predictions.append((t['scene_size'] * seconds_per_byte if seconds_per_byte else float(t['scene_size']), 'size'))
+        else:
+            predictions.append((0.0, 'none'))
+    return predictions
+
+
+# stable sort - the tests with equal predictions keep the declaration order
+def order_tests(tests: list, order: str) -> Tuple[list, list]:
+    predictions = predict_durations(tests)
+    indices = list(range(len(tests)))
+    if order == ORDER_LONGEST_FIRST:
+        indices.sort(key=lambda i: predictions[i][0], reverse=True)
+    ordered = [tests[i] for i in indices]
+    schedule = [{'test_name': tests[i]['test_name'],
+                 'declared_index': i,
+                 'predicted_duration': predictions[i][0],
+                 'prediction': predictions[i][1]} for i in indices]
+    return ordered, schedule
+
+
+def print_schedule(schedule: list, order: str, count: int = 5) -> None:
+    moved = sum(1 for index, entry in enumerate(schedule) if entry['declared_index'] != index)
+    with_history = sum(1 for entry in schedule if entry['prediction'] == 'history')
+    print(f'{Fore.GREEN}Scheduling{Style.RESET_ALL} {len(schedule)} tests [{order}]: '
+          f'{Fore.BLUE}{moved}{Style.RESET_ALL} reordered, {with_history} predicted from history')
+    if order != ORDER_LONGEST_FIRST:
+        return
+    for entry in schedule[:count]:
+        duration = f"{entry['predicted_duration']:.1f}s" if entry['prediction'] == 'history' else entry['prediction']
+        print(f"\t{entry['test_name']} [{duration}] (declared #{entry['declared_index'] + 1})")
@@ -0,0 +1,186 @@
+import fnmatch
+import os
+
+from .utils import *
+
+DEPENDENCY_EXTENSIONS = ['png', 'jpg', 'jpeg', 'tif', 'tiff', 'tx', 'exr', 'hdr', 'tga', 'bmp',
+                         'rstexbin', 'vdb', 'rs', 'abc', 'ies', 'oso', 'osl']
+# the scenes are binary files, the external file paths are stored as plain strings
+DEPENDENCY_PATTERN = re.compile(rb'[\w\-./\\: ]{1,1024}\.(?:' + '|'.join(DEPENDENCY_EXTENSIONS).encode() + rb')(?![\w.])',
+                                re.IGNORECASE)
+ABSOLUTE_PATH_PATTERN = re.compile(r'([A-Za-z]:[\\/]|[\\/])')
+MAX_PREFIX_LENGTH = 8
+SCAN_CHUNK_SIZE = 16 * 1024 * 1024
+SCAN_CHUNK_OVERLAP = 1024
+
+
+def normalize_path(path: Path) -> str:
+    return os.path.normcase(os.path.normpath(str(path)))
+
+
+def parse_timestamp(value: str):
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return None
+
+
+def git_output(args: list, cwd: Path) -> List[str]:
+    process = Popen(['git', '-C', str(cwd)] + args, stdout=PIPE, stderr=PIPE, shell=False)
+    stdout, stderr = process.communicate()
+    if process.returncode != 0:
+        raise ValueError(f"git {' '.join(args)} failed: {stderr.decode(errors='ignore').strip()}")
+    return [line for line in stdout.decode(errors='ignore').splitlines() if line]
+
+
+'''
+Maps the scene files to the external files (textures, proxies, volumes...) they reference.
+Entries are cached in a json file and rescanned only when the scene size or mtime changes.
+'''
+class DependencyIndex:
+    def __init__(self, index_file: Path, search_paths: List[Path]):
+        self.index_file = index_file
+        self.search_paths = search_paths
+        self.entries = {}
+        self.modified = False
+        if self.index_file.exists():
+            try:
+                with open(self.index_file, 'r') as f:
+                    self.entries = json.load(f)
+            except (IOError, json.decoder.JSONDecodeError) as err:
+                print(f"{Fore.YELLOW}Warning:{Style.RESET_ALL} ignoring dependency index {self.index_file} [{repr(err)}]")
+
+    def dependencies(self, scene: Path) -> List[Path]:
+        key = normalize_path(scene)
+        stat = scene.stat()
+        entry = self.entries.get(key)
+        if entry is None or entry['mtime'] != stat.st_mtime or entry['size'] != stat.st_size:
+            entry = {'mtime': stat.st_mtime, 'size': stat.st_size, 'dependencies': self.scan(scene)}
+            self.entries[key] = entry
+            self.modified = True
+        return [Path(p) for p in entry['dependencies']]
+
+    def scan(self, scene: Path) -> List[str]:
+        candidates = set()
+        with open(scene, 'rb') as f:
+            tail = b''
+            while True:
+                chunk = f.read(SCAN_CHUNK_SIZE)
+                if not chunk:
+                    break
+                data = tail + chunk
+                for match in DEPENDENCY_PATTERN.finditer(data):
+                    candidates.add(match.group(0).decode(errors='ignore').strip())
+                tail = data[-SCAN_CHUNK_OVERLAP:]
+
+        dependencies = set()
+        for candidate in candidates:
+            path = self.resolve(scene, candidate)
+            if path and normalize_path(path) != normalize_path(scene):
+                dependencies.add(str(path))
+        return sorted(dependencies)
+
+    def resolve(self, scene: Path, candidate: str):
+        # strip the bytes glued in front of the path (string length prefix etc.)
+        match = ABSOLUTE_PATH_PATTERN.search(candidate)
+        names = [candidate[match.start():]] if match else []
+        names += [candidate[i:] for i in range(min(len(candidate), MAX_PREFIX_LENGTH))]
+        for name in names:
+            path = Path(name.replace('\\', '/'))
+            if path.is_absolute() and path.exists():
+                return path
+            for base in [scene.parent] + self.search_paths:
+                if (base / path).exists():
+                    return (base / path).resolve()
+        return None
+
+    def save(self) -> None:
+        if not self.modified:
+            return
+        try:
+            self.index_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.index_file, 'w') as f:
+                json.dump(self.entries, f, indent=2)
+        except IOError as io_err:
+            print_error(f"Could not save dependency index to {self.index_file} [{repr(io_err)}]")
+
+
+'''
+Decides if a file changed since a git revision or a timestamp
+'''
+class ChangeDetector:
+    def __init__(self, since: str, repository: Path):
+        self.since = since
+        self.timestamp = parse_timestamp(since)
+        self.changed_files = set()
+        if self.timestamp is None:
+            top_level = Path(git_output(['rev-parse', '--show-toplevel'], repository)[0])
+            changed = git_output(['diff', '--name-only', since, '--'], top_level)
+            changed += git_output(['ls-files', '--others', '--exclude-standard'], top_level)
+            self.changed_files = {normalize_path((top_level / f).resolve()) for f in changed}
+
+    def is_changed(self, path: Path) -> bool:
+        if self.timestamp is not None:
+            return path.exists() and path.stat().st_mtime > self.timestamp
+        return normalize_path(path.resolve()) in self.changed_files
+
+
+class TestSelector:
+    def __init__(self, params: ExecutionParameters):
+        self.params = params
+        self.scenes_root = params.root_path / 'scenes'
+
+    def select(self, tests: list) -> list:
+        selected = [t for t in tests if self.matches_name(t) and self.matches_tags(t)]
+        if self.params.changed_since:
+            selected = self.select_changed(selected)
+        if len(selected) != len(tests):
+            print(f'{Fore.GREEN}Selected{Style.RESET_ALL} {Fore.BLUE}{len(selected)}{Style.RESET_ALL}/{len(tests)} tests')
+        return selected
+
+    def matches_name(self, test: dict) -> bool:
+        if not self.params.filters:
+            return True
+        name = test['test_name']
+        for pattern in self.params.filters:
+            if pattern.startswith('re:'):
+                if re.search(pattern[3:], name):
+                    return True
+            elif fnmatch.fnmatch(name, pattern):
+                return True
+        return False
+
+    def matches_tags(self, test: dict) -> bool:
+        tags = test.get('tags', [])
+        if any(tag in tags for tag in self.params.exclude_tags):
+            return False
+        if self.params.tags:
+            return any(tag in tags for tag in self.params.tags)
+        return True
+
+    # keeps the tests which scene or any of the scene dependencies changed
+    def select_changed(self, tests: list) -> list:
+        try:
+            detector = ChangeDetector(self.params.changed_since, self.scenes_root)
+        except (ValueError, IndexError, OSError) as err:
+            print_error(f"Could not collect the changes since {self.params.changed_since} [{repr(err)}]")
+            exit(EXIT_FAILURE)
+
+        search_paths = [self.scenes_root, Path(self.params.user_config['required']['redshift_project_root'])]
+        index = DependencyIndex(self.params.root_path / 'cache' / 'dependency_index.json', search_paths)
+        selected = []
+        for test in tests:
+            scene = self.scenes_root / Path(test['path_to_scene'])
+            # missing scenes are reported by the task
+            if not scene.exists() or detector.is_changed(scene):
+                selected.append(test)
+                continue
+            if any(detector.is_changed(dependency) for dependency in index.dependencies(scene)):
+                selected.append(test)
+        index.save()
+        print(f'{Fore.GREEN}Impacted by changes since {self.params.changed_since}{Style.RESET_ALL}: {Fore.BLUE}{len(selected)}{Style.RESET_ALL}/{len(tests)} tests')
+        return selected
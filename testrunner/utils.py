@@ -1,5 +1,7 @@
 import argparse
+import gzip
 import json
+import os
 import platform
 import pprint as pprint
 import re as re
@@ -12,9 +14,30 @@ from typing import List, Tuple
 
 from colorama import Fore, Style
 
+# optional - the logs of the compacted runs are compressed with zstd when it is installed, with gzip otherwise
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 EXIT_SUCCESS = 0
 EXIT_FAILURE = -1
 
+# extensions of the images written by the renderer for the -oif output format
+OUTPUT_FORMAT_EXTENSIONS = {
+    'png': ['.png'],
+    'exr': ['.exr'],
+    'tif': ['.tif', '.tiff']
+}
+IMAGE_EXTENSIONS = [ext for extensions in OUTPUT_FORMAT_EXTENSIONS.values() for ext in extensions]
+# logs of the compacted runs: <name>.html.zst or <name>.html.gz
+COMPRESSED_LOG_SUFFIXES = ['.zst', '.gz']
+# metrics and timings of the summarized runs which artifacts were removed
+SUMMARY_JSON = 'summary.json'
+# redshift default UnifiedMaxSamples, assumed for the references when the render options do not set it.
+# The samples set in the scenes are not known to the runner
+REFERENCE_MAX_SAMPLES = 256
+
 def print_error(msg: str):
     print(f'{Fore.RED}ERROR: {msg}{Style.RESET_ALL}')
 
@@ -35,21 +58,6 @@ def get_os_tag() -> str:
         raise RuntimeError("{} is not supported".format(platform.system()))
 
 
-def process_test_files(test_json, tests_list) -> None:
-    try:
-        with open(test_json, 'r') as test_file:
-            conf = json.load(test_file)
-        tests = conf['tests']
-        for t in tests:
-            if 'include' in t:
-                process_test_files(Path(test_json).parent /
-                                   t['include'], tests_list)
-            else:
-                tests_list.append(t)
-    except IOError as e:
-        raise e
-
-
 def execute_process(params: list, user_env=None) -> int:
     params_str = [str(p) for p in params]
     process = Popen(params_str, env=user_env,
@@ -58,11 +66,22 @@ def execute_process(params: list, user_env=None) -> int:
     return process.returncode
 
 
-def get_latest_log_path() -> Path:
+# redshift keeps the logs, caches and preferences in REDSHIFT_LOCALDATAPATH
+def get_local_data_path(env=None) -> Path:
+    env = os.environ if env is None else env
+    if env.get('REDSHIFT_LOCALDATAPATH'):
+        return Path(env['REDSHIFT_LOCALDATAPATH'])
+    if get_os_tag() == "win":
+        return Path("C:\\ProgramData\\Redshift")
+    else:
+        return Path.home() / 'redshift'
+
+
+def get_latest_log_path(env=None) -> Path:
     if get_os_tag() == "win":
-        return Path("C:\\ProgramData\\Redshift\\Log\\Log.Latest.0")
+        return get_local_data_path(env) / 'Log' / 'Log.Latest.0'
     else:
-        return Path.home() / 'redshift/log/log.latest.0'
+        return get_local_data_path(env) / 'log' / 'log.latest.0'
 
 
 def analyze_latest_log(log_file: Path) -> Tuple[bool, str]:
@@ -81,13 +100,67 @@ def analyze_latest_log(log_file: Path) -> Tuple[bool, str]:
         return False, "Log not found"
 
 
+# "<option> <value>" lines of a render options file
+def read_render_options(file: Path) -> dict:
+    options = {}
+    if file.exists():
+        with open(file, 'r') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2:
+                    options[parts[0]] = parts[1]
+    return options
+
+
+# fraction of the reference samples (UnifiedMaxSamples of the reference options) the samples are, None when unknown
+def samples_ratio(samples, reference_options: Path) -> float:
+    if samples is None:
+        return None
+    try:
+        reference = float(read_render_options(reference_options).get("UnifiedMaxSamples", REFERENCE_MAX_SAMPLES))
+        return min(1.0, float(samples) / reference)
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
 def validate_path(path:Path):
     if not path.exists():
         msg = f'Path does not exists {path}'
         print_error(msg)
         raise IOError(msg)
     
+# the log or its compressed version left by the compaction of the results, None when there is none
+def find_log(file: Path) -> Path:
+    if file.exists():
+        return file
+    for suffix in COMPRESSED_LOG_SUFFIXES:
+        compressed = file.with_name(file.name + suffix)
+        if compressed.exists():
+            return compressed
+    return None
+
+
+def load_summary(run_path: Path) -> dict:
+    if not (run_path / SUMMARY_JSON).exists():
+        return {}
+    try:
+        with open(run_path / SUMMARY_JSON, 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError) as err:
+        print_error(f"Could not read {run_path / SUMMARY_JSON} [{repr(err)}]")
+        return {}
+
+
 def read_html(file: Path):
+    file = find_log(file) or file
+    if file.suffix == '.gz':
+        with gzip.open(file, 'rt') as f:
+            return f.read()
+    if file.suffix == '.zst':
+        if zstandard is None:
+            raise IOError(f'zstandard module is needed to read {file}')
+        with open(file, 'rb') as f:
+            return zstandard.ZstdDecompressor().stream_reader(f).read().decode()
     with open(file, 'r') as f:
         content = f.read()
     return content
@@ -98,6 +171,18 @@ def date_time_with_prefix(prefix:str, ext:str="json", format:str='%Y-%m-%d_%H%M%
     else:
         return datetime.now().strftime(f'{prefix}_%Y-%m-%d_%H%M%S.{ext}')
 
+# date named run folder, runs started in the same second get a numbered suffix
+def create_run_folder(parent: Path) -> Path:
+    parent.mkdir(parents=True, exist_ok=True)
+    name = date_time_with_prefix("")
+    folder, index = parent / name, 1
+    while True:
+        try:
+            folder.mkdir()
+            return folder
+        except FileExistsError:
+            folder, index = parent / f'{name}_{index}', index + 1
+
 def convert_to_seconds(time_string:str, time_format="%Hh:%Mm:%Ss"):
     time_object = datetime.strptime(time_string, time_format)
     total_seconds = timedelta(hours=time_object.hour, minutes=time_object.minute, seconds=time_object.second).total_seconds()
@@ -112,19 +197,6 @@ def split_to_gpus(val:str, prefix= "-gpu", sep:str=",") -> List[str]:
     return items
     
 
-def load_test_files(tests: list) -> list:
-    print(f'{Fore.GREEN}Processing files from{Style.RESET_ALL}: {tests}:', end= ' ')
-    scene_files = []
-    try:
-        for json_test in tests:
-            process_test_files(json_test, scene_files)
-    except IOError as io_err:
-        print_error(repr(io_err))
-        exit(EXIT_FAILURE)
-    print(f'{Fore.BLUE}{len(scene_files)}{Style.RESET_ALL} tests were found')
-    return scene_files
-
-
 @dataclass(init=False, eq=False, order=False, repr=True)
 class ExecutionParameters:
 
@@ -138,6 +210,38 @@ class ExecutionParameters:
     gpu: List[str]
     program: str
     test: str
+    filters: List[str]
+    tags: List[str]
+    exclude_tags: List[str]
+    changed_since: str
+    order: str
+    smoke: int
+    max_failure_streak: int
+    on_failure_streak: str
+    canary_count: int
+    output_format: str
+    calibrate: int
+    fast: bool
+    fast_ratio: float
+    sample_ratio: float
+    noise_sigma: float
+    progressive: bool
+    divergence_factor: float
+    resume: Path
+    daemon: bool
+    daemon_submit: bool
+    daemon_port: int
+    environment: dict
+    memory_budget: float
+    ab: List[Path]
+    ab_cycles: int
+    gpu_sweep: List[str]
+    cache_policy: str
+    prewarm: bool
+    report: bool
+    compact_results: bool
+    keep_runs: int
+    keep_compressed: int
 
     def __init__(self, args):
         self.reference = args.reference
@@ -149,7 +253,41 @@ class ExecutionParameters:
         self.root_path = Path("./").resolve()
         self.performance_analysis = args.performance_analysis
         self.image_analysis = args.image_analysis
-        self.analysis_path = Path(str(args.analysis_path))
+        self.analysis_path = Path(args.analysis_path) if args.analysis_path else None
+        self.filters = args.filter or []
+        self.tags = [tag.lower() for tag in args.tag or []]
+        self.exclude_tags = [tag.lower() for tag in args.exclude_tag or []]
+        self.changed_since = args.changed_since
+        self.order = args.order
+        self.smoke = args.smoke
+        self.max_failure_streak = args.max_failure_streak
+        self.on_failure_streak = args.on_failure_streak
+        self.canary_count = args.canary_count
+        self.output_format = args.output_format
+        self.calibrate = args.calibrate
+        self.fast = args.fast
+        self.fast_ratio = args.fast_ratio
+        # fraction of the reference samples of the renders, scales the noise thresholds
+        self.sample_ratio = 1.0
+        self.noise_sigma = args.noise_sigma
+        self.progressive = args.progressive
+        self.divergence_factor = args.divergence_factor
+        self.resume = Path(args.resume).resolve() if args.resume else None
+        self.daemon = args.daemon
+        self.daemon_submit = args.daemon_submit
+        self.daemon_port = args.daemon_port
+        # environment overrides of the rendering processes
+        self.environment = {}
+        self.memory_budget = args.memory_budget
+        self.ab = [Path(executable).resolve() for executable in args.ab] if args.ab else None
+        self.ab_cycles = args.ab_cycles
+        self.gpu_sweep = args.gpu_sweep
+        self.cache_policy = args.cache_policy
+        self.prewarm = args.prewarm
+        self.report = args.report
+        self.compact_results = args.compact_results
+        self.keep_runs = args.keep_runs
+        self.keep_compressed = args.keep_compressed
 
         try:
             with open(args.config, 'r') as cfg:
@@ -187,6 +325,60 @@ class ExecutionParameters:
         if not 'redshift_project_root' in self.user_config['required']:
             return False, "'redshift_project_root' is missing in user config"
 
+        if self.program == 'redshiftBenchmark' and self.output_format != 'png':
+            return False, "redshiftBenchmark writes only png images, use --output-format png"
+        if self.calibrate and not self.reference:
+            return False, "--calibrate is used with --reference"
+        if self.fast_ratio is not None and not self.fast:
+            return False, "--fast-ratio is used with --fast"
+        if self.fast:
+            if self.program != 'redshiftCmdLine' or self.reference:
+                return False, "--fast is supported by redshiftCmdLine tests only"
+            if not Path(self.get_render_options()).exists():
+                return False, f"Render options for --fast do not exist {self.get_render_options()}"
+            fast_samples = read_render_options(Path(self.get_render_options())).get("UnifiedMaxSamples")
+            derived = samples_ratio(fast_samples, Path('options.txt'))
+            if self.fast_ratio is not None:
+                if not 0.0 < self.fast_ratio <= 1.0:
+                    return False, "--fast-ratio must be in (0, 1]"
+                if derived is not None and abs(derived - self.fast_ratio) > 0.01 * derived:
+                    print(f"{Fore.YELLOW}Warning:{Style.RESET_ALL} --fast-ratio {self.fast_ratio} does not match "
+                          f"the {derived:.4f} of UnifiedMaxSamples in {self.get_render_options()} and options.txt")
+                self.sample_ratio = self.fast_ratio
+            elif derived is None:
+                return False, f"UnifiedMaxSamples is not set in {self.get_render_options()}, give the sample ratio with --fast-ratio"
+            else:
+                self.sample_ratio = derived
+        if self.progressive and (self.program != 'redshiftCmdLine' or self.reference or self.fast):
+            return False, "--progressive is supported by redshiftCmdLine tests without --fast only"
+        if self.memory_budget is not None and self.memory_budget <= 0:
+            return False, "--memory-budget must be positive"
+        if self.ab:
+            if self.program not in ['redshiftCmdLine', 'redshiftBenchmark'] or self.reference or self.progressive:
+                return False, "--ab compares redshiftCmdLine or redshiftBenchmark builds without --reference and --progressive"
+            for executable in self.ab:
+                if not executable.exists():
+                    return False, f"--ab: Path to the build does not exists {executable}"
+            if self.ab_cycles < 1:
+                return False, "--ab-cycles must be at least 1"
+        if self.gpu_sweep is not None:
+            if self.program not in ['redshiftCmdLine', 'redshiftBenchmark'] or self.reference or self.progressive or self.ab:
+                return False, "--gpu-sweep measures redshiftCmdLine or redshiftBenchmark tests without --reference, --progressive and --ab"
+            if not self.gpu_sweep and not self.gpu:
+                return False, "--gpu-sweep without device sets sweeps the devices given by --gpu"
+        if (self.performance_analysis or self.image_analysis) and self.analysis_path is None:
+            return False, "--performance-analysis and --image-analysis need the results given by --analysis-path"
+        if self.compact_results and (self.keep_runs < 0 or self.keep_compressed < 0):
+            return False, "--keep-runs and --keep-compressed can't be negative"
+        if self.prewarm and self.cache_policy == 'cold':
+            return False, "--prewarm can't be used with --cache-policy cold, the cache is emptied before every render"
+        if self.resume:
+            if not self.resume.is_dir():
+                return False, f"Results folder to resume does not exists {self.resume}"
+            # the references are always generated into the same folder
+            if self.reference and self.resume != self.root_path / 'references' / self.program:
+                return False, f"--reference can resume only {self.root_path / 'references' / self.program}"
+
         # paths
         p = Path(self.config['required']['redshiftCmdLine'])
         if not p.exists():
@@ -203,6 +395,12 @@ class ExecutionParameters:
 
         return True, None
 
+    # render options override file, the reduced samples one for --fast
+    def get_render_options(self) -> str:
+        if self.fast:
+            return self.config.get('optional', {}).get('fast_options', 'options_fast.txt')
+        return 'options.txt'
+
     def get_executable(self) -> Path:
         kind = self.program
         if kind == 'redshiftBenchmark':
@@ -217,7 +415,7 @@ class ExecutionParameters:
             return Path()
 
 
-def parse_command_line_args() -> ExecutionParameters:
+def parse_command_line_args(argv: List[str] = None) -> ExecutionParameters:
     class ExtendAction(argparse.Action):
         def __call__(self, parser, namespace, values, option_string=None):
             items = getattr(namespace, self.dest) or []
@@ -237,12 +435,44 @@ def parse_command_line_args() -> ExecutionParameters:
     parser.add_argument('--gpu', nargs='+', required=False, action='extend', help='GPU to execute the program. For multi-GPU separete with comma --gpu 1,2,3')
     parser.add_argument("--treshold", type=float, default=0.95, help="Mean Square Root [mse] value above which the image is considered incorrect")
     parser.add_argument("--program", choices=['redshiftCmdLine',
-                        'redshiftBenchmark', 'maya'], required=True, help='Choose program to execute the tests')
+                        'redshiftBenchmark', 'maya'], help='Choose program to execute the tests')
     parser.add_argument("--performance-analysis", action="store_true", help="Extract the performance results from the --analysis_path")
     parser.add_argument("--image-analysis", action="store_true", help="Run the image analysis task on the results from --analysis_path")
     parser.add_argument("--analysis-path", type=str, help="Path to the results for analysis")
-
-    args = parser.parse_args()
+    parser.add_argument("--filter", action='append', help='Run only tests which name matches the glob pattern. Use "re:" prefix for a regular expression')
+    parser.add_argument("--tag", action='append', help='Run only tests marked with the tag (any of the given tags)')
+    parser.add_argument("--exclude-tag", action='append', help='Skip tests marked with the tag')
+    parser.add_argument("--changed-since", type=str, help='Run only tests which scene or its dependencies changed since the git revision or timestamp (YYYY-MM-DD[ HH:MM:SS])')
+    parser.add_argument("--order", choices=['longest-first', 'declared'], default='longest-first', help='Order of the tests: longest predicted render time first or the order from the test files')
+    parser.add_argument("--smoke", type=int, default=0, help='Render N fastest tests first and stop if any of them fails')
+    parser.add_argument("--max-failure-streak", type=int, default=0, help='Stop after N consecutive failures with the same error (0 - disabled)')
+    parser.add_argument("--on-failure-streak", choices=['abort', 'canary'], default='abort', help='What to do when --max-failure-streak is reached: abort or render only the canary tests')
+    parser.add_argument("--canary-count", type=int, default=5, help='Number of the fastest tests rendered by --on-failure-streak canary')
+    parser.add_argument("--output-format", choices=list(OUTPUT_FORMAT_EXTENSIONS.keys()), default='png', help='Image format written by redshiftCmdLine: png, exr (half float, compared in linear float) or uncompressed tif')
+    parser.add_argument("--calibrate", type=int, default=0, help='With --reference render every reference N more times to measure its noise')
+    parser.add_argument("--fast", action='store_true', help='Render with the reduced samples render options, the noise thresholds are scaled by the fraction of the reference samples they give (UnifiedMaxSamples of the fast options over options.txt)')
+    parser.add_argument("--fast-ratio", type=float, help='Fraction of the reference samples of the --fast options when it can not be read from the options')
+    parser.add_argument("--noise-sigma", type=float, default=3.0, help='Number of standard deviations of the reference noise accepted by the calibrated thresholds')
+    parser.add_argument("--progressive", action='store_true', help='Render the tests in passes with growing samples and stop when the result clearly converged or diverged')
+    parser.add_argument("--divergence-factor", type=float, default=4.0, help='Progressive pass with mse above the factor times its noise treshold is a failure')
+    parser.add_argument("--resume", type=str, help='Continue the interrupted run in the results folder, the tests completed there are not rendered again')
+    parser.add_argument("--daemon", action='store_true', help='Start the resident test daemon serving the jobs submitted with --daemon-submit')
+    parser.add_argument("--daemon-submit", action='store_true', help='Run the command on the test daemon and stream its progress')
+    parser.add_argument("--daemon-port", type=int, default=8765, help='Local port of the test daemon')
+    parser.add_argument("--memory-budget", type=float, help='Memory in GB the image analysis, report and compaction workers may use together (default: 80%% of the available memory)')
+    parser.add_argument("--ab", nargs=2, metavar=('BASELINE', 'CANDIDATE'), help='Compare two builds of the program: render every test with both executables interleaved in ABBA order')
+    parser.add_argument("--ab-cycles", type=int, default=2, help='Number of ABBA cycles rendered by --ab for every test')
+    parser.add_argument("--gpu-sweep", nargs='*', metavar='GPUS', help='Render every test with each device set (e.g. 0 0,1 0,1,2,3) and report the multi-GPU scaling. Without values sweeps 1..N devices of --gpu')
+    parser.add_argument("--cache-policy", choices=['default', 'isolated', 'shared', 'cold'], default='default', help='Texture and shader cache of the renders: default (redshift preferences), isolated (per run), shared (kept between the runs) or cold (emptied before every render)')
+    parser.add_argument("--prewarm", action='store_true', help='Render every test once before the measured render to warm the cache, the pre-warm render gives the cold start time')
+    parser.add_argument("--report", action='store_true', help='Write the html review report (report/index.html) of the --analysis-path results, or of the test run after its analysis')
+    parser.add_argument("--compact-results", action='store_true', help='Compact the results folder: keep the --keep-runs newest runs, compress the logs and images of the --keep-compressed older ones and keep only summary.json of the rest. The artifacts of the failing tests are always kept')
+    parser.add_argument("--keep-runs", type=int, default=5, help='Number of the newest runs --compact-results keeps as they are')
+    parser.add_argument("--keep-compressed", type=int, default=20, help='Number of the runs after --keep-runs which --compact-results compresses, the older ones are summarized')
+
+    args = parser.parse_args(argv)
+    if not args.program and not args.daemon and not args.compact_results:
+        parser.error("the following arguments are required: --program")
     parameters = ExecutionParameters(args)
     return parameters
 
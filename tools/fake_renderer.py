@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+'''
+Stand-in for redshiftCmdLine and redshiftBenchmark to exercise the test runner without a GPU.
+Point "redshiftCmdLine" or "redshiftBenchmark" in the config to this script (or a wrapper on Windows).
+
+The render time follows Amdahl's law over the -gpu devices:
+    time = FAKE_RENDER_SECONDS * ((1 - FAKE_RENDER_PARALLEL) + FAKE_RENDER_PARALLEL / devices)
+It writes a log with the lines the performance analysis parses into the redshift log folder
+(REDSHIFT_LOCALDATAPATH) and a gray image per scene, the same for every run of the scene.
+A scene missing in the cache folder (REDSHIFT_CACHEPATH) renders longer and is added to the cache.
+
+    FAKE_RENDER_SECONDS   render time on one device (default 1.0)
+    FAKE_RENDER_PARALLEL  parallel fraction of the render (default 0.9)
+    FAKE_RENDER_NOISE     relative random variation of the time (default 0.02)
+    FAKE_RENDER_FAIL      scenes which name contains the text fail with an assert in the log
+    FAKE_CACHE_SECONDS    extra time of the render with a cold cache (default 0.5)
+'''
+import hashlib
+import os
+
+# opencv writes exr only when enabled before its import
+os.environ.setdefault('OPENCV_IO_ENABLE_OPENEXR', '1')
+import platform
+import random
+import sys
+import time
+from pathlib import Path
+
+import cv2 as cv
+import numpy as np
+
+IMAGE_SIZE = (64, 64)
+DISPLAY_GAMMA = 2.2
+
+
+def local_data_path() -> Path:
+    if os.environ.get('REDSHIFT_LOCALDATAPATH'):
+        return Path(os.environ['REDSHIFT_LOCALDATAPATH'])
+    if platform.system() == 'Windows':
+        return Path('C:\\ProgramData\\Redshift')
+    return Path.home() / 'redshift'
+
+
+def log_folder() -> Path:
+    if platform.system() == 'Windows':
+        return local_data_path() / 'Log' / 'Log.Latest.0'
+    return local_data_path() / 'log' / 'log.latest.0'
+
+
+def option_values(args: list, option: str) -> list:
+    return [args[i + 1] for i, arg in enumerate(args[:-1]) if arg == option]
+
+
+def scene_image(scene: Path) -> np.ndarray:
+    value = hashlib.sha1(scene.name.encode('utf-8')).digest()[0]
+    return np.full((IMAGE_SIZE[1], IMAGE_SIZE[0], 3), value, np.uint8)
+
+
+# exr holds linear float data in 0-1, png and tif the 8-bit display values
+def write_image(file: Path, image: np.ndarray) -> None:
+    if file.suffix.lower() == '.exr':
+        image = ((image.astype(np.float32) / 255.0) ** DISPLAY_GAMMA).astype(np.float32)
+    try:
+        written = cv.imwrite(str(file), image)
+    except cv.error as err:
+        raise IOError(f'Could not write {file}, the opencv build may lack the {file.suffix} codec [{err}]')
+    if not written:
+        raise IOError(f'Could not write {file}')
+
+
+# the scenes not in the cache load their textures and compile their shaders first
+def cache_miss(scenes: list) -> bool:
+    if not os.environ.get('REDSHIFT_CACHEPATH'):
+        return False
+    cache = Path(os.environ['REDSHIFT_CACHEPATH'])
+    cache.mkdir(parents=True, exist_ok=True)
+    missing = [scene for scene in scenes if not (cache / f'{scene.name}.cache').exists()]
+    for scene in missing:
+        (cache / f'{scene.name}.cache').touch()
+    return bool(missing)
+
+
+def format_clock(seconds: float) -> str:
+    seconds = int(round(seconds))
+    return f'{seconds // 3600:02d}h:{seconds // 60 % 60:02d}m:{seconds % 60:02d}s'
+
+
+def main(args: list) -> int:
+    benchmark = '-oip' not in args
+    scenes = [Path(arg) for arg in args if arg.lower().endswith('.rs')]
+    devices = option_values(args, '-gpu') or ['0']
+
+    seconds = float(os.environ.get('FAKE_RENDER_SECONDS', '1.0'))
+    parallel = float(os.environ.get('FAKE_RENDER_PARALLEL', '0.9'))
+    noise = float(os.environ.get('FAKE_RENDER_NOISE', '0.02'))
+    render_time = seconds * ((1.0 - parallel) + parallel / len(devices)) * random.uniform(1.0 - noise, 1.0 + noise)
+    fail = os.environ.get('FAKE_RENDER_FAIL')
+    if cache_miss(scenes):
+        render_time += float(os.environ.get('FAKE_CACHE_SECONDS', '0.5'))
+
+    lines = [f'<div class="DETAILED line">Device {i + 1}/{len(devices)} : Fake GPU {device}</div>' for i, device in enumerate(devices)]
+    failed = [scene for scene in scenes if not scene.exists() or (fail and fail in scene.name)]
+    if failed:
+        lines.append(f'=\nASSERT FAILED: fake render of {failed[0].name}\n=')
+    else:
+        time.sleep(render_time * len(scenes))
+        lines.append(f'<div class="DEBUG line">Rendering blocks: {render_time:.2f}s</div>')
+        lines.append(f'<div class="INFO line"><b>Rendering time: {render_time * len(scenes):.3f}s ({len(devices)} GPU(s) used)</b></div>')
+        lines.append(f'Rendering with: [{", ".join(f"Fake GPU {device}" for device in devices)}]')
+        lines.append(f'Time: {format_clock(render_time)}')
+
+    log = log_folder()
+    log.mkdir(parents=True, exist_ok=True)
+    with open(log / 'log.html', 'w') as f:
+        f.write('<html><body>\n' + '\n'.join(lines) + '\n</body></html>\n')
+    if failed:
+        return 1
+
+    if benchmark:
+        output = Path.cwd() / 'redshiftBenchmarkOutput.png' if platform.system() == 'Windows' else Path.home() / 'redshiftBenchmarkOutput.png'
+        write_image(output, scene_image(scenes[0]))
+        return 0
+    output_path = Path(option_values(args, '-oip')[0])
+    output_format = (option_values(args, '-oif') or ['png'])[0]
+    output_path.mkdir(parents=True, exist_ok=True)
+    for scene in scenes:
+        write_image(output_path / f'{scene.stem}.{output_format}', scene_image(scene))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))